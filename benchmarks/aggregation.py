@@ -0,0 +1,61 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 19:40:18
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 19:40:18
+# Copyright (c) FederalLab. All rights reserved.
+r'''
+Compares the flat buffer aggregation with the per tensor aggregation.
+
+Usage::
+
+    python benchmarks/aggregation.py --model resnet18 --clients 10
+'''
+import argparse
+import time
+
+import torch
+import torchvision
+
+import openfed.functional.agg as agg
+
+parser = argparse.ArgumentParser(description='Aggregation benchmark')
+parser.add_argument('--model', type=str, default='resnet18')
+parser.add_argument('--clients', type=int, default=10)
+parser.add_argument('--repeat', type=int, default=3)
+
+
+def timeit(func, repeat):
+    func()
+    tic = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - tic) / repeat * 1000
+
+
+def main():
+    args = parser.parse_args()
+    model = getattr(torchvision.models, args.model)()
+    params = list(model.state_dict(keep_vars=True).values())
+
+    def state(p):
+        return torch.randn_like(p.float()).to(p.dtype)
+
+    data_list = [{
+        p: dict(param=state(p), momentum_buffer=state(p))
+        for p in params
+    } for _ in range(args.clients)]
+    meta_list = [dict(instances=i + 1) for i in range(args.clients)]
+
+    print(f'{args.model}: {len(params)} tensors, {args.clients} clients')
+    for name, flat, loop in [
+        ('average', lambda: agg._flat_aggregate(data_list, dtype=torch.float),
+         lambda: agg._average_aggregate(data_list)),
+        ('naive', lambda: agg._weighted_flat_aggregate(data_list, meta_list),
+         lambda: agg._weighted_aggregate(data_list, meta_list)),
+    ]:
+        print(f'{name:>8}: flat {timeit(flat, args.repeat):.1f} ms, '
+              f'per tensor {timeit(loop, args.repeat):.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 23:58:40
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 23:58:40
+# Copyright (c) FederalLab. All rights reserved.
+r'''
+Compares the pairwise mask of :func:`openfed.functional.mask_package` with
+the encryption of :func:`openfed.functional.paillier_package`, on the time
+to protect one upload, the upload size and the time to aggregate all
+uploads.
+
+Usage::
+
+    python benchmarks/mask.py --model resnet18 --collaborators 4
+'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torchvision
+from torch.distributed import HashStore
+
+from openfed.federated import tensor_bytes
+from openfed.functional import (MaskAccumulator, PaillierAccumulator,
+                                PairwiseMask, key_gen)
+from openfed.functional.paillier import _encrypt_states
+
+parser = argparse.ArgumentParser(description='Secure aggregation benchmark')
+parser.add_argument('--model', type=str, default='resnet18')
+parser.add_argument('--collaborators', type=int, default=4)
+parser.add_argument('--n_lwe', type=int, default=3000)
+
+
+def main():
+    args = parser.parse_args()
+    model = getattr(torchvision.models, args.model)()
+    params = [p.detach() for p in model.parameters()]
+    size = sum(p.numel() for p in params) * 4 / 1024**2
+    print(f'{args.model}: {len(params)} tensors, {size:.1f} MB, '
+          f'{args.collaborators} collaborators')
+
+    ranks = list(range(1, args.collaborators + 1))
+    store = HashStore()
+    with ThreadPoolExecutor(len(ranks)) as executor:
+        masks = list(
+            executor.map(lambda rank: PairwiseMask(store, rank, ranks), ranks))
+        # Agree on the secrets of the round, which is not timed.
+        list(executor.map(lambda m: m.prepare(0), masks))
+
+    def mask(rank):
+        data = dict()
+        for index, p in enumerate(params):
+            data[p] = dict(
+                param_masked=masks[rank].mask(p, 0, (index, 'param')),
+                mask_info=[ranks[rank], ranks, 0, index])
+        return data
+
+    public_key, private_key = key_gen(n_lwe=args.n_lwe, seed=0)
+
+    def encrypt(rank):
+        states = [dict(param=p) for p in params]
+        _encrypt_states(public_key, states)
+        return dict(zip(params, states))
+
+    for name, upload, accumulator in [
+        ('paillier', encrypt, PaillierAccumulator(private_key)),
+        ('mask', mask, MaskAccumulator(store)),
+    ]:
+        tic = time.time()
+        data_list = [upload(rank) for rank in range(len(ranks))]
+        upload_time = (time.time() - tic) / len(ranks)
+
+        unique = {
+            id(v): v
+            for state in data_list[0].values() for v in state.values()
+            if hasattr(v, 'numel')
+        }
+        upload_size = tensor_bytes(list(unique.values())) / 1024**2
+
+        tic = time.time()
+        for data in data_list:
+            accumulator.add(data)
+        accumulator.param_states()
+        agg_time = time.time() - tic
+        print(f'{name:>8}: upload {upload_time * 1000:.1f} ms, '
+              f'{upload_size:.1f} MB, aggregate {agg_time * 1000:.1f} ms')
+
+    for m in masks:
+        m.close()
+
+
+if __name__ == '__main__':
+    main()
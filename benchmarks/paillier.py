@@ -0,0 +1,112 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 20:55:31
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 20:55:31
+# Copyright (c) FederalLab. All rights reserved.
+r'''
+Compares the per tensor encryption with the batched encryption of
+:func:`openfed.functional.paillier_package`.
+
+Usage::
+
+    python benchmarks/paillier.py --model resnet18 --pack_bits 12
+    python benchmarks/paillier.py --model resnet18 --num_threads 4
+'''
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torchvision
+
+from openfed.federated import tensor_bytes
+from openfed.functional import NoisePool, key_gen
+from openfed.functional.paillier import _encrypt_states
+
+parser = argparse.ArgumentParser(description='Paillier benchmark')
+parser.add_argument('--model', type=str, default='resnet18')
+parser.add_argument('--n_lwe', type=int, default=3000)
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument(
+    '--pack_bits',
+    type=int,
+    default=0,
+    help='Also benchmark batched encryption with packed values.')
+parser.add_argument('--headroom', type=int, default=4)
+parser.add_argument('--num_threads', type=int, default=0)
+parser.add_argument('--chunk_size', type=int, default=2**20)
+
+
+def main():
+    args = parser.parse_args()
+    model = getattr(torchvision.models, args.model)()
+    params = [p for p in model.parameters()]
+    size = sum(p.numel() for p in params) * 4 / 1024**2
+    print(f'{args.model}: {len(params)} tensors, {size:.1f} MB')
+
+    public_key, _ = key_gen(n_lwe=args.n_lwe, seed=0)
+
+    def per_tensor():
+        states = [dict(param=p.detach()) for p in params]
+        for state in states:
+            _encrypt_states(public_key, [state])
+        return states
+
+    executor = ThreadPoolExecutor(
+        args.num_threads) if args.num_threads > 0 else None
+
+    def batched():
+        states = [dict(param=p.detach()) for p in params]
+        _encrypt_states(
+            public_key, states, chunk_size=args.chunk_size, executor=executor)
+        return states
+
+    pools = []
+
+    def pooled():
+        if not pools:
+            # one noise per tensor
+            pools.append(NoisePool(public_key, size=len(params)))
+        pool = pools[0]
+        # the pool is filled while waiting, e.g., training
+        while not pool.queue.full():
+            time.sleep(0.01)
+        states = [dict(param=p.detach()) for p in params]
+        tic = time.time()
+        for state in states:
+            _encrypt_states(public_key, [state], pool)
+        return states, time.time() - tic
+
+    def packed():
+        states = [dict(param=p.detach()) for p in params]
+        _encrypt_states(
+            public_key,
+            states,
+            pack_bits=args.pack_bits,
+            headroom=args.headroom)
+        return states
+
+    funcs = [('per tensor', per_tensor), ('batched', batched)]
+    if args.pack_bits > 0:
+        funcs.append(('batched packed', packed))
+    funcs.append(('per tensor pooled', pooled))
+    for name, func in funcs:
+        duration = 0.0
+        for _ in range(args.repeat):
+            tic = time.time()
+            states = func()
+            if isinstance(states, tuple):
+                states, elapsed = states
+            else:
+                elapsed = time.time() - tic
+            duration += elapsed / args.repeat
+
+        # shared c1 is only transferred once
+        unique = {id(v): v for s in states for v in s.values()}
+        cipher_size = tensor_bytes(list(unique.values())) / 1024**2
+        print(f'{name:>17}: {duration * 1000:.1f} ms, '
+              f'{size / duration:.1f} MB/s, ciphertext {cipher_size:.1f} MB')
+    pools[0].close()
+
+
+if __name__ == '__main__':
+    main()
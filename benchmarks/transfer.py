@@ -0,0 +1,92 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 11:02:47
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 11:02:47
+# Copyright (c) FederalLab. All rights reserved.
+r'''
+Compares the transfer modes of :class:`openfed.federated.Pipe`.
+
+Usage::
+
+    python benchmarks/transfer.py --params 100 --numel 1000000
+'''
+import argparse
+import os
+import resource
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+import openfed
+from openfed.federated import (FederatedProperties, aggregator, collaborator,
+                               init_federated_group)
+
+parser = argparse.ArgumentParser(description='Pipe transfer benchmark')
+parser.add_argument('--params', type=int, default=100)
+parser.add_argument('--numel', type=int, default=100000)
+parser.add_argument('--repeat', type=int, default=5)
+parser.add_argument(
+    '--modes', type=str, nargs='+', default=['object', 'tensor', 'stream'])
+parser.add_argument('--init_method', type=str, default='tcp://localhost:1996')
+
+
+def build_data(params, numel):
+    return {
+        f'layer_{i}': dict(param=torch.randn(numel))
+        for i in range(params)
+    }
+
+
+def worker(rank, args, mode, queue):
+    address = openfed.Address(
+        'gloo', args.init_method, world_size=2, rank=rank, transfer_mode=mode)
+    role = aggregator if rank == 0 else collaborator
+    fed_props = FederatedProperties(role, role, address)
+    pipe = init_federated_group(fed_props)[0]
+
+    data = build_data(args.params, args.numel) if rank == 1 else None
+    durations = []
+    with pipe.dist_props:
+        for _ in range(args.repeat):
+            tic = time.time()
+            if rank == 1:
+                pipe.push(data)
+            else:
+                received = pipe.pull()
+                assert len(received) == args.params
+                del received
+            durations.append(time.time() - tic)
+    if rank == 0:
+        # KB on linux
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put((sum(durations) / len(durations), max_rss / 1024))
+
+
+def main():
+    args = parser.parse_args()
+    size = args.params * args.numel * 4 / 1024**2
+    print(f'Payload: {args.params} tensors, {size:.1f} MB')
+    ctx = mp.get_context('spawn')
+    for mode in args.modes:
+        if args.init_method.startswith('file://'):
+            path = args.init_method[len('file://'):]
+            if os.path.isfile(path):
+                os.remove(path)
+        queue = ctx.SimpleQueue()
+        processes = [
+            ctx.Process(target=worker, args=(rank, args, mode, queue))
+            for rank in range(2)
+        ]
+        for p in processes:
+            p.start()
+        duration, max_rss = queue.get()
+        for p in processes:
+            p.join()
+        print(f'{mode:>8}: {duration * 1000:.1f} ms/transfer, '
+              f'{size / duration:.1f} MB/s, '
+              f'receiver peak rss {max_rss:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,23 @@ class Address(object):
         rank: Rank of current node (it should be a number between 0 and
             ``world_size``-1). If `-1` is provided, rank will be specified
             during runtime. Default: -1
+        transfer_mode: How :class:`Pipe` moves data between nodes. ``object``
+            pickles the whole data via ``gather_object``. ``tensor`` sends a
+            small header with names, dtypes and shapes, followed by the raw
+            tensor bytes via ``send``/``recv``, which avoids pickling tensors
+            and the extra copies it brings. ``stream`` uses the same format as
+            ``tensor``, but sends data in chunks of at most ``chunk_size``
+            bytes, so that only one chunk is alive at a time on both ends.
+            Default: ``'object'``
+        chunk_size: The chunk budget in bytes used by ``stream`` mode. The
+            tensors of a single parameter larger than it are sent in flat
+            slices. Default: ``2**26``
+        timeout: Seconds a collaborator waits for the aggregator to respond
+            before it treats the aggregator as offline. Default: ``1800``
+        backoff_min: The first interval in seconds between two checks while
+            waiting. It is doubled after each check. Default: ``0.001``
+        backoff_max: The maximum interval in seconds between two checks while
+            waiting. Default: ``1.0``
 
     Examples::
 
@@ -59,12 +76,22 @@ class Address(object):
     init_method: str
     world_size: int
     rank: int
+    transfer_mode: str
+    chunk_size: int
+    timeout: float
+    backoff_min: float
+    backoff_max: float
 
     def __init__(self,
                  backend: str = 'gloo',
                  init_method: str = 'tcp://localhost:1994',
                  world_size: int = 2,
-                 rank: int = -1):
+                 rank: int = -1,
+                 transfer_mode: str = 'object',
+                 chunk_size: int = 2**26,
+                 timeout: float = 1800.0,
+                 backoff_min: float = 0.001,
+                 backoff_max: float = 1.0):
         assert init_method.startswith('file://') or init_method.startswith(
             'tcp://') or init_method.startswith('null')
 
@@ -88,11 +115,20 @@ class Address(object):
         assert backend in ['gloo', 'mpi', 'nccl', 'null']
         assert 1 <= world_size
         assert -1 <= rank < world_size
+        assert transfer_mode in ['object', 'tensor', 'stream']
+        assert chunk_size > 0
+        assert timeout > 0
+        assert 0 < backoff_min <= backoff_max
 
         self.backend = backend
         self.init_method = init_method
         self.world_size = world_size
         self.rank = rank
+        self.transfer_mode = transfer_mode
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
 
     def __repr__(self):
         head = ['backend', 'init_method', 'world_size', 'rank']
@@ -112,6 +148,11 @@ class Address(object):
             init_method=self.init_method,
             world_size=self.world_size,
             rank=self.rank,
+            transfer_mode=self.transfer_mode,
+            chunk_size=self.chunk_size,
+            timeout=self.timeout,
+            backoff_min=self.backoff_min,
+            backoff_max=self.backoff_max,
         )
 
     @classmethod
@@ -3,12 +3,16 @@
 # @Last Modified by  : Chen Dengsheng
 # @Last Modified time: 2021-09-25 16:51:09
 # Copyright (c) FederalLab. All rights reserved.
+from .async_maintainer import AsyncMaintainer
 from .const import DefaultMaintainer
 from .functional import fed_context
 from .maintainer import Maintainer
+from .versions import VersionCache
 
 __all__ = [
     'fed_context',
     'DefaultMaintainer',
     'Maintainer',
+    'AsyncMaintainer',
+    'VersionCache',
 ]
@@ -0,0 +1,145 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-17 14:05:21
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-17 14:05:21
+# Copyright (c) FederalLab. All rights reserved.
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List, Optional
+
+from openfed.federated import Pipe, fetch_states, pull, push
+from openfed.functional.const import at_new_episode
+from .maintainer import Maintainer
+
+
+class AsyncMaintainer(object):
+    r'''The asyncio front end of :class:`Maintainer`. The blocking transfers
+    and store reads are run in executors, so that one event loop can drive
+    the maintainer along with other tasks.
+
+    Args:
+        maintainer: The maintainer to drive. Hooks are still registered on
+            it, and other attributes, such as :attr:`data_list`, are read
+            from it.
+        max_workers: If the maintainer of aggregator does not service pipes
+            on a thread pool, a pool of ``max_workers`` threads is assigned
+            to it, see :class:`Maintainer`. Default: ``4``
+        interval: The seconds between two polls of the pipes' states.
+            Default: ``0.01``
+
+    Example::
+
+        >>> amt = AsyncMaintainer(mt)
+        >>> # aggregator
+        >>> await amt.step()
+        >>> # collaborator
+        >>> await amt.step(upload=False)
+        >>> amt.package()
+        >>> await amt.step(download=False)
+    '''
+    maintainer: Maintainer
+
+    def __init__(self,
+                 maintainer: Maintainer,
+                 max_workers: int = 4,
+                 interval: float = 0.01):
+        if maintainer.aggregator and maintainer._executor is None:
+            assert max_workers > 0
+            maintainer.max_workers = max_workers
+            maintainer._executor = ThreadPoolExecutor(max_workers)
+        self.maintainer = maintainer
+        self.interval = interval
+
+    def __getattr__(self, name: str) -> Any:
+        if name == 'maintainer':
+            raise AttributeError(name)
+        return getattr(self.maintainer, name)
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        r'''Runs the blocking ``func`` in the default executor of the loop.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None,
+                                          partial(func, *args, **kwargs))
+
+    async def upload(self) -> bool:
+        r'''Uploads data to the other end, see :func:`Maintainer.upload`.
+        '''
+        if self.maintainer.collaborator:
+            return await asyncio.wrap_future(self.maintainer.upload_async())
+        else:
+            return await self._run(self.maintainer.upload)
+
+    async def download(self) -> bool:
+        r'''Downloads data from the other end, see
+        :func:`Maintainer.download`.
+        '''
+        if self.maintainer.collaborator:
+            return await asyncio.wrap_future(self.maintainer.download_async())
+        else:
+            return await self._run(self.maintainer.download)
+
+    async def step(self, *args, **kwargs) -> bool:
+        r'''Runs a step, see :func:`Maintainer.step`. Aggregator polls the
+        pipes and calls step hooks in the default executor of the loop, since
+        hooks may read the store, while the pipes are serviced on the thread
+        pool of the maintainer.
+        '''
+        if self.maintainer.collaborator:
+            return await asyncio.wrap_future(
+                self.maintainer.step_async(*args, **kwargs))
+        else:
+            return await self._aggregator_step()
+
+    async def ready(self, pipes: Optional[List[Pipe]] = None) -> List[Pipe]:
+        r'''Waits until any of ``pipes`` is pushing or pulling.
+
+        Args:
+            pipes: The pipes to wait. If ``None``, wait all the pipes of the
+                maintainer. Default: ``None``
+
+        Returns:
+            The pipes pushing or pulling.
+        '''
+        pipes = list(self.maintainer.pipes if pipes is None else pipes)
+        while True:
+            # One batched read for all pipes.
+            states = await self._run(fetch_states, pipes)
+            ready = [
+                pipe for pipe, state in zip(pipes, states)
+                if state in [push, pull]
+            ]
+            if ready:
+                return ready
+            await asyncio.sleep(self.interval)
+
+    def _episode(self):
+        r'''Runs an episode of the aggregator loop, see
+        :func:`Maintainer._aggregator_loop`.
+        '''
+        mt = self.maintainer
+        step = mt._step
+        step(at_new_episode)
+        mt._finish_jobs(step)
+        mt._service_pipes(step, fetch_states(mt.pipes))
+
+    async def _aggregator_step(self) -> bool:
+        mt = self.maintainer
+        mt.stopped = False
+
+        while not mt.stopped and len(mt.pipes) > 0:
+            await self._run(self._episode)
+
+            tic = time.time()
+            await asyncio.sleep(self.interval)
+            mt._stats['wait_time'] += time.time() - tic
+
+        # Jobs submitted before stopping are finished and recorded.
+        futures = [asyncio.wrap_future(f) for _, f in mt._jobs.values()]
+        if futures:
+            await asyncio.wait(futures)
+        await self._run(mt._finish_jobs, mt._step, True)
+
+        return True
@@ -10,6 +10,14 @@ from openfed.federated.exceptions import DeviceOffline
 
 def fed_context(func):
     r'''A decorator that can be used to provide federated communication context.
+    A :class:`DeviceOffline` raised by ``func`` is turned into a warning, and
+    ``False`` is returned.
+
+    .. note::
+        Pipes transfer data on their own process groups without the global
+        states of ``torch.distributed``, thus the distributed properties are
+        not entered, and transfers of different pipes can run on different
+        threads at the same time.
 
     .. warning::
 
@@ -18,18 +26,10 @@ def fed_context(func):
     '''
 
     def _fed_context(self, *args, **kwargs):
-
-        def safe_call(*args, **kwargs):
-            try:
-                return func(*args, **kwargs)
-            except DeviceOffline:
-                warnings.warn(f'Failed to call {func}')
-                return False
-
-        if self.pipe.dist_props.lock.locked():
-            return safe_call(self, *args, **kwargs)
-        else:
-            with self.pipe.dist_props:
-                return safe_call(self, *args, **kwargs)
+        try:
+            return func(self, *args, **kwargs)
+        except DeviceOffline:
+            warnings.warn(f'Failed to call {func}')
+            return False
 
     return _fed_context
@@ -4,16 +4,25 @@
 # @Last Modified time: 2021-09-25 16:51:38
 # Copyright (c) FederalLab. All rights reserved.
 import time
+import uuid
+import warnings
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from copy import deepcopy
 from queue import PriorityQueue
-from typing import Any, Callable, Dict, List, Optional, Union
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+import torch
 from torch import Tensor
 
 from openfed.common.meta import Meta
-from openfed.federated import (FederatedProperties, Pipe, init_federated_group,
-                               is_aggregator, is_collaborator)
+from openfed.federated import (FederatedProperties, InvalidUpload, Packed,
+                               Pipe, Serialized, fetch_states,
+                               init_federated_group, is_aggregator,
+                               is_collaborator, iter_chunks, not_modified,
+                               offline, openfed_generation, openfed_meta,
+                               prefetch, pull, push, zombie)
 from openfed.functional.const import (after_destroy, after_download,
                                       after_upload, at_failed, at_first,
                                       at_invalid_state, at_last,
@@ -23,6 +32,14 @@ from openfed.functional.const import (after_destroy, after_download,
 from openfed.utils import FMT, tablist
 from .const import DefaultMaintainer
 from .functional import fed_context
+from .versions import VersionCache
+
+
+def _ordered(hooks: PriorityQueue) -> List[Tuple[int, Callable]]:
+    r'''Returns the hooks sorted by ``nice``, as ``hooks.queue`` is in heap
+    order.
+    '''
+    return sorted(hooks.queue, key=lambda item: item[0])
 
 
 class Maintainer(object):
@@ -32,6 +49,29 @@ class Maintainer(object):
         fed_props: The federated group belongs to.
         state_dict: Indicates tensors exchanged. If not specified, you should
             load it via :func:``load_state_dict``. Default: ``None``
+        max_workers: If greater than ``0``, the aggregator services ready
+            pipes on a pool of ``max_workers`` threads, so that a slow
+            collaborator does not block the others. Step hooks are still
+            called in the main thread, and ``after_upload`` and
+            ``after_download`` are called once the transfer finished. Jobs
+            submitted before the loop stops are finished and recorded, thus a
+            few more models than expected may be received. Each pipe transfers
+            on its own process group, which needs no lock shared by the
+            workers. Default: ``0``
+        prefetch: If ``True``, in ``stream`` transfer mode, package hooks of
+            the next chunk are applied on a worker thread while the current
+            chunk is sent, e.g., to overlap encryption with sending. Two
+            chunks are alive at a time. Default: ``False``
+        versions: If given, aggregator keeps the global model it serves in
+            it, keyed by :attr:`generation` instead of :attr:`version`, as
+            the model may change within a version, e.g., the test round of
+            :class:`openfed.API`. See :class:`VersionCache`. Default: ``None``
+        conditional_download: If ``True``, collaborator states the
+            :attr:`generation` of the data it holds in
+            ``meta['held_generation']`` while downloading in :func:`step`, and
+            aggregator answers without sending data if the data it serves is
+            not changed since then. The held data is kept in :attr:`data`.
+            Default: ``False``
 
     Example::
 
@@ -46,6 +86,11 @@ class Maintainer(object):
         +------------------+-----------+-------+
         >>> with mt:
         >>>     ...
+
+        >>> # upload in background while training the next round
+        >>> future = mt.step_async(download=False)
+        >>> ...
+        >>> future.result()
     '''
     pipe: Pipe
     pipes: List[Pipe]
@@ -59,8 +104,16 @@ class Maintainer(object):
 
     def __init__(self,
                  fed_props: FederatedProperties,
-                 state_dict: Optional[Any] = None):
+                 state_dict: Optional[Any] = None,
+                 max_workers: int = 0,
+                 prefetch: bool = False,
+                 versions: Optional[VersionCache] = None,
+                 conditional_download: bool = False):
         self.fed_props = fed_props
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+        self.versions = versions
+        self.conditional_download = conditional_download
 
         # call while package
         self._package_hooks = PriorityQueue()
@@ -69,9 +122,14 @@ class Maintainer(object):
         self._step_hooks = defaultdict(PriorityQueue)
 
         self.version: int = 0
+        # The token of the served data, renewed whenever it may change.
+        self.generation: str = uuid.uuid4().hex
+        # The generation of the data downloaded by collaborator.
+        self.held_generation: Optional[str] = None
         self.stopped: bool = False
         self.received_numbers: int = 0
         self.last_aggregate_time: float = time.time()
+        self._stats: Dict[str, float] = defaultdict(float)
 
         self.meta: Meta = Meta()
         self.meta_list: List[Meta] = []
@@ -79,6 +137,8 @@ class Maintainer(object):
         # The data just received
         self.data: Dict[str, Dict[str, Any]] = defaultdict(dict)
         self.data_list: List[Dict[Tensor, Any]] = []
+        # If specified, received data is folded into it instead of data_list
+        self.accumulator: Optional[Any] = None
 
         # The data need to be sent
         self.packaged_data: Dict[str, Dict[str, Any]] = defaultdict(dict)
@@ -89,6 +149,20 @@ class Maintainer(object):
         # set an initialize pipe
         self.pipe: Pipe = None  # type: ignore
 
+        # Service pipes on worker threads if max_workers > 0.
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers) if max_workers > 0 else None
+        self._jobs: Dict[Pipe, Tuple[bool, Future]] = dict()
+        # Runs the asynchronous transfers of collaborator in order.
+        self._async_executor: Optional[ThreadPoolExecutor] = None
+        self._package_lock = Lock()
+        # Worker threads fold the received data into the accumulator.
+        self._accumulator_lock = Lock()
+        # The serialized packaged data, keyed by version and transfer mode.
+        self._serialized: Optional[Tuple[Any, Any]] = None
+        # Whether the packaged model is put into versions.
+        self._version_kept = False
+
         if self.fed_props:
             self.build_connection()
 
@@ -169,6 +243,31 @@ class Maintainer(object):
         '''
         self._unpackage_hooks.put((nice, unpackage_hook))
 
+    def register_accumulator(self, accumulator: Any):
+        r'''Register an accumulator.
+
+        Args:
+            accumulator: The accumulator, such as
+                :class:`openfed.functional.AverageAccumulator`. It should
+                provide ``add(data, meta)`` and ``clear()``.
+
+        .. note::
+            Once registered, the data downloaded by aggregator is folded into
+            the accumulator instead of being cached in :attr:`data_list`, and
+            :func:`clear` will clear the accumulator too. If ``add`` returns
+            ``False``, the data is discarded, and its meta is not kept in
+            :attr:`meta_list`.
+
+        .. note::
+            In ``stream`` transfer mode, each chunk is folded as soon as it
+            arrives, with the meta published by collaborator before pushing,
+            so that no whole model is kept per collaborator. The chunks folded
+            before a failed or discarded one are not rolled back, thus the
+            states of a parameter are averaged over the collaborators
+            reporting it.
+        '''
+        self.accumulator = accumulator
+
     def register_step_hook(self,
                            nice: int,
                            step_hook: Callable,
@@ -229,6 +328,7 @@ class Maintainer(object):
         else:
             self.version += 1
         self.meta['version'] = self.version
+        self._new_generation()
 
     def load_state_dict(self, state_dict: Dict[str, Tensor]):
         r'''Loads state dict to exchange with other end.
@@ -237,39 +337,206 @@ class Maintainer(object):
             state_dict: State dict to exchange with.
         '''
         self.state_dict.update(state_dict)
+        self._new_generation()
+
+    def _new_generation(self):
+        r'''Renews :attr:`generation`, as the data to serve may be changed.
+        Aggregator publishes it along with the data, and the cached
+        serialized data and the kept version are invalidated.
+        '''
+        self.generation = uuid.uuid4().hex
+        self._serialized = None
+        self._version_kept = False
 
     @fed_context
-    def transfer(self, to: bool) -> Union[Any, None]:
+    def transfer(self,
+                 to: bool,
+                 callback: Optional[Callable] = None,
+                 pipe: Optional[Pipe] = None,
+                 data: Optional[Any] = None) -> Union[Any, None]:
         r'''Transfer data to another end.
 
         Args:
             to: If ``True``, upload the data to the other end. If ``False``,
                 download data from the other end.
+            callback: Only used by ``stream`` transfer mode while downloading.
+                Each received chunk is handed to it as soon as it arrives.
+            pipe: The pipe to transfer data with. If ``None``, use current
+                pipe. Default: ``None``
+            data: The data to upload. If ``None``, upload the packaged data.
+                Default: ``None``
 
         Returns:
             If download was successful, return the downloaded data.
         '''
+        pipe = pipe or self.pipe
         if to:
-            self.pipe.upload(self.packaged_data)
+            if data is not None:
+                pipe.upload(data)
+            elif pipe.transfer_mode == 'stream':
+                pipe.upload(self._package_chunks(pipe))
+            else:
+                pipe.upload(self.packaged_data)
         else:
-            return self.pipe.download()
+            return pipe.download(callback)
+
+    def _package_chunks(self, pipe: Pipe):
+        r'''Yields packaged data chunk by chunk for ``stream`` transfer mode.
+        Package hooks are applied to a shallow copy of each parameter's data
+        right before it is sent, so that only one chunk of transformed data is
+        alive at a time, or two if :attr:`prefetch`. Collaborator sends its
+        meta as the last item, and aggregator sends its :attr:`generation`.
+        '''
+        # Hooks may run on the prefetching thread, where grad mode is reset.
+        grad_enabled = torch.is_grad_enabled()
 
-    def download(self) -> bool:
-        r'''Downloads data from the other end.
+        def items():
+            for n, p in self.state_dict.items():
+                with torch.set_grad_enabled(grad_enabled):
+                    data = self._apply_package_hooks(n, p)
+                yield n, data
+            if self.collaborator:
+                # Package hooks may report in meta, e.g., the compression
+                # ratio, so send it in the end of stream.
+                yield openfed_meta, self.meta
+            else:
+                yield openfed_generation, self.generation
+
+        chunks = iter_chunks(items(), pipe.chunk_size)
+        return prefetch(chunks) if self.prefetch else chunks
+
+    def _apply_package_hooks(self, n: str, p: Tensor) -> Dict[str, Any]:
+        r'''Applies package hooks to a shallow copy of the packaged data of
+        ``n``, and leaves the packaged data untouched.
+        '''
+        p_data = dict(self.packaged_data[n])
+
+        for nice, hook in _ordered(self._package_hooks):
+            p_data = hook(p_data, p)
+        return p_data
+
+    def _serialized_data(self, pipe: Pipe) -> Any:
+        r'''Returns the packaged data with package hooks applied, and
+        serialized for the transfer mode of ``pipe``. It is cached until the
+        :attr:`generation` is renewed, so that it is shared by all the pipes
+        pulling the same data.
+        '''
+        key = (self.generation, pipe.transfer_mode)
+        with self._package_lock:
+            if self._serialized is None or self._serialized[0] != key:
+                data = {
+                    n: self._apply_package_hooks(n, p)
+                    for n, p in self.state_dict.items()
+                }
+                data[openfed_generation] = self.generation
+                if pipe.transfer_mode == 'tensor':
+                    serialized = Packed(data)
+                else:
+                    serialized = Serialized(data)
+                self._serialized = (key, serialized)
+                self._stats['serializations'] += 1
+            return self._serialized[1]
+
+    def _unpackage_chunk(self, chunk: Dict[str, Any],
+                         data: Dict[str, Any]) -> bool:
+        r'''Applies unpackage hooks to the received chunk and caches it in
+        ``data``.
+
+        Returns:
+            ``False`` if any hook raises :class:`InvalidUpload`.
         '''
-        # clear data before download
-        self.data.clear()
-        data = self.transfer(to=False)
-        if not data:
+        valid = True
+        for n, p_data in chunk.items():
+            if n in self.state_dict:
+                p = self.state_dict[n]
+                # decode received data.
+                try:
+                    for nice, hook in _ordered(self._unpackage_hooks):
+                        p_data = hook(p_data, p)
+                except InvalidUpload as e:
+                    warnings.warn(f'Discard the received data: {e}')
+                    valid = False
+            data[n] = chunk[n]
+        return valid
+
+    def _download(
+            self,
+            pipe: Pipe) -> Union[Tuple[Dict[str, Any], Optional[Meta]], bool]:
+        r'''Receives and unpackages data from ``pipe``, without touching the
+        inner state, so that it can be called from worker threads.
+
+        Returns:
+            The received data and the meta of the other end, which is only
+            read by aggregator, ``not_modified`` if the data held by
+            collaborator is not modified, or ``False`` if failed or the data
+            is invalid. The data is ``None`` if it has been folded into the
+            accumulator chunk by chunk.
+        '''
+        data: Dict[str, Any] = dict()
+        meta = None
+
+        # The rest of stream is still received if a chunk is invalid.
+        valid = True
+
+        # In stream mode, aggregator folds each chunk into the accumulator as
+        # soon as it arrives, weighted by the meta published before pushing.
+        fold = self.aggregator and self.accumulator is not None and \
+            pipe.transfer_mode == 'stream'
+        if fold:
+            chunk_meta = deepcopy(pipe.meta)
+
+        def callback(chunk):
+            nonlocal valid
+            valid = self._unpackage_chunk(chunk, data) and valid
+            if fold:
+                tensor_data = {
+                    self.state_dict[n]: data.pop(n)
+                    for n in chunk if n in self.state_dict
+                }
+                if valid and tensor_data:
+                    with self._accumulator_lock:
+                        valid = self.accumulator.add(  # type: ignore
+                            tensor_data, chunk_meta) is not False
+
+        if pipe.transfer_mode == 'stream':
+            received = self.transfer(to=False, callback=callback, pipe=pipe)
+            if not received:
+                return False
+            if received == not_modified:
+                return not_modified
+            # The meta is sent in the end of stream.
+            if self.aggregator:
+                meta = Meta(**data.pop(openfed_meta))
+        else:
+            # The meta is published before pushing, and may be overwritten
+            # by the next step of the other end once the transfer finishes.
+            if self.aggregator:
+                meta = deepcopy(pipe.meta)
+            received = self.transfer(to=False, pipe=pipe)
+            if not received:
+                return False
+            if received == not_modified:
+                return not_modified
+            callback(received)
+        if not valid:
             return False
+        return (None if fold else data), meta
 
-        for n, p in self.state_dict.items():
-            p_data = data[n]
+    def _record(self, data: Optional[Dict[str, Any]],
+                meta: Optional[Meta]) -> bool:
+        r'''Caches the downloaded data and the meta along with it. If ``data``
+        is ``None``, it has been folded into the accumulator already.
 
-            # decode received data.
-            for nice, hook in self._unpackage_hooks.queue:
-                p_data = hook(p_data, p)
+        Returns:
+            ``False`` if the data is discarded by the accumulator, in which
+            case the meta is not kept either.
+        '''
+        if data is None:
+            self.meta_list.append(meta)
+            return True
 
+        if self.collaborator:
+            self.held_generation = data.pop(openfed_generation, None)
         self.data = data
 
         if self.aggregator:
@@ -277,28 +544,155 @@ class Maintainer(object):
             tensor_data = dict()
             for n, p in self.state_dict.items():
                 tensor_data[p] = data[n]
-            # cache the data
-            self.data_list.append(tensor_data)
-            self.meta_list.append(deepcopy(self.pipe.meta))
-
+            if self.accumulator is not None:
+                # fold the data and release it
+                with self._accumulator_lock:
+                    if self.accumulator.add(tensor_data, meta) is False:
+                        return False
+            else:
+                # cache the data
+                self.data_list.append(tensor_data)
+            self.meta_list.append(meta)
         return True
 
-    def upload(self) -> bool:
-        r'''Uploads data to the other end.
+    def download(self) -> bool:
+        r'''Downloads data from the other end.
+        '''
+        if not self.conditional_download:
+            # clear data before download
+            self.data.clear()
+        result = self._download(self.pipe)
+        if result is False:
+            return False
+        if result == not_modified:
+            # keep the data of the held version
+            return True
+        return self._record(*result)  # type: ignore
+
+    def _upload(self, pipe: Pipe) -> bool:
+        r'''Packages and uploads data to ``pipe``. It can be called from
+        worker threads.
         '''
         assert self.packaged_data
 
-        for n, p in self.state_dict.items():
-            p_data = self.packaged_data[n]
+        if self.aggregator and self._not_modified(pipe):
+            return self._reply_not_modified(pipe)
+
+        if self.aggregator and self.versions is not None:
+            # Put once per packaged model, instead of once per upload.
+            with self._package_lock:
+                if not self._version_kept:
+                    self.versions.put(self.generation, self.state_dict)
+                    self._version_kept = True
+
+        if pipe.transfer_mode == 'stream':
+            if self.collaborator:
+                pipe.set_meta(self.meta)
+            self.transfer(to=True, pipe=pipe)
+        elif self.aggregator:
+            # All collaborators pulling the same version share the same
+            # serialized data.
+            self.transfer(to=True, pipe=pipe, data=self._serialized_data(pipe))
+        else:
+            # package hooks modify the packaged data in place.
+            for n, p in self.state_dict.items():
+                p_data = self.packaged_data[n]
 
-            # apply various transformations, such as encryption here.
-            for nice, hook in self._package_hooks.queue:
-                p_data = hook(p_data, p)
+                # apply various transformations, such as encryption here.
+                for nice, hook in _ordered(self._package_hooks):
+                    p_data = hook(p_data, p)
 
-        self.transfer(to=True)
+            # Package hooks may report in meta, e.g., the compression ratio.
+            pipe.set_meta(self.meta)
+            self.transfer(to=True, pipe=pipe)
 
         return True
 
+    @fed_context
+    def _reply_not_modified(self, pipe: Pipe) -> bool:
+        r'''Answers the collaborator of ``pipe`` that the data is not
+        modified. Returns ``False`` if the collaborator does not read the
+        answer.
+        '''
+        pipe.not_modified()
+        self._stats['not_modified'] += 1
+        return True
+
+    def _not_modified(self, pipe: Pipe) -> bool:
+        r'''Returns ``True`` if the collaborator of ``pipe`` holds the data of
+        the current :attr:`generation` already.
+        '''
+        held_generation = pipe.meta.get('held_generation')
+        return held_generation is not None and \
+            held_generation == self.generation
+
+    def upload(self) -> bool:
+        r'''Uploads data to the other end. Collaborator publishes its meta
+        along with data.
+        '''
+        return self._upload(self.pipe)
+
+    def _submit_async(self, func: Callable, *args, **kwargs) -> Future:
+        r'''Calls ``func`` on the background thread of collaborator. The calls
+        are run one by one in the order of submission.
+        '''
+        assert self.collaborator, \
+            'Asynchronous transfer is only supported by collaborator.'
+        if self._async_executor is None:
+            self._async_executor = ThreadPoolExecutor(1)
+
+        # Grad mode is thread local.
+        grad_enabled = torch.is_grad_enabled()
+
+        def call():
+            with torch.set_grad_enabled(grad_enabled):
+                return func(*args, **kwargs)
+
+        return self._async_executor.submit(call)
+
+    def _snapshot_packaged_data(self):
+        r'''Replaces the tensors in packaged data with copies, so that the
+        model can be trained while the data is uploaded.
+        '''
+        for n, p_data in self.packaged_data.items():
+            for k, v in p_data.items():
+                if isinstance(v, Tensor):
+                    p_data[k] = v.detach().clone()
+
+    def upload_async(self) -> Future:
+        r'''Uploads data to the other end on a background thread.
+
+        The packaged data is copied before returning, thus the model and
+        optimizer can be modified at once. Returns a future of the result
+        of :func:`upload`.
+        '''
+        self._snapshot_packaged_data()
+        return self._submit_async(self.upload)
+
+    def download_async(self) -> Future:
+        r'''Downloads data from the other end on a background thread.
+
+        Returns a future of the result of :func:`download`. :attr:`data` is
+        updated once the future is done, then it can be unpackaged.
+        '''
+        return self._submit_async(self.download)
+
+    def step_async(self, *args, **kwargs) -> Future:
+        r'''Runs :func:`step` of collaborator on a background thread, and
+        returns a future of its result.
+
+        The packaged data is copied before returning if uploading, see
+        :func:`upload_async`.
+
+        .. note::
+            Asynchronous calls are run one by one in order. Wait for their
+            futures before calling the synchronous methods, or modifying
+            :attr:`meta`.
+        '''
+        if kwargs.get('upload', True):
+            self._snapshot_packaged_data()
+        return self._submit_async(self._collaborator_step, *args, **kwargs)
+
     def step(self, *args, **kwargs) -> bool:
         if self.collaborator:
             return self._collaborator_step(*args, **kwargs)
@@ -310,11 +704,20 @@ class Maintainer(object):
         upload = kwargs.pop('upload', True)
         meta = kwargs.pop('meta', None)
 
-        self.pipe.set_meta(meta or self.meta)
+        if meta:
+            self.meta = meta
+
+        if download and self.conditional_download and \
+                self.held_generation is not None:
+            self.meta['held_generation'] = self.held_generation
+        else:
+            self.meta.pop('held_generation', None)
 
         if upload:
+            # meta is published while uploading, after package hooks.
             flag_upload = self.upload()
         else:
+            self.pipe.set_meta(self.meta)
             flag_upload = True
 
         if download:
@@ -329,65 +732,131 @@ class Maintainer(object):
 
         return flag_upload and flag_download
 
-    def _aggregator_step(self, *args, **kwargs) -> bool:
-        self.stopped = False
+    def _step(self, step_name: str, *args, **kwargs) -> Optional[bool]:
+        r'''Calls the step hooks of ``step_name``.
 
-        def step(step_name: str, *args, **kwargs):
-            self.current_step = step_name
+        Returns:
+            ``False`` if any hook returns ``False``, else ``True`` if any hook
+            returns ``True``, else ``None``.
+        '''
+        self.current_step = step_name
 
-            step_hook = self._step_hooks[step_name].queue
+        output = []
+        for nice, hook in _ordered(self._step_hooks[step_name]):
+            output.append(hook(self, *args, **kwargs))
 
-            output = []
-            for nice, hook in step_hook:
-                output.append(hook(self, *args, **kwargs))
+        if False in output:
+            return False
+        elif True in output:
+            return True
+        else:
+            return None
 
-            if False in output:
-                return False
-            elif True in output:
-                return True
-            else:
-                return None
+    def _aggregator_step(self, *args, **kwargs) -> bool:
+        self.stopped = False
 
+        return self._aggregator_loop(self._step)
+
+    def _aggregator_loop(self, step: Callable) -> bool:
         while not self.stopped and len(self.pipes) > 0:
             step(at_new_episode)
-            for i, pipe in enumerate(self.pipes):
-                if self.stopped:
-                    break
-
-                self.pipe = pipe
-                step(at_first)
-
-                if pipe.is_offline:
-                    step(before_destroy)
-                    del self.pipes[i]
-                    step(after_destroy, True)
-                elif pipe.is_zombie:
-                    step(at_zombie)
-                elif pipe.is_pushing:
-                    # collaborator pushes data to aggregator,
-                    # as a aggregator, we need to download
-                    if step(before_download):
+            self._finish_jobs(step)
+            # Take one snapshot of all pipes' states per episode, instead of
+            # reading the store for every state check.
+            self._service_pipes(step, fetch_states(self.pipes))
+
+            # sleep for a while to wait all the state have been correctly set.
+            tic = time.time()
+            time.sleep(0.01)
+            self._stats['wait_time'] += time.time() - tic
+
+        # Jobs submitted before stopping are finished and recorded.
+        self._finish_jobs(step, wait=True)
+
+        return True
+
+    def _service_pipes(self, step: Callable, states: List[str]):
+        r'''Services each pipe according to its state in ``states``, which is
+        a snapshot of the states of :attr:`pipes`.
+        '''
+        for pipe, state in zip(list(self.pipes), states):
+            if self.stopped:
+                break
+            if pipe in self._jobs:
+                # still being serviced by a worker
+                continue
+
+            self.pipe = pipe
+            step(at_first)
+
+            if state == offline:
+                step(before_destroy)
+                self.pipes.remove(pipe)
+                step(after_destroy, True)
+            elif state == zombie:
+                step(at_zombie)
+            elif state == push:
+                # collaborator pushes data to aggregator,
+                # as a aggregator, we need to download
+                if step(before_download):
+                    if self._executor:
+                        self._submit_job(pipe, False)
+                    else:
                         flag = self.download()
                         step(after_download, flag)
+                else:
+                    step(at_failed)
+            elif state == pull:
+                # collaborator pulls data to aggregator,
+                # as a aggregator, we need to upload
+                if step(before_upload):
+                    if self._executor:
+                        self._submit_job(pipe, True)
                     else:
-                        step(at_failed)
-                elif pipe.is_pulling:
-                    # collaborator pulls data to aggregator,
-                    # as a aggregator, we need to upload
-                    if step(before_upload):
                         flag = self.upload()
                         step(after_upload, flag)
-                    else:
-                        step(at_failed)
                 else:
-                    step(at_invalid_state)
+                    step(at_failed)
+            else:
+                step(at_invalid_state)
 
-                step(at_last)
+            if pipe in self._jobs:
+                # `at_last` is called once the job is finished.
+                continue
+            step(at_last)
 
-            # sleep for a while to wait all the state have been correctly set.
-            time.sleep(0.01)
+    def _submit_job(self, pipe: Pipe, to: bool):
+        r'''Services ``pipe`` on a worker thread.
+        '''
+        assert self._executor
+        if to:
+            future = self._executor.submit(self._upload, pipe)
+        else:
+            future = self._executor.submit(self._download, pipe)
+        self._jobs[pipe] = (to, future)
 
-        return True
+    def _finish_jobs(self, step: Callable, wait: bool = False):
+        r'''Records the finished jobs and calls the ``after_upload`` or
+        ``after_download`` step hooks on them, in the main thread.
+
+        Args:
+            step: The function to call step hooks.
+            wait: If ``True``, wait all jobs to finish.
+        '''
+        for pipe, (to, future) in list(self._jobs.items()):
+            if not wait and not future.done():
+                continue
+            del self._jobs[pipe]
+            result = future.result()
+
+            self.pipe = pipe
+            if to:
+                step(after_upload, result)
+            else:
+                flag = result is not False and self._record(*result)
+                step(after_download, flag)
+            if not self.stopped:
+                step(at_last)
 
     def package(self,
                 optim_list: Optional[Any] = None,
@@ -400,6 +869,7 @@ class Maintainer(object):
                 state. Default: ``None``.
         '''
         self.packaged_data.clear()
+        self._new_generation()
         if optim_list and not isinstance(optim_list, list):
             optim_list = [
                 optim_list,
@@ -457,14 +927,35 @@ class Maintainer(object):
                                 if key in p_data:
                                     state[key] = p_data[key]
 
+    @property
+    def stats(self) -> Dict[str, float]:
+        r'''Statistics of all pipes since the last :func:`clear`, such as
+        ``store_ops``, the number of store operations, and ``wait_time``, the
+        seconds spent on waiting for the other ends.
+        '''
+        stats: Dict[str, float] = defaultdict(float, self._stats)
+        for pipe in self.pipes:
+            for k, v in pipe.stats.items():
+                stats[k] += v
+        return stats
+
     def clear(self):
         r'''Clears inner cached data.
         '''
         self.data_list.clear()
         self.meta_list.clear()
+        if self.accumulator is not None:
+            self.accumulator.clear()
+        self._stats.clear()
+        for pipe in self.pipes:
+            pipe.stats.clear()
 
     def __del__(self):
         self.manual_stop()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        if self._async_executor:
+            self._async_executor.shutdown(wait=False)
         self.pipes.clear()
 
     def manual_stop(self):
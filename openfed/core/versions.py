@@ -0,0 +1,153 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-17 10:12:37
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-17 10:12:37
+# Copyright (c) FederalLab. All rights reserved.
+import os
+import warnings
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+
+def _nbytes(model: Dict[str, Tensor]) -> int:
+    return sum(t.numel() * t.element_size() for t in model.values())
+
+
+class VersionCache(object):
+    r'''Keeps the global models of the latest versions, so that aggregator can
+    refer to the model a collaborator started from, even if the global model
+    has been updated since then. The least recently used version is evicted
+    first.
+
+    The kept models are the bases to rebuild uploads on, e.g., by
+    :func:`delta_encoding`. Downloads are not served as deltas from them.
+
+    Args:
+        max_versions: The max number of versions kept. Default: ``2``
+        max_bytes: The memory budget of models kept in memory. If exceeded,
+            the least recently used ones are spilled to ``spill_dir``, or
+            evicted if ``spill_dir`` is not given. The newest version is
+            never evicted. If ``None``, no limit. Default: ``None``
+        spill_dir: The directory to spill models to. Spilled models are
+            memory mapped from the files, and read lazily. Default: ``None``
+
+    Example::
+
+        >>> versions = VersionCache(max_versions=4, max_bytes=2**30,
+        >>>                         spill_dir='/tmp/openfed_versions')
+        >>> mt = Maintainer(fed_props, state_dict, versions=versions)
+        >>> mt.versions.get(mt.generation)
+    '''
+
+    def __init__(self,
+                 max_versions: int = 2,
+                 max_bytes: Optional[int] = None,
+                 spill_dir: Optional[str] = None):
+        assert max_versions > 0
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        # version -> model, the least recently used first.
+        self.models: OrderedDict = OrderedDict()
+        # The versions spilled to disk, and their files.
+        self.spilled: Dict[Any, str] = dict()
+        self.nbytes = 0
+        self.lock = Lock()
+
+    def __contains__(self, version: Any) -> bool:
+        return version in self.models
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def versions(self) -> List[Any]:
+        r'''Returns the kept versions, the least recently used first.
+        '''
+        with self.lock:
+            return list(self.models)
+
+    def put(self, version: Any, model: Dict[str, Tensor]):
+        r'''Keeps a copy of ``model`` as ``version``.
+
+        A version identifies one model. If the version is kept already, the
+        kept model is not replaced, and a warning is raised if ``model`` is
+        different from it.
+
+        Raises:
+            ValueError: ``model`` alone exceeds ``max_bytes``, and there is
+                no ``spill_dir`` to spill it to.
+        '''
+        with self.lock:
+            if version in self.models:
+                self.models.move_to_end(version)
+                kept = self.models[version]
+                if any(not torch.equal(kept[n], t.detach().to(kept[n]))
+                       for n, t in model.items()):
+                    warnings.warn(f'The model of version {version} is '
+                                  'changed, but the first one is kept. '
+                                  'Update the version once the model '
+                                  'changes.')
+                return
+            nbytes = _nbytes(model)
+            if self.max_bytes is not None and nbytes > self.max_bytes and \
+                    self.spill_dir is None:
+                raise ValueError(f'The model of {nbytes} bytes exceeds the '
+                                 f'budget of {self.max_bytes} bytes.')
+            model = {n: t.detach().clone() for n, t in model.items()}
+            self.models[version] = model
+            self.nbytes += nbytes
+            while len(self.models) > self.max_versions:
+                self._evict(next(iter(self.models)))
+            self._fit()
+
+    def get(self, version: Any) -> Optional[Dict[str, Tensor]]:
+        r'''Returns the model of ``version``, or ``None`` if not kept.
+        '''
+        with self.lock:
+            if version not in self.models:
+                return None
+            self.models.move_to_end(version)
+            return self.models[version]
+
+    def clear(self):
+        r'''Evicts all versions.
+        '''
+        with self.lock:
+            for version in list(self.models):
+                self._evict(version)
+
+    def _evict(self, version: Any):
+        model = self.models.pop(version)
+        if version in self.spilled:
+            os.remove(self.spilled.pop(version))
+        else:
+            self.nbytes -= _nbytes(model)
+
+    def _fit(self):
+        # Spill or evict the least recently used models in memory, until the
+        # budget is met. The newest one is spilled but never evicted.
+        if self.max_bytes is None:
+            return
+        newest = next(reversed(self.models))
+        for version in list(self.models):
+            if self.nbytes <= self.max_bytes:
+                break
+            if version in self.spilled:
+                continue
+            if self.spill_dir is None:
+                if version != newest:
+                    self._evict(version)
+                continue
+            model = self.models[version]
+            path = os.path.join(self.spill_dir, f'version_{version}.pt')
+            torch.save({n: t.cpu() for n, t in model.items()}, path)
+            self.spilled[version] = path
+            self.nbytes -= _nbytes(model)
+            self.models[version] = torch.load(path, mmap=True)
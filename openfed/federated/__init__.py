@@ -5,13 +5,17 @@
 # Copyright (c) FederalLab. All rights reserved.
 from .const import (aggregator, aggregator_rank, collaborator,
                     collaborator_rank, is_aggregator, is_collaborator,
-                    nick_name, offline, openfed_identity, openfed_meta,
+                    nick_name, not_modified, offline, openfed_ack,
+                    openfed_generation, openfed_identity, openfed_meta,
                     openfed_status, pull, push, zombie)
-from .exceptions import DeviceOffline
+from .exceptions import DeviceOffline, InvalidUpload
 from .functional import (build_point2point_group, init_federated_group,
                          joint_federated_group, openfed_lock)
-from .pipe import Pipe, get_store_value, set_store_value
+from .pipe import Pipe, fetch_states, get_store_value, set_store_value
 from .props import DistributedProperties, FederatedProperties
+from .wire import (ChunkJoiner, Packed, Serialized, iter_chunks,
+                   pack_tensors, prefetch, recv_object, recv_tensors,
+                   send_object, send_tensors, tensor_bytes, unpack_tensors)
 
 __all__ = [
     'aggregator',
@@ -22,9 +26,12 @@ __all__ = [
     'pull',
     'zombie',
     'offline',
+    'not_modified',
     'openfed_identity',
     'openfed_status',
     'openfed_meta',
+    'openfed_generation',
+    'openfed_ack',
     'openfed_lock',
     'nick_name',
     'aggregator_rank',
@@ -36,6 +43,20 @@ __all__ = [
     'set_store_value',
     'get_store_value',
     'Pipe',
+    'fetch_states',
     'init_federated_group',
     'DeviceOffline',
+    'InvalidUpload',
+    'pack_tensors',
+    'unpack_tensors',
+    'send_tensors',
+    'recv_tensors',
+    'send_object',
+    'recv_object',
+    'iter_chunks',
+    'ChunkJoiner',
+    'prefetch',
+    'tensor_bytes',
+    'Packed',
+    'Serialized',
 ]
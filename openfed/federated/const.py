@@ -21,10 +21,15 @@ push = 'push'
 pull = 'pull'
 zombie = 'zombie'
 offline = 'offline'
+# aggregator answers a pull without data, see `Pipe.not_modified`.
+not_modified = 'not_modified'
 
 openfed_identity = 'openfed_identity'
 openfed_status = 'openfed_status'
 openfed_meta = 'openfed_meta'
+# the token of the model served by aggregator, see `Maintainer.generation`.
+openfed_generation = 'openfed_generation'
+openfed_ack = 'openfed_ack'
 nick_name = 'nick_name'
 
 aggregator_rank = 0
@@ -15,3 +15,10 @@ class DeviceOffline(Exception):
         File '<stdin>', line 1, in <module>
         openfed.common.exceptions.DeviceOffline
     """
+
+
+class InvalidUpload(Exception):
+    """Raised by unpackage hooks if the received data can not be restored,
+    e.g., the base it is encoded against is not kept any longer. The
+    download fails and the data is discarded.
+    """
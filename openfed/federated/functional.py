@@ -133,17 +133,22 @@ def init_federated_group(fed_props: FederatedProperties) -> List[Pipe]:
         # build pipe
         for (prefix, sub_pg) in sub_pg_list:
             if isinstance(prefix, str):
-                store = distributed_c10d._pg_map[sub_pg][1]
+                # All pipes share the default store, so that their states can
+                # be fetched in a single batched request.
+                store = distributed_c10d._get_default_store()
                 assert store
                 prefix_store = PrefixStore(prefix, store)
             else:
-                prefix_store = prefix
+                store, prefix = prefix, ''
+                prefix_store = store
 
             pipe = Pipe(
                 prefix_store,
                 pg=sub_pg,
                 dist_props=dist_props,
-                fed_props=fed_props)
+                fed_props=fed_props,
+                root_store=store,
+                prefix=prefix)
             pipe_list.append(pipe)
 
     return pipe_list
@@ -6,18 +6,22 @@
 import json
 import time
 import warnings
+from collections import defaultdict
 from datetime import timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import torch.distributed.distributed_c10d as distributed_c10d
 
 from openfed.common import Meta
 from openfed.utils import FMT, tablist
 from .const import (aggregator, aggregator_rank, collaborator,
-                    collaborator_rank, nick_name, offline, openfed_identity,
-                    openfed_meta, openfed_status, pull, push, zombie)
+                    collaborator_rank, nick_name, not_modified, offline,
+                    openfed_ack, openfed_identity, openfed_meta,
+                    openfed_status, pull, push, zombie)
 from .exceptions import DeviceOffline
 from .props import DistributedProperties, FederatedProperties
+from .wire import (ChunkJoiner, iter_chunks, recv_object, recv_tensors,
+                   send_object, send_tensors)
 
 
 def set_store_value(store, key, value) -> bool:
@@ -45,6 +49,45 @@ def get_store_value(store, key) -> Any:
     return json.loads(json_str)
 
 
+def fetch_states(pipes: List['Pipe']) -> List[str]:
+    r"""Reads the states of all pipes with as few store round trips as
+    possible.
+
+    Pipes sharing the same root store are read with one ``multi_get``. If the
+    store does not support ``multi_get``, each pipe is read on its own.
+
+    Args:
+        pipes: The pipes to read.
+
+    Returns:
+        The state of each pipe.
+    """
+    groups: Dict[int, List[Pipe]] = defaultdict(list)
+    for pipe in pipes:
+        groups[id(pipe.root_store)].append(pipe)
+
+    for group in groups.values():
+        root_store = group[0].root_store
+        if hasattr(root_store, 'multi_get'):
+            keys = [
+                f'{pipe.prefix}/{pipe._u_key}' if pipe.prefix else pipe._u_key
+                for pipe in group
+            ]
+            try:
+                values = root_store.multi_get(keys)
+            except Exception as e:
+                warnings.warn(f'Get store value failed. {e}')
+                values = [b'{}'] * len(keys)
+            group[0].stats['store_ops'] += 1
+            for pipe, value in zip(group, values):
+                pipe._load(json.loads(str(value, encoding='utf-8')))
+        else:
+            for pipe in group:
+                pipe._read()
+
+    return [pipe.state for pipe in pipes]
+
+
 class Pipe():
     r'''Transfers data between nodes.
 
@@ -54,17 +97,27 @@ class Pipe():
             `gloo`, `mpi`.
         dist_props: The distributed properties.
         fed_props: The federated properties.
+        root_store: The store that ``store`` prefixes keys on. Pipes sharing
+            the same root store can be polled with a single batched request,
+            see :func:`fetch_states`. Default: ``store``
+        prefix: The prefix ``store`` adds to keys of ``root_store``.
+            Default: ``''``
     '''
     store: Any
     pg: Any
     dist_props: DistributedProperties
     fed_props: FederatedProperties
+    root_store: Any
+    prefix: str
 
     _u_backup_info: Dict[str, Any]
     _i_backup_info: Dict[str, Any]
 
     read_successfully: bool
 
+    # Counts the store operations, etc.
+    stats: Dict[str, float]
+
     @property
     def _i_key(self):
         return openfed_identity + '_' + self.role
@@ -73,8 +126,19 @@ class Pipe():
     def _u_key(self):
         return openfed_identity + '_' + self.anti_role
 
+    def _get_store_value(self, key: str) -> Any:
+        self.stats['store_ops'] += 1
+        return get_store_value(self.store, key)
+
+    def _set_store_value(self, key: str, value: Any) -> bool:
+        self.stats['store_ops'] += 1
+        return set_store_value(self.store, key, value)
+
     def _read(self, key: Optional[str] = None):
-        read_info = get_store_value(self.store, self._u_key)
+        self._load(self._get_store_value(self._u_key))
+        return self._u_backup_info[key] if key else self._u_backup_info
+
+    def _load(self, read_info: Dict[str, Any]):
         if len(read_info) == 0:
             self.read_successfully = False
             self._u_backup_info[
@@ -82,11 +146,10 @@ class Pipe():
         else:
             self.read_successfully = True
             self._u_backup_info = read_info
-        return self._u_backup_info[key] if key else self._u_backup_info
 
     def _write(self, info: Dict) -> bool:
         info['timestep'] = time.time()
-        return set_store_value(self.store, self._i_key, info)
+        return self._set_store_value(self._i_key, info)
 
     def _update(self, info: Dict) -> bool:
         self._i_backup_info.update(info)
@@ -102,7 +165,7 @@ class Pipe():
         r"""Get key value directly from store.
         If key is missed, will wait until it has been set.
         """
-        return get_store_value(self.store, key)
+        return self._get_store_value(key)
 
     def set(self, key: str, value):
         r"""Set key value to self._i_key 's dictionary.
@@ -112,7 +175,7 @@ class Pipe():
     def direct_set(self, key: str, value):
         r"""Set key value directly to store.
         """
-        set_store_value(self.store, key, value)
+        self._set_store_value(key, value)
 
     @property
     def role(self):
@@ -140,11 +203,17 @@ class Pipe():
         pg: Any,
         dist_props: DistributedProperties,
         fed_props: FederatedProperties,
+        root_store: Optional[Any] = None,
+        prefix: str = '',
     ):
         self.store = store
         self.pg = pg
         self.dist_props = dist_props
         self.fed_props = fed_props
+        self.root_store = root_store or store
+        self.prefix = prefix
+
+        self.stats = defaultdict(float)
 
         set_store_value(
             store=self.store,
@@ -163,12 +232,19 @@ class Pipe():
     def upload(self, data: Any):
         self.transfer(True, data)
 
-    def download(self) -> Any:
-        return self.transfer(False)
+    def download(self, callback: Optional[Callable] = None) -> Any:
+        return self.transfer(False, callback=callback)
 
     def _get_state(self):
         return self.get(openfed_status)
 
+    @property
+    def state(self) -> str:
+        r"""The state of the other end at the last read, without touching the
+        store.
+        """
+        return self._u_backup_info[openfed_status]
+
     def _set_state(self, state):
         return self.set(openfed_status, state)
 
@@ -195,31 +271,122 @@ class Pipe():
 
     def offline(self):
         self._set_state(offline)
+        # wake up the other end if it is waiting for us
+        self._signal()
+
+    @property
+    def _signal_key(self) -> str:
+        return openfed_ack + '_' + self.anti_role
+
+    @property
+    def _wait_key(self) -> str:
+        return openfed_ack + '_' + self.role
+
+    def _signal(self):
+        self.stats['store_ops'] += 1
+        try:
+            self.store.set(self._signal_key, '1')
+        except Exception as e:
+            warnings.warn(f'Set store value failed. {e}')
+
+    def _clear_signal(self) -> bool:
+        r"""Removes the signal left by the last response.
+
+        Returns:
+            ``True`` if the store supports waiting for the signal, ``False``
+            otherwise.
+        """
+        self.stats['store_ops'] += 1
+        try:
+            self.store.delete_key(self._wait_key)
+            return True
+        except Exception:
+            return False
+
+    def _wait(self, condition: Callable[[], bool], signal: bool = True):
+        r"""Waits until ``condition`` is met.
+
+        Between two checks, it blocks on the signal key via ``store.wait``
+        (or sleeps if ``signal`` is ``False``), with the interval growing
+        exponentially from ``backoff_min`` to ``backoff_max`` of address.
+
+        Raises:
+            DeviceOffline: The other end is offline, or does not response
+                within ``timeout`` seconds of address.
+        """
+        address = self.fed_props.address
+        interval = address.backoff_min
+        tic = time.time()
+        try:
+            while not condition():
+                # the state has been read by condition()
+                if self.state == offline:
+                    raise DeviceOffline(self)
+                remain = address.timeout - (time.time() - tic)
+                if remain <= 0:
+                    raise DeviceOffline(self)
+                interval = min(interval, remain)
+                if signal:
+                    self.stats['store_ops'] += 1
+                    try:
+                        self.store.wait([self._wait_key],
+                                        timedelta(seconds=interval))
+                    except RuntimeError:
+                        # timeout
+                        pass
+                else:
+                    time.sleep(interval)
+                interval = min(interval * 2, address.backoff_max)
+        finally:
+            self.stats['wait_time'] += time.time() - tic
+            self.stats['wait_count'] += 1
 
     @property
     def is_offline(self) -> bool:
         return self._get_state() == offline
 
-    def transfer(self, to: bool, data: Optional[Any] = None) -> Any:
+    def transfer(self,
+                 to: bool,
+                 data: Optional[Any] = None,
+                 callback: Optional[Callable] = None) -> Any:
+        r"""Transfers data to (``to=True``) or from (``to=False``) the other
+        end.
+
+        Args:
+            to: The direction of the transfer.
+            data: The data to upload. In ``stream`` mode, it can also be an
+                iterator of chunks.
+            callback: Only used by ``stream`` mode while downloading. If
+                given, each chunk is handed to it as soon as it arrives and is
+                not kept by the pipe.
+
+        Returns:
+            The downloaded data, or ``not_modified`` if aggregator answered
+            the download of collaborator by :func:`not_modified`.
+        """
         if self.is_offline:
             raise DeviceOffline(self)
 
         def _state():
-            return self.is_pulling if to else self.is_pushing
+            if to:
+                return self.is_pulling
+            else:
+                return self._get_state() in [push, not_modified]
 
         if self.collaborator:
+            signal = self._clear_signal()
             if to:
                 self.pushing()
             else:
                 self.pulling()
 
-            tic = time.time()
-            while not _state():
-                if self.is_offline:
-                    raise DeviceOffline(self)
-                toc = time.time()
-                if timedelta(seconds=toc - tic) > timedelta(minutes=30):
-                    raise DeviceOffline(self)
+            self._wait(_state, signal)
+
+            if self.state == not_modified:
+                self.zombie()
+                # tell aggregator the answer has been read
+                self._signal()
+                return not_modified
         else:
             if not _state():
                 raise DeviceOffline(self)
@@ -228,46 +395,100 @@ class Pipe():
                     self.pushing()
                 else:
                     self.pulling()
+                # wake up the collaborator waiting for response
+                self._signal()
 
         if to:
             self.push(data)
         else:
-            data = self.pull()
+            data = self.pull(callback)
 
         self.zombie()
 
         return data
 
+    def not_modified(self):
+        r"""Answers the pulling collaborator without sending data, if it holds
+        the data already. The download of collaborator returns
+        ``not_modified``. It returns once the collaborator has read the
+        answer.
+
+        Raises:
+            DeviceOffline: The collaborator is not pulling, or does not read
+                the answer within ``timeout`` seconds of address.
+        """
+        assert self.aggregator, 'Only aggregator answers not modified.'
+
+        if not self.is_pulling:
+            raise DeviceOffline(self)
+
+        signal = self._clear_signal()
+        self._set_state(not_modified)
+        # wake up the collaborator waiting for response
+        self._signal()
+
+        self._wait(lambda: not self.is_pulling, signal)
+
+        self.zombie()
+
+    @property
+    def transfer_mode(self) -> str:
+        return self.fed_props.address.transfer_mode
+
+    @property
+    def chunk_size(self) -> int:
+        return self.fed_props.address.chunk_size
+
     def push(self, data):
-        assert distributed_c10d._get_group_size(self.pg) == 2,\
+        r"""Sends data to the other end. The ranks in the point to point
+        process group are used, so that it does not depend on the global
+        states of ``torch.distributed``, nor need :attr:`dist_props`.
+        """
+        assert self.pg.size() == 2,\
             'Pipe is only designed for point to point communication.'
 
         rank = collaborator_rank if self.aggregator else aggregator_rank
-        rank = distributed_c10d._get_global_rank(self.pg, rank) \
-            if distributed_c10d.get_world_size() > 2 else rank
 
-        distributed_c10d.gather_object(data, None, dst=rank, group=self.pg)
+        if self.transfer_mode == 'stream':
+            chunks = iter_chunks(data.items(), self.chunk_size) \
+                if isinstance(data, dict) else data
+            for chunk in chunks:
+                send_tensors(chunk, rank, group=self.pg)
+            # A `None` chunk marks the end of stream.
+            send_tensors(None, rank, group=self.pg)
+        elif self.transfer_mode == 'tensor':
+            send_tensors(data, rank, group=self.pg)
+        else:
+            send_object(data, rank, group=self.pg)
 
-    def pull(self) -> Any:
-        assert distributed_c10d._get_group_size(self.pg) == 2,\
+    def pull(self, callback: Optional[Callable] = None) -> Any:
+        r"""Receives data from the other end, see :func:`push`.
+        """
+        assert self.pg.size() == 2,\
             'Pipe is only designed for point to point communication.'
 
-        world_size = distributed_c10d.get_world_size()
-
-        received = [None for _ in range(world_size)]
-
-        rank = aggregator_rank if self.aggregator else collaborator_rank
         other_rank = collaborator_rank if self.aggregator else aggregator_rank
 
-        rank = distributed_c10d._get_global_rank(
-            self.pg, rank) if world_size > 2 else rank
-        other_rank = distributed_c10d._get_global_rank(
-            self.pg, other_rank) if world_size > 2 else other_rank
-
-        distributed_c10d.gather_object(None, received, dst=rank, group=self.pg)
-
-        data = [r for r in received if r is not None][0]
-        assert data
+        if self.transfer_mode == 'stream':
+            data = True if callback else dict()
+            joiner = ChunkJoiner()
+            while True:
+                chunk = recv_tensors(other_rank, group=self.pg)
+                if chunk is None:
+                    break
+                # Values sliced by the other end are handed over once rebuilt.
+                chunk = joiner(chunk)
+                if not chunk:
+                    continue
+                if callback:
+                    callback(chunk)
+                else:
+                    data.update(chunk)
+        elif self.transfer_mode == 'tensor':
+            data = recv_tensors(other_rank, group=self.pg)
+        else:
+            data = recv_object(other_rank, group=self.pg)
+        assert data is not None
 
         return data
 
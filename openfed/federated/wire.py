@@ -0,0 +1,383 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 10:12:31
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 10:12:31
+# Copyright (c) FederalLab. All rights reserved.
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import torch
+from torch import Tensor
+
+_tensor = '__tensor__'
+_dict = '__dict__'
+_list = '__list__'
+_tuple = '__tuple__'
+# A tensor sent in flat slices, and a slice of it.
+_sliced = '__sliced__'
+_slice = '__slice__'
+
+
+def _dtype_to_str(dtype: torch.dtype) -> str:
+    return str(dtype).split('.')[-1]
+
+
+def _str_to_dtype(dtype: str) -> torch.dtype:
+    return getattr(torch, dtype)
+
+
+def pack_tensors(data: Any) -> Tuple[Any, List[Tensor]]:
+    r"""Splits data into a json serializable header and a list of tensors.
+
+    Tensors are replaced by their index in the returned list, together with
+    the dtype and shape needed to allocate them on the other end. The same
+    tensor object is only packed once.
+
+    Args:
+        data: Nested ``dict``, ``list`` or ``tuple`` of tensors and python
+            scalars.
+
+    Returns:
+        A tuple of ``(header, tensors)``.
+    """
+    tensors: List[Tensor] = []
+    memo = dict()
+
+    def _pack(obj):
+        if isinstance(obj, Tensor):
+            if id(obj) not in memo:
+                assert obj.layout == torch.strided, \
+                    'Only dense tensors are supported.'
+                memo[id(obj)] = len(tensors)
+                tensors.append(obj.detach().cpu().contiguous())
+            t = tensors[memo[id(obj)]]
+            return {
+                _tensor: memo[id(obj)],
+                'dtype': _dtype_to_str(t.dtype),
+                'shape': list(t.shape),
+            }
+        elif isinstance(obj, dict):
+            return {_dict: [[_pack(k), _pack(v)] for k, v in obj.items()]}
+        elif isinstance(obj, list):
+            return {_list: [_pack(v) for v in obj]}
+        elif isinstance(obj, tuple):
+            return {_tuple: [_pack(v) for v in obj]}
+        elif obj is None or isinstance(obj, (bool, int, float, str)):
+            return obj
+        else:
+            raise TypeError(f'{type(obj)} is not supported by tensor '
+                            "transfer mode, use 'object' instead.")
+
+    header = _pack(data)
+
+    return header, tensors
+
+
+def unpack_tensors(header: Any, tensors: List[Tensor]) -> Any:
+    r"""Rebuilds data from header and tensors returned by
+    :func:`pack_tensors`.
+    """
+
+    def _unpack(obj):
+        if isinstance(obj, dict):
+            if _tensor in obj:
+                return tensors[obj[_tensor]]
+            elif _dict in obj:
+                return {_unpack(k): _unpack(v) for k, v in obj[_dict]}
+            elif _list in obj:
+                return [_unpack(v) for v in obj[_list]]
+            elif _tuple in obj:
+                return tuple(_unpack(v) for v in obj[_tuple])
+            else:
+                raise ValueError(f'Invalid header: {obj}')
+        else:
+            return obj
+
+    return _unpack(header)
+
+
+def tensor_specs(header: Any) -> List[Tuple[int, torch.dtype, List[int]]]:
+    r"""Collects ``(index, dtype, shape)`` of all tensors in header, sorted by
+    index.
+    """
+    specs = dict()
+
+    def _collect(obj):
+        if isinstance(obj, dict):
+            if _tensor in obj:
+                specs[obj[_tensor]] = (obj[_tensor],
+                                       _str_to_dtype(obj['dtype']),
+                                       obj['shape'])
+            else:
+                for v in obj.values():
+                    _collect(v)
+        elif isinstance(obj, list):
+            for v in obj:
+                _collect(v)
+
+    _collect(header)
+
+    return [specs[i] for i in sorted(specs)]
+
+
+def tensor_bytes(data: Any) -> int:
+    r"""Returns the total bytes of tensors contained in data.
+    """
+    if isinstance(data, Tensor):
+        return data.numel() * data.element_size()
+    elif isinstance(data, dict):
+        return sum(tensor_bytes(v) for v in data.values())
+    elif isinstance(data, (list, tuple)):
+        return sum(tensor_bytes(v) for v in data)
+    else:
+        return 0
+
+
+def _map_tensors(obj: Any, func: Callable[[Tensor], Any]) -> Any:
+    r"""Returns a copy of nested ``obj``, with tensors replaced by ``func``.
+    """
+    if isinstance(obj, Tensor):
+        return func(obj)
+    elif isinstance(obj, dict):
+        return {k: _map_tensors(v, func) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_map_tensors(v, func) for v in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_map_tensors(v, func) for v in obj)
+    else:
+        return obj
+
+
+def _iter_slices(key: Any, value: Any,
+                 chunk_size: int) -> Iterator[Dict[Any, Any]]:
+    r"""Yields ``value`` with its tensors replaced by placeholders, followed by
+    the flat slices of each tensor, at most ``chunk_size`` bytes per chunk.
+    """
+    tensors: List[Tensor] = []
+
+    def placeholder(t):
+        tensors.append(t.detach().reshape(-1))
+        return {
+            _sliced: len(tensors) - 1,
+            'dtype': _dtype_to_str(t.dtype),
+            'shape': list(t.shape),
+        }
+
+    yield {key: _map_tensors(value, placeholder)}
+    for i, t in enumerate(tensors):
+        step = max(1, chunk_size // t.element_size())
+        for offset in range(0, t.numel(), step):
+            yield {_slice: [key, i, offset, t[offset:offset + step]]}
+
+
+def iter_chunks(items: Iterable[Tuple[Any, Any]],
+                chunk_size: int) -> Iterator[Dict[Any, Any]]:
+    r"""Groups ``(key, value)`` pairs into dictionaries whose tensors take at
+    most ``chunk_size`` bytes. The tensors of a single value larger than
+    ``chunk_size`` are sent in flat slices, which are rebuilt by
+    :class:`ChunkJoiner` on the other end.
+
+    Args:
+        items: The ``(key, value)`` pairs. It is consumed lazily.
+        chunk_size: The chunk budget in bytes.
+    """
+    chunk: Dict[Any, Any] = dict()
+    size = 0
+    for k, v in items:
+        v_size = tensor_bytes(v)
+        if chunk and size + v_size > chunk_size:
+            yield chunk
+            chunk, size = dict(), 0
+        if v_size > chunk_size:
+            yield from _iter_slices(k, v, chunk_size)
+        else:
+            chunk[k] = v
+            size += v_size
+    if chunk:
+        yield chunk
+
+
+def _allocate(obj: Any, tensors: Dict[int, Tensor]) -> Any:
+    r"""Returns a copy of nested ``obj``, with the placeholders of sliced
+    tensors replaced by empty tensors, which are also put in ``tensors``.
+    """
+    if isinstance(obj, dict) and _sliced in obj:
+        t = torch.empty(obj['shape'], dtype=_str_to_dtype(obj['dtype']))
+        tensors[obj[_sliced]] = t
+        return t
+    elif isinstance(obj, dict):
+        return {k: _allocate(v, tensors) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_allocate(v, tensors) for v in obj)
+    else:
+        return obj
+
+
+class ChunkJoiner(object):
+    r"""Rebuilds the values sliced by :func:`iter_chunks` from the received
+    chunks. Only the values being rebuilt are kept.
+
+    Example::
+
+        >>> joiner = ChunkJoiner()
+        >>> for chunk in chunks:
+        >>>     # the complete values in chunk
+        >>>     chunk = joiner(chunk)
+    """
+
+    def __init__(self):
+        # key -> [value, allocated tensors, elements not received]
+        self.pending: Dict[Any, List[Any]] = dict()
+
+    def __call__(self, chunk: Dict[Any, Any]) -> Dict[Any, Any]:
+        r"""Returns the complete values in ``chunk``, and the values completed
+        by it.
+        """
+        joined = dict()
+        for k, v in chunk.items():
+            if k == _slice:
+                key, i, offset, data = v
+                pending = self.pending[key]
+                pending[1][i].view(-1)[offset:offset + data.numel()].copy_(data)
+                pending[2] -= data.numel()
+                if pending[2] == 0:
+                    del self.pending[key]
+                    joined[key] = pending[0]
+                continue
+
+            tensors: Dict[int, Tensor] = dict()
+            value = _allocate(v, tensors) if tensor_bytes(v) == 0 else v
+            numel = sum(t.numel() for t in tensors.values())
+            if numel > 0:
+                self.pending[k] = [value, tensors, numel]
+            else:
+                joined[k] = value
+        return joined
+
+
+def prefetch(iterator: Iterator[Any]) -> Iterator[Any]:
+    r"""Yields the items of ``iterator``, while the next one is produced on a
+    worker thread. Thus, producing the next item overlaps with consuming the
+    current one, at the cost of one more item alive.
+
+    Args:
+        iterator: The iterator, which is only advanced by the worker thread.
+    """
+    end = object()
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(next, iterator, end)
+        while True:
+            item = future.result()
+            if item is end:
+                return
+            future = executor.submit(next, iterator, end)
+            yield item
+
+
+class Serialized(object):
+    r"""Data pickled once, which can be sent many times in ``object`` transfer
+    mode without being pickled again. The other end receives the original
+    data.
+
+    Args:
+        data: Data to pickle.
+    """
+
+    def __init__(self, data: Any):
+        self.buffer = pickle.dumps(data)
+
+    def __reduce__(self):
+        return (pickle.loads, (self.buffer, ))
+
+
+class Packed(object):
+    r"""Data packed once by :func:`pack_tensors`, which can be sent many times
+    in ``tensor`` transfer mode via :func:`send_tensors`.
+
+    Args:
+        data: Data to pack.
+    """
+
+    def __init__(self, data: Any):
+        header, self.tensors = pack_tensors(data)
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        self.header = torch.tensor(list(header_bytes), dtype=torch.uint8)
+        self.size = torch.tensor([len(header_bytes)], dtype=torch.long)
+
+
+def _send(t: Tensor, dst: int, group: Any):
+    group.send([t], dst, 0).wait()
+
+
+def _recv(t: Tensor, src: int, group: Any):
+    group.recv([t], src, 0).wait()
+
+
+def send_tensors(data: Any, dst: int, group: Any):
+    r"""Sends data to ``dst`` with raw tensor bytes instead of pickled objects.
+
+    Args:
+        data: Data to send. See :func:`pack_tensors`. It can also be a
+            :class:`Packed` data, which will not be packed again.
+        dst: The rank of destination in ``group``.
+        group: The process group to work on.
+
+    .. note::
+        It calls the process group directly, instead of the global states of
+        ``torch.distributed``, so that pipes of different federated groups
+        can transfer at the same time.
+    """
+    packed = data if isinstance(data, Packed) else Packed(data)
+
+    _send(packed.size, dst, group)
+    _send(packed.header, dst, group)
+    for t in packed.tensors:
+        if t.numel() > 0:
+            _send(t, dst, group)
+
+
+def recv_tensors(src: int, group: Any) -> Any:
+    r"""Receives data sent by :func:`send_tensors`.
+
+    Args:
+        src: The rank of source in ``group``.
+        group: The process group to work on.
+
+    Returns:
+        The received data.
+    """
+    size = torch.zeros(1, dtype=torch.long)
+    _recv(size, src, group)
+    header_tensor = torch.empty(int(size.item()), dtype=torch.uint8)
+    _recv(header_tensor, src, group)
+    header = json.loads(bytes(header_tensor.tolist()).decode('utf-8'))
+
+    tensors = []
+    for _, dtype, shape in tensor_specs(header):
+        t = torch.empty(shape, dtype=dtype)
+        if t.numel() > 0:
+            _recv(t, src, group)
+        tensors.append(t)
+
+    return unpack_tensors(header, tensors)
+
+
+def send_object(data: Any, dst: int, group: Any):
+    r"""Sends pickled data to ``dst``. See :func:`send_tensors`.
+    """
+    buffer = torch.frombuffer(bytearray(pickle.dumps(data)), dtype=torch.uint8)
+    _send(torch.tensor([buffer.numel()], dtype=torch.long), dst, group)
+    _send(buffer, dst, group)
+
+
+def recv_object(src: int, group: Any) -> Any:
+    r"""Receives data sent by :func:`send_object`.
+    """
+    size = torch.zeros(1, dtype=torch.long)
+    _recv(size, src, group)
+    buffer = torch.empty(int(size.item()), dtype=torch.uint8)
+    _recv(buffer, src, group)
+    return pickle.loads(buffer.numpy().tobytes())
@@ -3,15 +3,20 @@
 # @Last Modified by  : Chen Dengsheng
 # @Last Modified time: 2021-09-25 16:52:46
 # Copyright (c) FederalLab. All rights reserved.
-from .agg import (average_aggregation, elastic_aggregation, load_param_states,
+from .agg import (AverageAccumulator, MaskAccumulator, NaiveAccumulator,
+                  PaillierAccumulator, average_aggregation,
+                  elastic_aggregation, load_param_states, mask_aggregation,
                   naive_aggregation, paillier_aggregation)
 from .const import (after_destroy, after_download, after_upload, at_failed,
                     at_first, at_invalid_state, at_last, at_new_episode,
                     at_zombie, before_destroy, before_download, before_upload)
-from .hooks import device_alignment, sign_gradient_clip
-from .paillier import (Ciphertext, PrivateKey, PublicKey, float_to_long,
+from .hooks import (delta_encoding, device_alignment, quantization,
+                    sign_gradient_clip, topk_sparsification)
+from .mask import PairwiseMask, mask_package, unmask
+from .paillier import (Ciphertext, NoisePool, PrivateKey, PublicKey,
+                       compact_ciphertext, expand_ciphertext, float_to_long,
                        key_gen, long_to_float, paillier_dec, paillier_enc,
-                       paillier_package)
+                       paillier_noise, paillier_package)
 from .reduce import meta_reduce
 from .step import count_step, dispatch_step, period_step
 
@@ -30,6 +35,9 @@ __all__ = [
     'before_upload',
     'device_alignment',
     'sign_gradient_clip',
+    'quantization',
+    'topk_sparsification',
+    'delta_encoding',
     'PublicKey',
     'PrivateKey',
     'Ciphertext',
@@ -39,6 +47,13 @@ __all__ = [
     'float_to_long',
     'long_to_float',
     'paillier_package',
+    'paillier_noise',
+    'NoisePool',
+    'PairwiseMask',
+    'mask_package',
+    'unmask',
+    'compact_ciphertext',
+    'expand_ciphertext',
     'count_step',
     'period_step',
     'dispatch_step',
@@ -47,5 +62,10 @@ __all__ = [
     'naive_aggregation',
     'elastic_aggregation',
     'paillier_aggregation',
+    'mask_aggregation',
+    'AverageAccumulator',
+    'NaiveAccumulator',
+    'PaillierAccumulator',
+    'MaskAccumulator',
     'meta_reduce',
 ]
@@ -11,7 +11,10 @@ import torch
 from torch import Tensor
 from torch.optim import Optimizer
 
-from .paillier import Ciphertext, PrivateKey, long_to_float, paillier_dec
+from openfed.core.const import DefaultMaintainer
+
+from .mask import derive_seed, from_fixed, prg, unmask
+from .paillier import PrivateKey, _decrypt, _thread_pool, expand_ciphertext
 
 
 def load_param_states(optim: Optimizer, param_states: Dict[Tensor, Any]):
@@ -38,9 +41,92 @@ def load_param_states(optim: Optimizer, param_states: Dict[Tensor, Any]):
                       f'{fail} params are ignored.')
 
 
-def average_aggregation(data_list: List[Dict[Tensor, Any]],
-                        meta_list: Optional[Any] = None,
-                        optim_list: Optional[Any] = None):
+def _flat_aggregate(
+    data_list: List[Dict[Tensor, Any]],
+    weight: Optional[List[float]] = None,
+    dtype: Optional[torch.dtype] = None
+) -> Optional[Dict[Tensor, Dict[str, Tensor]]]:
+    r"""Aggregates data into flat buffers. The same state of all params, with
+    the same dtype and device, is reduced into one contiguous buffer with a
+    multi-tensor ``_foreach_add_`` per client, instead of looping over params
+    and clients in python. The aggregated states are views of the buffer.
+
+    Args:
+        data_list: The received data.
+        weight: The weight of each client. If ``None``, take the mean.
+        dtype: The dtype to aggregate in. If ``None``, use the dtype of the
+            received state, and the default dtype for non floating state.
+
+    Returns:
+        The aggregated param states, or ``None`` if clients do not report
+        the same params and states with the same shape and dtype. In that
+        case, the caller should fall back to aggregate them one by one.
+    """
+    if len(data_list) == 0:
+        return None
+    first = data_list[0]
+    params = list(first)
+    # The keys of reported states of each param.
+    keys = [[k for k, v in s.items() if v is not None] for s in first.values()]
+    # The states of each client, in the order of params.
+    states_list = []
+    for data in data_list:
+        if len(data) != len(params) or \
+                any(a is not b for a, b in zip(data, params)):
+            return None
+        states = list(data.values())
+        for s, ks in zip(states, keys):
+            if [k for k, v in s.items() if v is not None] != ks:
+                return None
+        states_list.append(states)
+
+    # Group the params by state, dtype and device.
+    groups: Dict[Any, List[int]] = defaultdict(list)
+    for i, (s, ks) in enumerate(zip(states_list[0], keys)):
+        for k in ks:
+            v = s[k]
+            if not isinstance(v, Tensor):
+                return None
+            groups[(k, v.dtype, v.device)].append(i)
+
+    if weight is None:
+        weight = [1.0 / len(data_list)] * len(data_list)
+
+    param_states = defaultdict(dict)
+    for (k, v_dtype, device), indices in groups.items():
+        if dtype is not None:
+            f_dtype = dtype
+        elif v_dtype.is_floating_point:
+            f_dtype = v_dtype
+        else:
+            f_dtype = torch.get_default_dtype()
+        shapes = [states_list[0][i][k].shape for i in indices]
+        sizes = [shape.numel() for shape in shapes]
+        buffer = torch.zeros(sum(sizes), dtype=f_dtype, device=device)
+        outputs = [
+            v.view(shape) for v, shape in zip(buffer.split(sizes), shapes)
+        ]
+
+        for states, w in zip(states_list, weight):
+            inputs = [states[i][k] for i in indices]
+            try:
+                # shape check, avoid broadcasting
+                if [v.shape for v in inputs] != shapes:
+                    return None
+                if any(v.dtype != f_dtype for v in inputs):
+                    inputs = [v.to(f_dtype) for v in inputs]
+                torch._foreach_add_(outputs, inputs, alpha=w)
+            except (AttributeError, RuntimeError):
+                # not tensor, or on different devices
+                return None
+
+        for i, v in zip(indices, outputs):
+            param_states[params[i]][k] = v
+
+    return param_states
+
+
+def _average_aggregate(data_list: List[Dict[Tensor, Any]]):
     param_states = defaultdict(dict)
 
     def aggregate(data: List[Tensor]):
@@ -68,26 +154,10 @@ def average_aggregation(data_list: List[Dict[Tensor, Any]],
     for p, state in param_states.items():
         for k, v in state.items():
             state[k] = aggregate(v)
-        if p.requires_grad:
-            state['grad'] = p - state['param']
-        else:
-            p.copy_(state['param'])
-    if optim_list:
-        if not isinstance(optim_list, list):
-            optim_list = [
-                optim_list,
-            ]
-        for optim in optim_list:
-            load_param_states(optim, param_states)
     return param_states
 
 
-def naive_aggregation(data_list: List[Dict[Tensor, Any]],
-                      meta_list: Any,
-                      optim_list: Optional[Any] = None):
-
-    assert len(data_list) == len(meta_list)
-
+def _weighted_aggregate(data_list: List[Dict[Tensor, Any]], meta_list: Any):
     param_states = defaultdict(dict)
 
     def aggregate(data: List[Tensor], weight: List[float]):
@@ -136,7 +206,41 @@ def naive_aggregation(data_list: List[Dict[Tensor, Any]],
 
         # remove useless weight
         del state['weight']
+    return param_states
+
+
+def _weighted_flat_aggregate(data_list: List[Dict[Tensor, Any]],
+                             meta_list: Any):
+    if len(data_list) == 0:
+        return None
+    total_instances = sum(meta['instances'] for meta in meta_list)
+    assert total_instances > 0
+
+    weight = [meta['instances'] / total_instances for meta in meta_list]
+    return _flat_aggregate(data_list, weight)
+
+
+def _has_sparse(data_list: List[Dict[Tensor, Any]]) -> bool:
+    r"""Returns ``True`` if any received state is a sparse update, such as
+    the ``param`` uploaded by :func:`topk_sparsification`. They are
+    aggregated by accumulators, which fold them into dense sums one by one.
+    """
+    return any(
+        isinstance(v, Tensor) and v.is_sparse for data in data_list
+        for state in data.values() for v in state.values())
 
+
+def average_aggregation(data_list: List[Dict[Tensor, Any]],
+                        meta_list: Optional[Any] = None,
+                        optim_list: Optional[Any] = None):
+    if _has_sparse(data_list):
+        return AverageAccumulator()(data_list, meta_list, optim_list)
+
+    param_states = _flat_aggregate(data_list, dtype=torch.float)
+    if param_states is None:
+        param_states = _average_aggregate(data_list)
+
+    for p, state in param_states.items():
         if p.requires_grad:
             state['grad'] = p - state['param']
         else:
@@ -151,62 +255,54 @@ def naive_aggregation(data_list: List[Dict[Tensor, Any]],
     return param_states
 
 
-def elastic_aggregation(data_list: List[Dict[Tensor, Any]],
-                        meta_list: Any,
-                        quantile: float = 0.5,
-                        optim_list: Optional[Any] = None):
+def naive_aggregation(data_list: List[Dict[Tensor, Any]],
+                      meta_list: Any,
+                      optim_list: Optional[Any] = None):
 
     assert len(data_list) == len(meta_list)
 
-    param_states = defaultdict(dict)
+    if _has_sparse(data_list):
+        return NaiveAccumulator()(data_list, meta_list, optim_list)
 
-    def aggregate(data: List[Tensor], weight: List[float]):
-        w_data = None
-        for d, w in zip(data, weight):
-            if w_data is None:
-                w_data = d * w
-            else:
-                w_data += d * w
-        return w_data
+    param_states = _weighted_flat_aggregate(data_list, meta_list)
+    if param_states is None:
+        param_states = _weighted_aggregate(data_list, meta_list)
 
-    # get all params
-    params = set()
-    for data in data_list:
-        for p in data:
-            params.add(p)
-    params = list(params)
+    for p, state in param_states.items():
+        if p.requires_grad:
+            state['grad'] = p - state['param']
+        else:
+            p.copy_(state['param'])
+    if optim_list:
+        if not isinstance(optim_list, list):
+            optim_list = [
+                optim_list,
+            ]
+        for optim in optim_list:
+            load_param_states(optim, param_states)
+    return param_states
 
-    for p in params:
-        param_state = param_states[p]
-        total_instances = 0
-        for data, meta in zip(data_list, meta_list):
-            if p in data:
-                total_instances += meta['instances']
 
-        assert total_instances > 0
+def elastic_aggregation(data_list: List[Dict[Tensor, Any]],
+                        meta_list: Any,
+                        quantile: float = 0.5,
+                        optim_list: Optional[Any] = None):
 
+    assert len(data_list) == len(meta_list)
+
+    if _has_sparse(data_list):
+        # Fold the sparse updates into dense sums, weighted as
+        # naive_aggregation, before the elastic weighting.
+        accumulator = NaiveAccumulator()
         for data, meta in zip(data_list, meta_list):
-            if p in data:
-                weight = meta['instances'] / total_instances
-                state = data[p]
-                for k in state:
-                    if state[k] is None:
-                        continue
-                    if k not in param_state:
-                        param_state[k] = []
-                    param_state[k].append(state[k])
-                if 'weight' not in param_state:
-                    param_state['weight'] = []
-                param_state['weight'].append(weight)
+            accumulator.add(data, meta)
+        param_states = accumulator.param_states()
+    else:
+        param_states = _weighted_flat_aggregate(data_list, meta_list)
+        if param_states is None:
+            param_states = _weighted_aggregate(data_list, meta_list)
 
     for p, state in param_states.items():
-        for k, v in state.items():
-            if k != 'weight':
-                state[k] = aggregate(v, state['weight'])
-
-        # remove useless weight
-        del state['weight']
-
         if p.requires_grad:
             assert 'importance' in state, \
                 'elastic aggregation requires `importance` state.'
@@ -231,67 +327,333 @@ def elastic_aggregation(data_list: List[Dict[Tensor, Any]],
 def paillier_aggregation(data_list: List[Dict[Tensor, Any]],
                          private_key: Union[str, PrivateKey],
                          meta_list: Optional[Any] = None,
-                         optim_list: Optional[Any] = None):
-    if isinstance(private_key, str):
-        private_key = PrivateKey.load(private_key)
-
-    def decode(c1, c2, received_numbers):
-        c = Ciphertext(c1, c2)
-        v = paillier_dec(private_key, c)  # type: ignore
-        return long_to_float(private_key, v, received_numbers)  # type: ignore
-
-    param_states = defaultdict(dict)
+                         optim_list: Optional[Any] = None,
+                         pack_bits: int = 0,
+                         headroom: int = 4,
+                         num_threads: int = 0,
+                         chunk_size: int = 2**20):
+    return PaillierAccumulator(private_key, pack_bits, headroom, num_threads,
+                               chunk_size)(data_list, meta_list, optim_list)
+
+
+def mask_aggregation(data_list: List[Dict[Tensor, Any]],
+                     meta_list: Optional[Any] = None,
+                     optim_list: Optional[Any] = None,
+                     store: Optional[Any] = None,
+                     frac_bits: int = 16,
+                     session: str = 'openfed_mask',
+                     threshold: Optional[int] = None):
+    return MaskAccumulator(store, frac_bits, session,
+                           threshold)(data_list, meta_list, optim_list)
+
+
+class AverageAccumulator(object):
+    r'''Folds the received data into running sums as soon as it is
+    downloaded, instead of caching all of them in ``data_list``. The memory
+    cost is ``O(model)`` no matter how many collaborators report. The result
+    equals to :func:`average_aggregation`.
+
+    Register it to the maintainer via
+    :func:`Maintainer.register_accumulator`, and use it as the
+    ``agg_func`` of :class:`openfed.API`.
+
+    Example::
+
+        >>> accumulator = AverageAccumulator()
+        >>> maintainer.register_accumulator(accumulator)
+        >>> api = openfed.API(maintainer, fed_optim, rounds, accumulator)
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        r'''Clears the running sums.
+        '''
+        # sum of weighted state
+        self.sums: Dict[Tensor, Dict[str, Any]] = defaultdict(dict)
+        # total weight of each state
+        self.weights: Dict[Tensor, Dict[str, float]] = defaultdict(dict)
+
+    def weight(self, meta: Any) -> float:
+        r'''Returns the weight of data with the given meta.
+        '''
+        return 1.0
+
+    def add(self, data: Dict[Tensor, Any], meta: Optional[Any] = None):
+        r'''Folds data into the running sums.
+
+        Args:
+            data: The received data, indexed by tensors. A sparse state is
+                taken as a sparse update of the tensor as it is now, thus
+                updates of other models should be rebuilt densely first,
+                as :func:`topk_sparsification` does.
+            meta: The meta information along with data.
+        '''
+        weight = self.weight(meta)
+        for p, state in data.items():
+            sums = self.sums[p]
+            weights = self.weights[p]
+            for k, v in state.items():
+                if v is None:
+                    continue
+                if v.is_sparse:
+                    # A sparse state is a sparse update of ``p``, which is
+                    # folded into the dense sum as it is.
+                    if k not in sums:
+                        sums[k] = torch.zeros_like(p, dtype=torch.float)
+                        weights[k] = 0.0
+                    sums[k].add_(p.detach().float(), alpha=weight)
+                    sums[k].add_(v.float(), alpha=weight)
+                    weights[k] += weight
+                    continue
+                v = v.float() * weight
+                if k in sums:
+                    sums[k] += v
+                    weights[k] += weight
+                else:
+                    sums[k] = v
+                    weights[k] = weight
+
+    def average(self, p: Tensor, k: str) -> Tensor:
+        r'''Returns the aggregated ``k`` state of ``p``, which is averaged
+        over the collaborators reporting it.
+        '''
+        assert self.weights[p][k] > 0
+        return self.sums[p][k] / self.weights[p][k]
+
+    def param_states(self) -> Dict[Tensor, Dict[str, Any]]:
+        r'''Returns the aggregated states of all params.
+        '''
+        param_states = defaultdict(dict)
+        for p, sums in self.sums.items():
+            state = param_states[p]
+            for k in sums:
+                state[k] = self.average(p, k)
+        return param_states
+
+    def __call__(self,
+                 data_list: Optional[List[Dict[Tensor, Any]]] = None,
+                 meta_list: Optional[Any] = None,
+                 optim_list: Optional[Any] = None):
+        r'''Aggregates the running sums. Data in ``data_list`` which has not
+        been folded, is folded first.
+        '''
+        if data_list:
+            if meta_list is None or len(meta_list) != len(data_list):
+                meta_list = [None] * len(data_list)
+            for data, meta in zip(data_list, meta_list):
+                self.add(data, meta)
+
+        param_states = self.param_states()
+        for p, state in param_states.items():
+            if p.requires_grad:
+                state['grad'] = p - state['param']
+            else:
+                p.copy_(state['param'])
+        if optim_list:
+            if not isinstance(optim_list, list):
+                optim_list = [
+                    optim_list,
+                ]
+            for optim in optim_list:
+                load_param_states(optim, param_states)
+        return param_states
 
-    def aggregate(data: List[Tensor]):
-        return torch.stack(data, dim=0).float().mean(dim=0, keepdim=False)
 
-    # get all params
-    params = set()
-    for data in data_list:
-        for p in data:
-            params.add(p)
-    params = list(params)
+class NaiveAccumulator(AverageAccumulator):
+    r'''Same as :class:`AverageAccumulator`, but data is weighted by the
+    ``instances`` in meta. The result equals to :func:`naive_aggregation`.
+    '''
 
-    for p in params:
-        param_state = param_states[p]
-        received_numbers = 0
-        for data in data_list:
-            if p in data:
-                received_numbers += 1
-                state = data[p]
-                for k in state:
-                    if state[k] is None:
-                        continue
-                    if k not in param_state:
-                        param_state[k] = []
+    def weight(self, meta: Any) -> float:
+        return meta['instances']
 
-                    param_state[k].append(state[k])
 
-        param_state['received_numbers'] = received_numbers
+class PaillierAccumulator(AverageAccumulator):
+    r'''Adds the received ciphertexts into running sums modulo ``p`` as soon
+    as they are downloaded, and decrypts the sums once in the end. The sums
+    are exact, and the memory cost is ``O(model)``. Plaintext states are
+    averaged as :class:`AverageAccumulator`.
 
-    for p, state in param_states.items():
-        received_numbers = state.pop('received_numbers')
-        for k, v in state.items():
-            state[k] = aggregate(v)
-        # decode
-        keys = [k[:-3] for k in state if k.endswith('_c1')]
-        for k in keys:
-            c1 = state[f'{k}_c1']
-            c2 = state[f'{k}_c2']
-            del state[f'{k}_c1']
-            del state[f'{k}_c2']
-            data = decode(c1, c2, received_numbers)
-            state[k] = data[:p.numel()].reshape_as(p)
+    Args:
+        private_key: The private key, or the path to it.
+        pack_bits: The same as :func:`paillier_package`. Default: ``0``
+        headroom: The same as :func:`paillier_package`. Default: ``4``
+        num_threads: If greater than ``0``, decrypt chunks of tensors on a
+            thread pool of ``num_threads`` threads, which is shared by all
+            the accumulators with the same ``num_threads``. Default: ``0``
+        chunk_size: The number of values decrypted at once. Default:
+            ``2**20``
+    '''
+
+    def __init__(self,
+                 private_key: Union[str, PrivateKey],
+                 pack_bits: int = 0,
+                 headroom: int = 4,
+                 num_threads: int = 0,
+                 chunk_size: int = 2**20):
+        if isinstance(private_key, str):
+            private_key = PrivateKey.load(private_key)
+        self.private_key = private_key
+        self.pack_bits = pack_bits
+        self.headroom = headroom
+        self.chunk_size = chunk_size
+        self.executor = _thread_pool(num_threads)
+        super().__init__()
+
+    def clear(self):
+        super().clear()
+        # sum of ciphertexts
+        self.ciphertexts: Dict[Tensor, Dict[str, Tensor]] = defaultdict(dict)
+        # the number of received ciphertexts
+        self.counts: Dict[Tensor, int] = defaultdict(int)
+
+    def add(self, data: Dict[Tensor, Any], meta: Optional[Any] = None):
+        plaintexts = dict()
+        for p, state in data.items():
+            self.counts[p] += 1
+            ciphertexts = self.ciphertexts[p]
+            plaintexts[p] = dict()
+            for k, v in state.items():
+                if k.endswith('_c1') or k.endswith('_c2'):
+                    v = expand_ciphertext(v)
+                    if k in ciphertexts:
+                        v = ciphertexts[k] + v
+                    ciphertexts[k] = v % self.private_key.p
+                else:
+                    plaintexts[p][k] = v
+        super().add(plaintexts, meta)
+
+    def param_states(self) -> Dict[Tensor, Dict[str, Any]]:
+        param_states = super().param_states()
+        for p, ciphertexts in self.ciphertexts.items():
+            state = param_states[p]
+            for k in [k[:-3] for k in ciphertexts if k.endswith('_c1')]:
+                v = _decrypt(self.private_key, ciphertexts[f'{k}_c1'],
+                             ciphertexts[f'{k}_c2'], self.counts[p],
+                             self.pack_bits, self.headroom, self.chunk_size,
+                             self.executor)
+                state[k] = v[:p.numel()].reshape_as(p)
+        return param_states
+
+
+class MaskAccumulator(AverageAccumulator):
+    r'''Sums the uploads masked by :func:`mask_package` modulo ``2^32``, where
+    the pairwise masks cancel. Plaintext states are averaged as
+    :class:`AverageAccumulator`.
+
+    The self-masks of the reported collaborators, and the masks paired with
+    the ones not reported, are removed by the seeds recovered from the shares
+    revealed by the reported ones, see :func:`unmask`. Later uploads of the
+    dropped collaborators in that round are discarded.
 
-        if p.requires_grad:
-            state['grad'] = p - state['param']
-        else:
-            p.copy_(state['param'])
-    if optim_list:
-        if not isinstance(optim_list, list):
-            optim_list = [
-                optim_list,
-            ]
-        for optim in optim_list:
-            load_param_states(optim, param_states)
-    return param_states
+    Args:
+        store: The store shared with collaborators. If ``None``, use the
+            store of the default maintainer. Default: ``None``
+        frac_bits: The same as :func:`mask_package`. Default: ``16``
+        session: The same as :func:`mask_package`. Default:
+            ``'openfed_mask'``
+        threshold: The same as :func:`mask_package`. Default: ``None``
+    '''
+
+    def __init__(self,
+                 store: Optional[Any] = None,
+                 frac_bits: int = 16,
+                 session: str = 'openfed_mask',
+                 threshold: Optional[int] = None):
+        _default_maintainer = DefaultMaintainer._default_maintainer
+        if store is None and _default_maintainer and _default_maintainer.pipe:
+            store = _default_maintainer.pipe.root_store
+        assert store is not None, 'A store is needed to remove the masks.'
+        self.store = store
+        self.frac_bits = frac_bits
+        self.session = session
+        self.threshold = threshold
+        # The rounds unmasked.
+        self.finished: List[Any] = []
+        super().__init__()
+
+    def clear(self):
+        super().clear()
+        # sum of masked states modulo 2^32
+        self.masked: Dict[Tensor, Dict[str, Tensor]] = defaultdict(dict)
+        # ranks of collaborators reported
+        self.reporters: Dict[Tensor, List[int]] = defaultdict(list)
+        # all ranks, version and index of each param
+        self.infos: Dict[Tensor, Any] = dict()
+
+    def add(self,
+            data: Dict[Tensor, Any],
+            meta: Optional[Any] = None) -> bool:
+        r'''Folds data into the running sums.
+
+        Returns:
+            ``False`` if data is discarded, because the collaborator has been
+            dropped in its round, or it is of another round than the summed
+            uploads. Nothing is folded then.
+        '''
+        # Check all states before folding any of them.
+        for p, state in data.items():
+            rank, ranks, version, index = state['mask_info']
+            if version in self.finished:
+                warnings.warn(f'Discard the upload of collaborator {rank}, '
+                              f'which has been dropped in round {version}.')
+                return False
+            if p in self.infos and self.infos[p][1] != version:
+                warnings.warn(f'Discard the upload of collaborator {rank} '
+                              f'in round {version}, masked uploads of '
+                              'different rounds can not be summed.')
+                return False
+
+        plaintexts = dict()
+        for p, state in data.items():
+            rank, ranks, version, index = state['mask_info']
+            self.infos[p] = (ranks, version, index)
+            self.reporters[p].append(rank)
+
+            masked = self.masked[p]
+            plaintexts[p] = dict()
+            for k, v in state.items():
+                if k.endswith('_masked'):
+                    v = v.long()
+                    if k in masked:
+                        v = masked[k].add_(v)
+                    masked[k] = v.bitwise_and_(2**32 - 1)
+                elif k != 'mask_info':
+                    plaintexts[p][k] = v
+        super().add(plaintexts, meta)
+        return True
+
+    def param_states(self) -> Dict[Tensor, Dict[str, Any]]:
+        param_states = super().param_states()
+        # self-mask seeds of reporters and seeds paired with dropped
+        # collaborators of each round
+        seeds: Dict[Any, Any] = dict()
+        for p, masked in self.masked.items():
+            ranks, version, index = self.infos[p]
+            reporters = self.reporters[p]
+            if version not in seeds:
+                seeds[version] = unmask(self.store, version, ranks,
+                                        reporters, self.session,
+                                        self.threshold)
+                self.finished.append(version)
+            self_seeds, pair_seeds = seeds[version]
+
+            state = param_states[p]
+            for k, v in masked.items():
+                k = k[:-len('_masked')]
+                for seed in self_seeds.values():
+                    mask = prg(derive_seed(seed, (index, k)), v.numel())
+                    v.sub_(mask.view_as(v).to(v.device))
+                # Remove the masks paired with dropped collaborators.
+                for rank, peers in pair_seeds.items():
+                    for peer, seed in peers.items():
+                        mask = prg(derive_seed(seed, (index, k)), v.numel())
+                        mask = mask.view_as(v).to(v.device)
+                        if rank < peer:
+                            v.sub_(mask)
+                        else:
+                            v.add_(mask)
+                state[k] = from_fixed(v, self.frac_bits, len(reporters))
+        return param_states
@@ -3,9 +3,20 @@
 # @Last Modified by  : Chen Dengsheng
 # @Last Modified time: 2021-09-25 16:53:02
 # Copyright (c) FederalLab. All rights reserved.
+import math
+from typing import Any, Dict, Tuple
+
 import torch
+from torch import Tensor
 
 from openfed.core.const import DefaultMaintainer
+from openfed.core.versions import VersionCache
+from openfed.federated.exceptions import InvalidUpload
+
+
+def _align(v, p):
+    # Keep integer tensors, such as ciphertexts, in their own dtype.
+    return v.to(p) if v.is_floating_point() else v.to(p.device)
 
 
 def device_alignment():
@@ -17,7 +28,7 @@ def device_alignment():
     def package(state, p):
         for k, v in state.items():
             if v is not None and isinstance(v, torch.Tensor):
-                state[k] = v.to(p)
+                state[k] = _align(v, p)
         return state
 
     _default_maintainer.register_package_hook(nice=100, package_hook=package)
@@ -25,23 +36,66 @@ def device_alignment():
     def unpackage(state, p):
         for k, v in state.items():
             if v is not None and isinstance(v, torch.Tensor):
-                state[k] = v.to(p)
+                state[k] = _align(v, p)
         return state
 
     _default_maintainer.register_unpackage_hook(
         nice=0, unpackage_hook=unpackage)
 
 
+def _pack_bits(mask: Tensor) -> Tensor:
+    # Eight bools per byte, the first one in the lowest bit. Each eight bools
+    # are read as an int64 of 0/1 bytes (little endian), and gathered into
+    # the highest byte by a multiplication.
+    mask = mask.reshape(-1)
+    if len(mask) % 8 != 0:
+        mask = torch.cat((mask, mask.new_zeros(8 - len(mask) % 8)))
+    x = mask.contiguous().view(torch.uint8).view(torch.int64)
+    return ((x * 0x0102040810204080) >> 56 & 0xFF).to(torch.uint8)
+
+
+def _unpack_bits(packed: Tensor, numel: int) -> Tensor:
+    # Copy each byte to all bytes of an int64, and keep the i-th bit in the
+    # i-th byte.
+    x = packed.to(torch.int64) * 0x0101010101010101
+    x &= 0x8040201008040201 - 2**64
+    return (x.view(torch.uint8) != 0)[:numel]
+
+
 def sign_gradient_clip(epsilon=0.001):
+    r'''Uploads the sign of ``param - original_param``, and aggregator
+    takes ``p - epsilon * sign`` as the ``param`` of collaborator. The signs
+    are sent as bitmaps, i.e., ``param_sign`` of the positive entries, and
+    ``param_nonzero`` of the nonzero entries if any entry is zero.
+
+    Args:
+        epsilon: The step size of aggregator. Default: ``0.001``
+    '''
     _default_maintainer = DefaultMaintainer._default_maintainer
 
     assert _default_maintainer, \
         'Define a maintainer and use `with maintainer` context.'
 
     if _default_maintainer.aggregator:
+        # The bits of each byte.
+        bits = (torch.arange(256).unsqueeze(1) >> torch.arange(8)) & 1
 
         def unpackage(state, p):
-            state['param'] = p - epsilon * state['param']
+            if 'param_sign' in state:
+                dtype = p.dtype if p.is_floating_point() else \
+                    torch.get_default_dtype()
+                # Look up the update of eight signs by each byte.
+                table = bits.to(p.device, dtype)
+                table = table.mul_(-2 * epsilon).add_(epsilon)
+                signs = state.pop('param_sign').int()
+                update = table.index_select(0, signs).view(-1)[:p.numel()]
+                if 'param_nonzero' in state:
+                    update.masked_fill_(
+                        ~_unpack_bits(state.pop('param_nonzero'), p.numel()),
+                        0)
+                state['param'] = update.view(p.shape).add_(p.detach())
+            else:
+                state['param'] = p - epsilon * state['param']
             return state
 
         _default_maintainer.register_unpackage_hook(
@@ -50,9 +104,324 @@ def sign_gradient_clip(epsilon=0.001):
 
         def package(state, p):
             assert 'original_param' in state
-            state['param'] = torch.sign(state['param'] -
-                                        state['original_param'])
+            # Aggregator takes its own ``p`` as the original param.
+            diff = state.pop('param') - state.pop('original_param')
+            state['param_sign'] = _pack_bits(diff > 0)
+            nonzero = diff != 0
+            if not nonzero.all():
+                state['param_nonzero'] = _pack_bits(nonzero)
             return state
 
         _default_maintainer.register_package_hook(
             nice=20, package_hook=package)
+
+
+def _quantize(v: Tensor, bits: int, block_size: int,
+              stochastic: bool) -> Tuple[Tensor, Tensor]:
+    # Symmetric quantization with a scale per block.
+    qmax = 2**(bits - 1) - 1
+    x = v.detach().reshape(-1).float()
+    numel = len(x)
+    block_size = block_size or max(numel, 1)
+    if numel % block_size != 0:
+        x = torch.cat((x, x.new_zeros(block_size - numel % block_size)))
+    x = x.view(-1, block_size)
+    scale = x.abs().amax(dim=1, keepdim=True).div_(qmax)
+    scale.masked_fill_(scale == 0, 1.0)
+    x = x / scale
+    if stochastic:
+        x.add_(torch.rand_like(x)).floor_()
+    else:
+        x.round_()
+    q = x.clamp_(-qmax, qmax).to(torch.int8).view(-1)[:numel]
+    if bits == 4:
+        # Two values in [1, 15] per byte.
+        q = (q + 8).to(torch.uint8)
+        if numel % 2 != 0:
+            q = torch.cat((q, q.new_zeros(1)))
+        q = q[0::2] | (q[1::2] << 4)
+    return q, scale.view(-1)
+
+
+def _dequantize(q: Tensor, scale: Tensor, bits: int, block_size: int,
+                p: Tensor) -> Tensor:
+    numel = p.numel()
+    if bits == 4:
+        q = torch.stack((q & 15, q >> 4), dim=1).view(-1)[:numel]
+        q = q.to(torch.int8) - 8
+    block_size = block_size or max(numel, 1)
+    x = q.to(scale.dtype)
+    if numel % block_size != 0:
+        x = torch.cat((x, x.new_zeros(block_size - numel % block_size)))
+    x = x.view(-1, block_size) * scale.view(-1, 1)
+    return x.view(-1)[:numel].view_as(p).to(p)
+
+
+def quantization(bits: int = 8, block_size: int = 0, stochastic: bool = True):
+    r'''Quantizes the transferred floating point tensors, whose shape is the
+    same as the param, such as ``param`` and momentum buffers, to ``bits``
+    bits integers, and dequantizes them on the other end. It should be
+    called on both ends with the same arguments.
+
+    The tensor ``v`` of key ``k`` is replaced by ``k_q`` and ``k_scale``.
+    Each upload is reported in the meta of the maintainer, i.e.,
+    ``dense_bytes`` and ``wire_bytes``, the bytes of quantized tensors before
+    and after quantization, and ``quantization_error``, the relative L2 error
+    of them.
+
+    Args:
+        bits: ``8`` or ``4``. Default: ``8``
+        block_size: The number of values sharing a scale. If ``0``, use a
+            scale per tensor. Default: ``0``
+        stochastic: If ``True``, use stochastic rounding, which is unbiased.
+            Default: ``True``
+
+    .. note::
+        It does not work together with encryption or masking.
+    '''
+    assert bits in (4, 8), 'Only 8 and 4 bits are supported.'
+
+    _default_maintainer = DefaultMaintainer._default_maintainer
+
+    assert _default_maintainer, \
+        'Define a maintainer and use `with maintainer` context.'
+
+    report = dict()
+
+    def package(state, p):
+        maintainer = _default_maintainer
+        if p is next(iter(maintainer.state_dict.values())):
+            report.update(dense_bytes=0, wire_bytes=0, error=0.0, norm=0.0)
+        for k, v in list(state.items()):
+            if not isinstance(v, Tensor) or not v.is_floating_point() or \
+                    v.shape != p.shape:
+                continue
+            q, scale = _quantize(v, bits, block_size, stochastic)
+            del state[k]
+            state[f'{k}_q'] = q
+            state[f'{k}_scale'] = scale
+
+            x = v.detach()
+            report['dense_bytes'] += x.numel() * x.element_size()
+            report['wire_bytes'] += q.numel() * q.element_size() + \
+                scale.numel() * scale.element_size()
+            report['error'] += (_dequantize(q, scale, bits, block_size, p) -
+                                x).pow(2).sum().item()
+            report['norm'] += x.float().pow(2).sum().item()
+        if report['wire_bytes'] > 0:
+            maintainer.meta.update(
+                dense_bytes=report['dense_bytes'],
+                wire_bytes=report['wire_bytes'],
+                quantization_error=math.sqrt(report['error'] /
+                                             max(report['norm'], 1e-12)))
+        return state
+
+    _default_maintainer.register_package_hook(nice=80, package_hook=package)
+
+    def unpackage(state, p):
+        for k in [k[:-2] for k in state if k.endswith('_q')]:
+            if f'{k}_scale' in state:
+                state[k] = _dequantize(
+                    state.pop(f'{k}_q'), state.pop(f'{k}_scale'), bits,
+                    block_size, p)
+        return state
+
+    _default_maintainer.register_unpackage_hook(
+        nice=10, unpackage_hook=unpackage)
+
+
+def topk_sparsification(ratio: float = 0.01, cache_size: int = 2):
+    r'''Uploads the ``ratio`` largest entries by magnitude of the update
+    ``param - original_param`` of collaborator, as ``param_indices`` and
+    ``param_values``. The dropped entries are kept by collaborator, and
+    added to the update of the next upload, i.e., error feedback. It should
+    be called on both ends.
+
+    ``original_param`` is taken from the packaged state if provided,
+    otherwise the ``param`` downloaded last time is used. Aggregator rebuilds
+    ``param`` as a sparse update of ``p``, which is folded into dense sums
+    by :func:`average_aggregation`, :func:`naive_aggregation`,
+    :func:`elastic_aggregation` and the accumulators, without densifying
+    each upload.
+
+    Collaborator tags the upload with the :attr:`Maintainer.generation` it
+    downloaded as ``base_generation``. If the aggregator serves another
+    generation since then, ``param`` is rebuilt densely on the global model
+    of that generation kept in :attr:`Maintainer.versions`, or the upload is
+    discarded if it is not kept any longer.
+
+    Args:
+        ratio: The fraction of entries to upload. Default: ``0.01``
+        cache_size: If the maintainer of aggregator does not keep versions,
+            a :class:`VersionCache` of ``cache_size`` models is assigned to
+            it. Default: ``2``
+
+    .. note::
+        An index and a value take 8 bytes, thus the upload shrinks by
+        ``1 / (2 * ratio)`` times.
+    '''
+    assert 0 < ratio <= 1
+
+    _default_maintainer = DefaultMaintainer._default_maintainer
+
+    assert _default_maintainer, \
+        'Define a maintainer and use `with maintainer` context.'
+
+    if _default_maintainer.aggregator:
+        if _default_maintainer.versions is None:
+            _default_maintainer.versions = VersionCache(cache_size)
+        versions = _default_maintainer.versions
+        names = {p: n for n, p in _default_maintainer.state_dict.items()}
+
+        def unpackage(state, p):
+            generation = state.pop('base_generation', None)
+            if 'param_indices' in state:
+                indices = torch.unravel_index(
+                    state.pop('param_indices').long(), p.shape)
+                # Check the received indices are in range.
+                update = torch.sparse_coo_tensor(
+                    torch.stack(indices),
+                    state.pop('param_values'),
+                    p.shape,
+                    check_invariants=True)
+                if generation is None or \
+                        generation == _default_maintainer.generation:
+                    # A sparse update of ``p``.
+                    state['param'] = update
+                else:
+                    # The update of a stale model, which is rebuilt on it.
+                    model = versions.get(generation)
+                    if model is None:
+                        raise InvalidUpload(
+                            f'Generation {generation} is not cached.')
+                    state['param'] = model[names[p]].to(p) + update.to(p)
+            return state
+
+        _default_maintainer.register_unpackage_hook(
+            nice=20, unpackage_hook=unpackage)
+    else:
+        original: Dict[Tensor, Tensor] = dict()
+        residual: Dict[Tensor, Tensor] = dict()
+
+        def unpackage(state, p):
+            v = state.get('param')
+            if isinstance(v, Tensor) and v.is_floating_point():
+                original[p] = v.detach().clone()
+            return state
+
+        _default_maintainer.register_unpackage_hook(
+            nice=20, unpackage_hook=unpackage)
+
+        def package(state, p):
+            v = state.get('param')
+            if not isinstance(v, Tensor) or not v.is_floating_point():
+                return state
+            base = state.pop('original_param', None)
+            if base is None:
+                base = original.get(p)
+            if base is None:
+                # Nothing downloaded yet, upload the dense param.
+                return state
+            update = (v.detach() - base).view(-1)
+            if p in residual:
+                update += residual[p]
+            k = max(1, int(update.numel() * ratio))
+            indices = update.abs().topk(k, sorted=False).indices
+            del state['param']
+            state['param_values'] = update[indices]
+            state['param_indices'] = indices.int() \
+                if update.numel() < 2**31 else indices
+            update[indices] = 0
+            residual[p] = update
+            if _default_maintainer.held_generation is not None:
+                state['base_generation'] = _default_maintainer.held_generation
+            return state
+
+        _default_maintainer.register_package_hook(
+            nice=30, package_hook=package)
+
+
+def delta_encoding(cache_size: int = 2):
+    r'''Uploads ``param - base`` as ``param_delta`` instead of ``param``,
+    where ``base`` is the global ``param`` downloaded last time. It should be
+    called on both ends. Combined with :func:`quantization`, which also
+    quantizes ``param_delta``, the small deltas are quantized with much
+    smaller errors than the params.
+
+    Aggregator tags each downloaded ``param`` with the
+    :attr:`Maintainer.generation` it serves as ``base_generation``, and
+    rebuilds ``param`` on the global model of that generation kept in
+    :attr:`Maintainer.versions`, even if the collaborator trained on a stale
+    model. If that model is not kept any longer, the upload is discarded.
+    The results of aggregation functions are not changed.
+
+    Args:
+        cache_size: If the maintainer of aggregator does not keep versions,
+            a :class:`VersionCache` of ``cache_size`` models is assigned to
+            it. Default: ``2``
+
+    .. note::
+        The generation of aggregator is renewed whenever the served model may
+        change, i.e., in :func:`Maintainer.package`,
+        :func:`Maintainer.load_state_dict` and
+        :func:`Maintainer.update_version`.
+    '''
+    _default_maintainer = DefaultMaintainer._default_maintainer
+
+    assert _default_maintainer, \
+        'Define a maintainer and use `with maintainer` context.'
+
+    if _default_maintainer.aggregator:
+        if _default_maintainer.versions is None:
+            _default_maintainer.versions = VersionCache(cache_size)
+        versions = _default_maintainer.versions
+        names = {p: n for n, p in _default_maintainer.state_dict.items()}
+
+        def package(state, p):
+            v = state.get('param')
+            if isinstance(v, Tensor) and v.is_floating_point():
+                state['base_generation'] = _default_maintainer.generation
+            return state
+
+        _default_maintainer.register_package_hook(
+            nice=40, package_hook=package)
+
+        def unpackage(state, p):
+            generation = state.pop('base_generation', None)
+            if 'param_delta' in state:
+                model = versions.get(generation)
+                if model is None:
+                    raise InvalidUpload(
+                        f'Generation {generation} is not cached.')
+                base = model[names[p]].to(p)
+                state['param'] = state.pop('param_delta').to(p) + base
+            return state
+
+        _default_maintainer.register_unpackage_hook(
+            nice=30, unpackage_hook=unpackage)
+    else:
+        # p -> (generation, the downloaded param)
+        bases: Dict[Tensor, Tuple[Any, Tensor]] = dict()
+
+        def unpackage(state, p):
+            generation = state.pop('base_generation', None)
+            v = state.get('param')
+            if generation is not None and isinstance(v, Tensor):
+                bases[p] = (generation, v.detach().clone())
+            return state
+
+        _default_maintainer.register_unpackage_hook(
+            nice=30, unpackage_hook=unpackage)
+
+        def package(state, p):
+            v = state.get('param')
+            if p not in bases or not isinstance(v, Tensor):
+                return state
+            generation, base = bases[p]
+            del state['param']
+            state['param_delta'] = v.detach() - base
+            state['base_generation'] = generation
+            return state
+
+        _default_maintainer.register_package_hook(
+            nice=40, package_hook=package)
@@ -0,0 +1,455 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 23:18:05
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 23:18:05
+# Copyright (c) FederalLab. All rights reserved.
+import hashlib
+import secrets
+import time
+from collections import deque
+from threading import Lock, Thread
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+from torch.distributed import distributed_c10d
+
+from openfed.core.const import DefaultMaintainer
+from openfed.federated.pipe import get_store_value, set_store_value
+
+# RFC 3526, 2048-bit MODP group.
+_prime = int(
+    'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+    '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+    '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+    'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+    '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+    '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+    'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+    '3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF', 16)
+_generator = 2
+
+# Masked values live in Z_{2^32}, stored as int32.
+_modulus = 2**32
+
+
+def derive_seed(*args: Any) -> int:
+    r'''Derives a 256-bit seed from ``args``.
+    '''
+    digest = hashlib.sha256(repr(args).encode()).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def prg(seed: int, numel: int) -> Tensor:
+    r'''Returns ``numel`` uniform 32-bit integers generated from ``seed``, as
+    an ``int32`` tensor.
+
+    The seed is expanded by SHAKE256, so that the known part of the masks,
+    e.g., of zero updates, does not reveal the rest.
+    '''
+    if numel == 0:
+        return torch.empty(0, dtype=torch.int32)
+    xof = hashlib.shake_256(seed.to_bytes(32, 'little'))
+    return torch.frombuffer(
+        bytearray(xof.digest(4 * numel)), dtype=torch.int32)
+
+
+def to_fixed(tensor: Tensor, frac_bits: int) -> Tensor:
+    r'''Maps ``tensor`` to fixed-point numbers with ``frac_bits`` fraction
+    bits, as an ``int64`` tensor.
+    '''
+    if not tensor.is_floating_point():
+        tensor = tensor.double()
+    return (tensor * 2**frac_bits).round_().long()
+
+
+def to_int32(tensor: Tensor) -> Tensor:
+    r'''Reduces an ``int64`` tensor modulo ``2^32`` into ``int32``.
+    '''
+    return tensor.add(2**31).bitwise_and_(_modulus - 1).sub_(2**31).int()
+
+
+def from_fixed(tensor: Tensor, frac_bits: int, denominator: float) -> Tensor:
+    r'''Maps the sum of fixed-point numbers modulo ``2^32`` back to the
+    average.
+    '''
+    return to_int32(tensor).float().div_(2**frac_bits * denominator)
+
+
+def share_secret(secret: int, xs: List[int],
+                 threshold: int) -> Dict[int, int]:
+    r'''Splits ``secret`` into Shamir shares over ``GF(_prime)``, any
+    ``threshold`` of which recover it.
+
+    Args:
+        secret: The secret, less than the prime.
+        xs: The non-zero points to evaluate the polynomial on.
+        threshold: The number of shares needed.
+
+    Returns:
+        The share of each point in ``xs``.
+    '''
+    coefficients = [secret] + [
+        secrets.randbelow(_prime) for _ in range(threshold - 1)
+    ]
+    shares = dict()
+    for x in xs:
+        y = 0
+        for c in reversed(coefficients):
+            y = (y * x + c) % _prime
+        shares[x] = y
+    return shares
+
+
+def recover_secret(shares: Dict[int, int]) -> int:
+    r'''Recovers the secret from Shamir shares by Lagrange interpolation at
+    ``0``, see :func:`share_secret`.
+    '''
+    secret = 0
+    for x, y in shares.items():
+        numerator, denominator = 1, 1
+        for other in shares:
+            if other != x:
+                numerator = numerator * other % _prime
+                denominator = denominator * (other - x) % _prime
+        secret += y * numerator * pow(denominator, -1, _prime)
+    return secret % _prime
+
+
+def _crypt(value: int, seed: int) -> int:
+    r'''Encrypts or decrypts a value less than ``2^2048`` by xor with the key
+    stream of ``seed``.
+    '''
+    stream = hashlib.shake_256(seed.to_bytes(32, 'little')).digest(256)
+    return value ^ int.from_bytes(stream, 'little')
+
+
+def _default_threshold(ranks: List[int]) -> int:
+    return len(ranks) // 2 + 1
+
+
+class PairwiseMask(object):
+    r'''Hides the uploaded tensors of a collaborator by double masking,
+    where the masks cancel or can be removed only in the sum of all
+    collaborators.
+
+    In each round ``v``, each collaborator ``i`` picks a fresh masking secret
+    ``s_i`` and a self-mask seed ``b_i``, and publishes ``g^s_i`` to the
+    shared store. The mask between collaborator ``i`` and ``j`` is generated
+    from the Diffie-Hellman secret of ``s_i`` and ``s_j``, which is added by
+    ``i`` and subtracted by ``j`` if ``i < j``. The self-mask generated from
+    ``b_i`` is added by ``i`` only. Both ``s_i`` and ``b_i`` are split into
+    ``threshold``-of-n Shamir shares, each encrypted for one collaborator by
+    a key agreed in the same way when created, and published to the store.
+
+    Once uploads are received, the aggregator publishes the dropped ranks of
+    the round. Each survivor answers in background with its share of ``b_j``
+    for each reported ``j``, and of ``s_j`` for each dropped ``j``, never
+    both for a rank, so that the self-masks of reporters and the unpaired
+    masks of dropped ones can be removed. A collaborator listed as dropped
+    does not answer. As ``threshold`` is more than half of collaborators,
+    the aggregator can not recover both secrets of any collaborator, thus
+    a single upload is never revealed, even if the dropped ranks are forged.
+    The secrets of a round are never used in other rounds.
+
+    Args:
+        store: The store shared by all collaborators and the aggregator.
+        rank: The rank of this collaborator.
+        ranks: The ranks of all collaborators, including ``rank``.
+        frac_bits: The fraction bits of the fixed-point numbers. The sum of
+            all collaborators must be in range ``(-2^(31 - frac_bits),
+            2^(31 - frac_bits))``. Default: ``16``
+        session: The prefix of keys in the store. Default: ``'openfed_mask'``
+        threshold: The number of survivors needed to remove the masks, more
+            than half of ``ranks``. If ``None``, use
+            ``len(ranks) // 2 + 1``. Default: ``None``
+
+    .. note::
+        Creating it blocks until all collaborators have published their
+        public keys, and masking the first tensor of a round blocks until all
+        of them have published the public values of that round.
+
+    .. note::
+        The aggregator is assumed to be honest-but-curious. The shares are
+        not authenticated, nor are the public values signed.
+    '''
+
+    def __init__(self,
+                 store: Any,
+                 rank: int,
+                 ranks: List[int],
+                 frac_bits: int = 16,
+                 session: str = 'openfed_mask',
+                 threshold: Optional[int] = None):
+        assert rank in ranks
+        assert len(ranks) > 1, 'Pairwise mask needs at least 2 collaborators.'
+        self.store = store
+        self.rank = rank
+        self.ranks = sorted(ranks)
+        self.frac_bits = frac_bits
+        self.session = session
+        self.threshold = threshold or _default_threshold(self.ranks)
+        assert len(self.ranks) // 2 < self.threshold <= len(self.ranks), \
+            'The threshold must be more than half of collaborators.'
+
+        # The keys to encrypt shares for each collaborator, including itself.
+        secret = secrets.randbelow(_prime - 3) + 2
+        set_store_value(self.store, f'{session}/pk/{rank}',
+                        hex(pow(_generator, secret, _prime)))
+        self.keys: Dict[int, int] = dict()
+        for peer in self.ranks:
+            # Blocks until the peer has published its public key.
+            public = int(get_store_value(self.store, f'{session}/pk/{peer}'),
+                         16)
+            self.keys[peer] = pow(public, secret, _prime)
+
+        # The self-mask seed and pairwise seeds of recent rounds.
+        self.rounds: Dict[Any, Tuple[int, Dict[int, int]]] = dict()
+        # The rounds that may be asked to reveal shares.
+        self.pending: deque = deque(maxlen=4)
+        self.lock = Lock()
+        self.stopped = False
+        self.thread = Thread(target=self._reveal, daemon=True)
+        self.thread.start()
+
+    def _share_key(self, sender: int, receiver: int, version: Any) -> int:
+        peer = receiver if sender == self.rank else sender
+        return derive_seed(self.keys[peer], 'share', version, sender,
+                           receiver)
+
+    def _advertise(self, version: Any) -> Tuple[int, Dict[int, int]]:
+        r'''Publishes the shares and the public value of round ``version``,
+        and agrees on the pairwise seeds with all collaborators.
+        '''
+        session = self.session
+        secret = secrets.randbelow(_prime - 3) + 2
+        self_seed = secrets.randbits(256)
+
+        xs = [peer + 1 for peer in self.ranks]
+        secret_shares = share_secret(secret, xs, self.threshold)
+        seed_shares = share_secret(self_seed, xs, self.threshold)
+        for peer in self.ranks:
+            key = self._share_key(self.rank, peer, version)
+            set_store_value(
+                self.store, f'{session}/{version}/shares/{self.rank}/{peer}',
+                [
+                    hex(_crypt(secret_shares[peer + 1], derive_seed(key, 0))),
+                    hex(_crypt(seed_shares[peer + 1], derive_seed(key, 1)))
+                ])
+        # Published after the shares, so that they exist once it is read.
+        set_store_value(self.store, f'{session}/{version}/pk/{self.rank}',
+                        hex(pow(_generator, secret, _prime)))
+
+        seeds = dict()
+        for peer in self.ranks:
+            if peer != self.rank:
+                # Blocks until the peer has published its public value.
+                public = int(
+                    get_store_value(self.store,
+                                    f'{session}/{version}/pk/{peer}'), 16)
+                seeds[peer] = derive_seed(pow(public, secret, _prime),
+                                          version)
+        return self_seed, seeds
+
+    def prepare(self, version: Any) -> Tuple[int, Dict[int, int]]:
+        r'''Agrees on the secrets of round ``version`` if not yet, which is
+        called by :func:`mask` otherwise.
+
+        Returns:
+            The self-mask seed, and the seed shared with each other
+            collaborator.
+        '''
+        with self.lock:
+            round_seeds = self.rounds.get(version)
+        if round_seeds is None:
+            round_seeds = self._advertise(version)
+            with self.lock:
+                if len(self.pending) == self.pending.maxlen:
+                    self.rounds.pop(self.pending[0], None)
+                self.rounds[version] = round_seeds
+                self.pending.append(version)
+        return round_seeds
+
+    def seed(self, peer: int, version: Any) -> int:
+        r'''Returns the seed shared with ``peer`` in round ``version``.
+        '''
+        return self.prepare(version)[1][peer]
+
+    def mask(self, tensor: Tensor, version: Any, key: Any) -> Tensor:
+        r'''Returns masked ``tensor`` as ``int32``.
+
+        Args:
+            tensor: The tensor to mask.
+            version: The round. All collaborators must use the same one.
+            key: Identifies the tensor in the model, the same for all
+                collaborators.
+        '''
+        self_seed, seeds = self.prepare(version)
+        fixed = to_fixed(tensor.detach().cpu(), self.frac_bits).reshape(-1)
+        fixed.add_(prg(derive_seed(self_seed, key), len(fixed)))
+        for peer, seed in seeds.items():
+            mask = prg(derive_seed(seed, key), len(fixed))
+            if self.rank < peer:
+                fixed.add_(mask)
+            else:
+                fixed.sub_(mask)
+        return to_int32(fixed).view(tensor.shape)
+
+    def _answer(self, version: Any, dropped: List[int]) -> Dict[str, str]:
+        r'''Returns the share of the masking secret of each dropped rank, and
+        of the self-mask seed of each other rank, in round ``version``.
+        '''
+        answer = dict()
+        for sender in self.ranks:
+            key = self._share_key(sender, self.rank, version)
+            shares = get_store_value(
+                self.store,
+                f'{self.session}/{version}/shares/{sender}/{self.rank}')
+            if sender in dropped:
+                share = _crypt(int(shares[0], 16), derive_seed(key, 0))
+            else:
+                share = _crypt(int(shares[1], 16), derive_seed(key, 1))
+            answer[str(sender)] = hex(share)
+        return answer
+
+    def _reveal(self):
+        while not self.stopped:
+            with self.lock:
+                pending = list(self.pending)
+            for version in pending:
+                key = f'{self.session}/{version}/dropped'
+                if not self.store.check([key]):
+                    continue
+                # Read once, so that only one kind of share of each rank is
+                # revealed in a round.
+                dropped = get_store_value(self.store, key)
+                if self.rank not in dropped:
+                    set_store_value(
+                        self.store, f'{self.session}/{version}/answers/'
+                        f'{self.rank}', self._answer(version, dropped))
+                with self.lock:
+                    self.pending.remove(version)
+                    self.rounds.pop(version, None)
+            time.sleep(0.1)
+
+    def close(self):
+        r'''Stops answering the aggregator.
+        '''
+        self.stopped = True
+        self.thread.join()
+
+
+def unmask(
+    store: Any,
+    version: Any,
+    ranks: List[int],
+    reporters: List[int],
+    session: str = 'openfed_mask',
+    threshold: Optional[int] = None
+) -> Tuple[Dict[int, int], Dict[int, Dict[int, int]]]:
+    r'''Publishes the dropped collaborators of round ``version``, and
+    recovers the seeds to remove the masks from the sum of the uploads of
+    ``reporters``.
+
+    Args:
+        store: The shared store.
+        version: The round.
+        ranks: The ranks of all collaborators.
+        reporters: The ranks of collaborators whose uploads are received.
+        session: The same as :class:`PairwiseMask`.
+        threshold: The same as :class:`PairwiseMask`.
+
+    Returns:
+        ``self_seeds[i]`` is the self-mask seed of reporter ``i``, and
+        ``seeds[i][j]`` is the seed shared by reporter ``i`` and dropped
+        ``j``.
+
+    .. note::
+        It blocks until ``threshold`` reporters have answered, and the uploads
+        of the dropped collaborators of this round must be discarded from now
+        on.
+    '''
+    ranks = sorted(ranks)
+    threshold = threshold or _default_threshold(ranks)
+    dropped = sorted(set(ranks) - set(reporters))
+    assert len(reporters) >= threshold, \
+        f'{len(reporters)} collaborators reported, less than the threshold ' \
+        f'{threshold} to remove the masks.'
+    set_store_value(store, f'{session}/{version}/dropped', dropped)
+
+    # shares of each rank, keyed by the point of the answering reporter
+    shares: Dict[int, Dict[int, int]] = {rank: dict() for rank in ranks}
+    for rank in sorted(reporters)[:threshold]:
+        key = f'{session}/{version}/answers/{rank}'
+        for k, v in get_store_value(store, key).items():
+            shares[int(k)][rank + 1] = int(v, 16)
+        store.delete_key(key)
+
+    self_seeds = {rank: recover_secret(shares[rank]) for rank in reporters}
+    seeds: Dict[int, Dict[int, int]] = {rank: dict() for rank in reporters}
+    for peer in dropped:
+        secret = recover_secret(shares[peer])
+        for rank in reporters:
+            public = int(
+                get_store_value(store, f'{session}/{version}/pk/{rank}'), 16)
+            seeds[rank][peer] = derive_seed(pow(public, secret, _prime),
+                                            version)
+    return self_seeds, seeds
+
+
+def mask_package(frac_bits: int = 16,
+                 session: str = 'openfed_mask',
+                 threshold: Optional[int] = None) -> Optional[PairwiseMask]:
+    r'''Masks the uploaded data of collaborators by :class:`PairwiseMask`.
+    The masked data is as large as the plaintext, and should be aggregated
+    by :func:`mask_aggregation` or :class:`MaskAccumulator`.
+
+    All collaborators must share the same address, which is not a
+    point-to-point one, and upload the same version in each round.
+
+    Args:
+        frac_bits: The same as :class:`PairwiseMask`. Default: ``16``
+        session: The same as :class:`PairwiseMask`. Default:
+            ``'openfed_mask'``
+        threshold: The same as :class:`PairwiseMask`. Default: ``None``
+
+    Returns:
+        The pairwise mask of collaborator, which can be closed by
+        ``mask.close()``.
+    '''
+    _default_maintainer = DefaultMaintainer._default_maintainer
+
+    assert _default_maintainer, \
+        'Define a maintainer and use `with maintainer` context.'
+
+    if not _default_maintainer.collaborator:
+        return None
+
+    pipe = _default_maintainer.pipe
+    with pipe.dist_props:
+        rank = distributed_c10d.get_rank()
+        world_size = distributed_c10d.get_world_size()
+    # The aggregator takes rank 0 of a shared address.
+    ranks = list(range(1, world_size))
+    pairwise_mask = PairwiseMask(pipe.root_store, rank, ranks, frac_bits,
+                                 session, threshold)
+    index = {
+        id(p): i
+        for i, p in enumerate(_default_maintainer.state_dict.values())
+    }
+
+    def package(state, p):
+        version = _default_maintainer.version
+        for k, v in list(state.items()):
+            if v is None:
+                del state[k]
+            elif isinstance(v, Tensor):
+                del state[k]
+                state[f'{k}_masked'] = pairwise_mask.mask(
+                    v, version, (index[id(p)], k))
+        state['mask_info'] = [rank, ranks, version, index[id(p)]]
+        return state
+
+    _default_maintainer.register_package_hook(nice=90, package_hook=package)
+
+    return pairwise_mask
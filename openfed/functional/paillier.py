@@ -3,8 +3,12 @@
 # @Last Modified by  : Chen Dengsheng
 # @Last Modified time: 2021-09-25 16:53:10
 # Copyright (c) FederalLab. All rights reserved.
+import os
 from abc import abstractmethod
-from typing import Union
+from concurrent.futures import Executor, ThreadPoolExecutor
+from queue import Full, Queue
+from threading import Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
@@ -12,6 +16,29 @@ from torch import Tensor
 from openfed.core.const import DefaultMaintainer
 from openfed.utils import FMT, tablist
 
+# Keys loaded from files, keyed by class, path, modified time and size.
+_loaded_keys: Dict[Tuple[type, str, float, int], 'Key'] = dict()
+_loaded_keys_lock = Lock()
+
+# Thread pools shared by encryption and decryption, keyed by the number of
+# threads, which live as long as the process.
+_thread_pools: Dict[int, ThreadPoolExecutor] = dict()
+_thread_pools_lock = Lock()
+
+
+def _thread_pool(num_threads: int) -> Optional[ThreadPoolExecutor]:
+    r'''Returns the shared thread pool of ``num_threads`` threads, or ``None``
+    if ``num_threads`` is not greater than ``0``. Hooks and accumulators
+    built in each round reuse it, instead of leaving a pool behind each.
+    '''
+    if num_threads <= 0:
+        return None
+    with _thread_pools_lock:
+        if num_threads not in _thread_pools:
+            _thread_pools[num_threads] = ThreadPoolExecutor(
+                num_threads, thread_name_prefix='openfed_paillier')
+        return _thread_pools[num_threads]
+
 
 class Key(object):
 
@@ -25,9 +52,47 @@ class Key(object):
         self.p = 2**self.bits + 1
         self.q = 2**self.bits
 
+        # matrices moved to other devices or dtypes
+        self._cache: Dict[Tuple[str, Any, Any], Tuple[Tensor, Tensor]] = dict()
+
     def save(self, key_file):
         torch.save(self.state_dict(), key_file)
 
+    def aligned(self, name: str, other: Tensor) -> Tensor:
+        r'''Returns the matrix ``name`` with the same device and dtype as
+        ``other``. The result is cached, and reused until the matrix is
+        replaced.
+
+        Args:
+            name: The name of matrix, such as ``A``, ``P`` and ``S``.
+            other: The tensor to align with.
+        '''
+        matrix = getattr(self, name)
+        key = (name, other.device, other.dtype)
+        cached = self._cache.get(key)
+        if cached is None or cached[0] is not matrix:
+            cached = (matrix, matrix.to(other))
+            self._cache[key] = cached
+        return cached[1]
+
+    @classmethod
+    def load(cls, key_file):
+        r'''Loads key from file. Keys loaded from the same path are shared in
+        the process, unless the file is modified.
+        '''
+        if not isinstance(key_file, (str, os.PathLike)):
+            return cls(**torch.load(key_file))
+        path = os.path.abspath(key_file)
+        stat = os.stat(path)
+        key = (cls, path, stat.st_mtime, stat.st_size)
+        with _loaded_keys_lock:
+            if key not in _loaded_keys:
+                # drop the outdated one
+                for k in [k for k in _loaded_keys if k[:2] == key[:2]]:
+                    del _loaded_keys[k]
+                _loaded_keys[key] = cls(**torch.load(path))
+            return _loaded_keys[key]
+
     def __repr__(self):
         head = ['n_lwe', 'bits', 'bits_safe', 'lines', 'bound', 'p', 'q']
         data = [
@@ -45,15 +110,78 @@ class Key(object):
 
 
 class PublicKey(Key):
-
-    def __init__(self, A, P, n_lwe, bits, lines, bound, **kwargs):
+    r'''The public key.
+
+    Args:
+        A: The public matrix. If ``None``, it will be regenerated from
+            ``seed``.
+        P: The public matrix derived from ``A`` and the private key.
+        seed: The seed to regenerate ``A``. Default: ``None``
+    '''
+
+    def __init__(self,
+                 A,
+                 P,
+                 n_lwe,
+                 bits,
+                 lines,
+                 bound,
+                 seed: Optional[int] = None,
+                 **kwargs):
         super().__init__(n_lwe, bits, lines, bound)
-        self.A = A
+        assert A is not None or seed is not None, \
+            'Either `A` or `seed` should be specified.'
+        self._A = A
         self.P = P
+        self.seed = seed
+
+    @property
+    def A(self) -> Tensor:
+        r'''The public matrix. If it is derived from seed, it is regenerated
+        on each access and not kept, see :func:`A_blocks` and
+        :func:`matmul_A`.
+        '''
+        if self._A is None:
+            return get_seeded_uniform_random_matrix(self.seed, self.n_lwe,
+                                                    self.n_lwe, self.q)
+        return self._A
+
+    def A_blocks(self, rows: int = 256) -> Iterator[Tuple[int, Tensor]]:
+        r'''Yields ``(row_start, block)`` of the public matrix. If it is
+        derived from seed and not materialized yet, the blocks are generated on
+        the fly, which takes ``rows x n_lwe`` memory at most.
+
+        Args:
+            rows: The rows of each block.
+        '''
+        for start in range(0, self.n_lwe, rows):
+            end = min(start + rows, self.n_lwe)
+            if self._A is not None:
+                yield start, self._A[start:end]
+            else:
+                yield start, get_seeded_uniform_random_matrix(
+                    self.seed, end - start, self.n_lwe, self.q, start)
+
+    def matmul_A(self, x: Tensor, rows: int = 256) -> Tensor:
+        r'''Returns ``x @ A`` with the device and dtype of ``x``. If ``A`` is
+        derived from seed, it is computed block by block, without
+        materializing ``A``.
+
+        Args:
+            x: A vector of ``n_lwe`` elements.
+            rows: The rows of each block.
+        '''
+        if self._A is not None:
+            return torch.matmul(x, self.aligned('A', x))
+        out = x.new_zeros(self.n_lwe)
+        for start, A in self.A_blocks(rows):
+            out += torch.matmul(x[start:start + len(A)], A.to(x))
+        return out
 
     def state_dict(self):
         return dict(
-            A=self.A,
+            A=self._A if self.seed is None else None,
+            seed=self.seed,
             P=self.P,
             n_lwe=self.n_lwe,
             bits=self.bits,
@@ -64,10 +192,6 @@ class PublicKey(Key):
             q=self.q,
         )
 
-    @classmethod
-    def load(cls, key_file):
-        return PublicKey(**torch.load(key_file))
-
 
 class PrivateKey(Key):
 
@@ -87,16 +211,21 @@ class PrivateKey(Key):
             q=self.q,
         )
 
-    @classmethod
-    def load(cls, key_file):
-        return PrivateKey(**torch.load(key_file))
-
 
 class Ciphertext(object):
+    r'''The ciphertext.
 
-    def __init__(self, c1, c2):
+    Args:
+        c1: The shared part of ciphertext.
+        c2: The ciphertext of each line.
+        p: The plaintext modulus. If specified, the sum of ciphertexts is
+            reduced modulo ``p``. Default: ``None``
+    '''
+
+    def __init__(self, c1, c2, p: Optional[int] = None):
         self.c1 = c1
         self.c2 = c2
+        self.p = p
 
     def __repr__(self):
         description = f'c1: {self.c1}, c2: {self.c2}'
@@ -104,7 +233,55 @@ class Ciphertext(object):
             class_name=self.__class__.__name__, description=description)
 
     def __add__(self, other):
-        return Ciphertext(self.c1 + other.c1, self.c2 + other.c2)
+        p = self.p or other.p
+        c1 = expand_ciphertext(self.c1) + expand_ciphertext(other.c1)
+        c2 = expand_ciphertext(self.c2) + expand_ciphertext(other.c2)
+        if p:
+            c1, c2 = c1 % p, c2 % p
+        return Ciphertext(c1, c2, p)
+
+
+# The narrowest integer types to hold ciphertexts with given bits.
+_compact_dtypes = [(8, torch.uint8), (16, torch.int16), (32, torch.int32)]
+
+
+def _compact_dtype(key: Key) -> torch.dtype:
+    for width, dtype in _compact_dtypes:
+        if key.bits <= width:
+            return dtype
+    return torch.int64
+
+
+def compact_ciphertext(key: Key, c: Tensor) -> Optional[Tensor]:
+    r'''Reduces ciphertext modulo ``p`` and stores it in the narrowest
+    integer type holding ``[0, 2**bits)``. Signed types are used as unsigned
+    ones with the same width, and restored by :func:`expand_ciphertext`.
+
+    As decryption is done modulo ``p``, the reduced ciphertext decrypts to
+    the same plaintext.
+
+    Returns:
+        The compact ciphertext, or ``None`` if it contains the residue
+        ``p - 1 == 2**bits``, which does not fit in ``bits``.
+    '''
+    c = c % key.p
+    dtype = _compact_dtype(key)
+    if dtype != torch.int64:
+        if bool((c == key.p - 1).any()):
+            return None
+        # Narrowing keeps the lower bits.
+        c = c.to(dtype)
+    return c
+
+
+def expand_ciphertext(c: Tensor) -> Tensor:
+    r'''Restores the ciphertext stored by :func:`compact_ciphertext` to
+    ``int64``. ``int64`` ciphertext is returned as it is.
+    '''
+    for width, dtype in _compact_dtypes:
+        if c.dtype == dtype:
+            return c.long() & (2**width - 1)
+    return c
 
 
 def get_discrete_gaussian_random_matrix(m, n, bits):
@@ -119,31 +296,163 @@ def get_uniform_random_matrix(m, n, q):
     return torch.randint(-q // 2 + 1, q // 2, (m, n)).long()
 
 
+def _to_int64(x: int) -> int:
+    # reinterpret uint64 as int64
+    x = x % 2**64
+    return x - 2**64 if x >= 2**63 else x
+
+
+_golden_gamma = _to_int64(0x9E3779B97F4A7C15)
+_mix_1 = _to_int64(0xBF58476D1CE4E5B9)
+_mix_2 = _to_int64(0x94D049BB133111EB)
+
+
+def _logical_right_shift(x: Tensor, k: int) -> Tensor:
+    return (x >> k) & ((1 << (64 - k)) - 1)
+
+
+def _splitmix64(x: Tensor) -> Tensor:
+    # int64 arithmetic wraps around, which is the same as uint64 bitwise.
+    x = (x ^ _logical_right_shift(x, 30)) * _mix_1
+    x = (x ^ _logical_right_shift(x, 27)) * _mix_2
+    return x ^ _logical_right_shift(x, 31)
+
+
+def get_seeded_uniform_random_matrix(seed: int,
+                                     m: int,
+                                     n: int,
+                                     q: int,
+                                     row_start: int = 0) -> Tensor:
+    r'''Returns rows ``[row_start, row_start + m)`` of a uniform random
+    matrix with ``n`` columns, which is fully determined by ``seed``.
+
+    The ``i``-th element (row major) is the ``i``-th output of SplitMix64
+    seeded with ``seed``, so that any block can be generated independently,
+    and the result does not depend on the version of PyTorch or the device.
+    '''
+    counter = torch.arange(
+        row_start * n + 1, (row_start + m) * n + 1, dtype=torch.long)
+    x = _splitmix64(_to_int64(seed) + counter * _golden_gamma)
+    # [-q // 2 + 1, q // 2), the same as get_uniform_random_matrix
+    return (torch.remainder(x, q - 1) + (-q // 2 + 1)).view(m, n)
+
+
 def key_gen(n_lwe: int = 3000,
             bits: int = 32,
             lines: int = 2**6,
-            bound: int = 2**3):
+            bound: int = 2**3,
+            seed: Optional[int] = None):
+    r'''Generates public and private key.
+
+    The public matrix ``A`` is derived from a seed instead of saved in the
+    public key, which shrinks the public key file from ``n_lwe x n_lwe`` to
+    ``n_lwe x lines`` integers.
+
+    Args:
+        seed: The seed of public matrix ``A``. If ``None``, a random seed is
+            used. Default: ``None``
+    '''
     p = 2**bits + 1
-    q = 2**bits
+    if seed is None:
+        seed = int(torch.randint(0, 2**62, (1, )).item())
     R = get_discrete_gaussian_random_matrix(n_lwe, lines, bits)
     S = get_discrete_gaussian_random_matrix(n_lwe, lines, bits)
-    A = get_uniform_random_matrix(n_lwe, n_lwe, q)
 
-    P = p * R - torch.matmul(A, S)
-    return PublicKey(A, P, n_lwe, bits, lines,
-                     bound), PrivateKey(S, n_lwe, bits, lines, bound)
+    public_key = PublicKey(None, None, n_lwe, bits, lines, bound, seed=seed)
+
+    # P = p * R - A @ S, without materializing A.
+    P = p * R
+    for start, A in public_key.A_blocks():
+        P[start:start + len(A)] -= torch.matmul(A, S)
+    public_key.P = P
+
+    return public_key, PrivateKey(S, n_lwe, bits, lines, bound)
 
 
-def paillier_enc(public_key: PublicKey, m: Tensor) -> Ciphertext:
+def paillier_noise(public_key: PublicKey,
+                   other: Optional[Tensor] = None) -> Tuple[Tensor, Tensor]:
+    r'''Samples the noise part of a ciphertext, i.e., ``c1`` and ``c2``
+    without plaintext. It takes almost all the time of encryption.
+
+    Args:
+        public_key: The public key.
+        other: The tensor to align device and dtype with. If ``None``, use
+            the public key as it is.
+    '''
+    other = public_key.P if other is None else other
     e1 = get_discrete_gaussian_random_vector(public_key.n_lwe,
-                                             public_key.bits).to(m)
+                                             public_key.bits).to(other)
     e2 = get_discrete_gaussian_random_vector(public_key.n_lwe,
-                                             public_key.bits).to(m)
+                                             public_key.bits).to(other)
     e3 = get_discrete_gaussian_random_vector(public_key.lines,
-                                             public_key.bits).to(m)
+                                             public_key.bits).to(other)
+
+    P = public_key.aligned('P', other)
+
+    c1 = public_key.matmul_A(e1) + public_key.p * e2
+    c2 = torch.matmul(e1, P) + public_key.p * e3
 
-    A = public_key.A.to(m)
-    P = public_key.P.to(m)
+    return c1, c2
+
+
+class NoisePool(object):
+    r'''Samples noise by :func:`paillier_noise` on a background thread, so
+    that encryption only costs one addition per value, e.g., while
+    collaborator is training.
+
+    Each noise is only used once.
+
+    Args:
+        public_key: The public key.
+        size: The number of noise to prepare in advance.
+    '''
+
+    def __init__(self, public_key: PublicKey, size: int = 2):
+        assert size > 0
+        self.public_key = public_key
+        self.queue: Queue = Queue(maxsize=size)
+        self.stopped = False
+        self.thread = Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        noise = None
+        while not self.stopped:
+            if noise is None:
+                noise = paillier_noise(self.public_key)
+            try:
+                self.queue.put(noise, timeout=0.1)
+                noise = None
+            except Full:
+                pass
+
+    def get(self) -> Tuple[Tensor, Tensor]:
+        r'''Returns a prepared noise. Blocks if there is no one.
+        '''
+        assert not self.stopped, 'Noise pool is closed.'
+        return self.queue.get()
+
+    def close(self):
+        r'''Stops the background thread.
+        '''
+        self.stopped = True
+        self.thread.join()
+
+
+def paillier_enc(public_key: PublicKey,
+                 m: Tensor,
+                 noise: Optional[Tuple[Tensor, Tensor]] = None) -> Ciphertext:
+    r'''Encrypts ``m``.
+
+    Args:
+        public_key: The public key.
+        m: The plaintext, see :func:`float_to_long`.
+        noise: The noise returned by :func:`paillier_noise`. It must not be
+            used twice. If ``None``, sample a new one. Default: ``None``
+    '''
+    if noise is None:
+        noise = paillier_noise(public_key, m)
+    c1, c2 = noise[0].to(m), noise[1].to(m)
 
     if len(m) % public_key.lines != 0:
         m = torch.cat(
@@ -152,29 +461,249 @@ def paillier_enc(public_key: PublicKey, m: Tensor) -> Ciphertext:
 
     m = m.reshape(-1, public_key.lines)
 
-    c1 = torch.matmul(e1, A) + public_key.p * e2
-    c2 = torch.matmul(e1, P) + public_key.p * e3
     c2 = c2.unsqueeze(dim=0) + m
 
-    return Ciphertext(c1, c2)
+    return Ciphertext(c1, c2, public_key.p)
 
 
 def paillier_dec(private_key: PrivateKey, c: Ciphertext) -> Tensor:
-    S = private_key.S.to(c.c1)
-    return (torch.matmul(c.c1, S).unsqueeze(0) +
-            c.c2).reshape(-1) % private_key.p
-
-
-def float_to_long(public_key: PublicKey, tensor: Tensor):
-    return ((tensor + public_key.bound) * 2**(public_key.bits_safe)).long()
-
-
-def long_to_float(private_key: PrivateKey, tensor: Tensor, denominator: float):
-    return tensor.float() / (
-        2**private_key.bits_safe) / denominator - private_key.bound
-
-
-def paillier_package(public_key: Union[str, PublicKey]):
+    c1, c2 = expand_ciphertext(c.c1), expand_ciphertext(c.c2)
+    S = private_key.aligned('S', c1)
+    return (torch.matmul(c1, S).unsqueeze(0) + c2).reshape(-1) % private_key.p
+
+
+def _packing(key: Key, pack_bits: int, headroom: int) -> Tuple[int, int]:
+    r'''Returns the width of each packed value and the number of values per
+    slot. The sum of ``2**headroom`` slots still fits in ``bits`` bits, thus
+    is smaller than ``p``.
+    '''
+    width = pack_bits + headroom
+    factor = key.bits // width
+    assert factor >= 1, \
+        f'{width} bits do not fit in a {key.bits} bits plaintext slot.'
+    return width, factor
+
+
+def float_to_long(public_key: PublicKey,
+                  tensor: Tensor,
+                  pack_bits: int = 0,
+                  headroom: int = 4) -> Tensor:
+    r'''Maps ``tensor`` to plaintext.
+
+    Args:
+        public_key: The public key.
+        tensor: The tensor in range ``[-bound, bound]``.
+        pack_bits: If greater than ``0``, quantize each value to
+            ``pack_bits`` bits, and pack ``bits // (pack_bits + headroom)``
+            of them into each plaintext slot. The plaintext is flattened and
+            shrunk by this factor. Default: ``0``
+        headroom: The bits reserved above each packed value for the sum of
+            ciphertexts, i.e., at most ``2**headroom`` ciphertexts can be
+            added together. Default: ``4``
+    '''
+    if pack_bits == 0:
+        return ((tensor + public_key.bound) * 2**(public_key.bits_safe)).long()
+
+    width, factor = _packing(public_key, pack_bits, headroom)
+    bound = public_key.bound
+    scale = (2**pack_bits - 1) / (2 * bound)
+    # Out of range values would overflow into the neighbours.
+    m = tensor.reshape(-1).clamp(-bound, bound)
+    m = m.add_(bound).mul_(scale).round_().long()
+    if len(m) % factor != 0:
+        m = torch.cat((m, m.new_zeros(factor - len(m) % factor)))
+    m = m.view(-1, factor)
+    packed = m[:, 0].clone()
+    for i in range(1, factor):
+        packed.add_(m[:, i].bitwise_left_shift(i * width))
+    return packed
+
+
+def long_to_float(private_key: PrivateKey,
+                  tensor: Tensor,
+                  denominator: float,
+                  pack_bits: int = 0,
+                  headroom: int = 4) -> Tensor:
+    r'''Maps the sum of decrypted plaintexts back to the average.
+
+    Args:
+        private_key: The private key.
+        tensor: The decrypted plaintext.
+        denominator: The number of summed ciphertexts.
+        pack_bits: The same as :func:`float_to_long`. The packed values are
+            unpacked into a flat tensor. Default: ``0``
+        headroom: The same as :func:`float_to_long`. Default: ``4``
+    '''
+    if pack_bits == 0:
+        return tensor.float() / (
+            2**private_key.bits_safe) / denominator - private_key.bound
+
+    assert denominator <= 2**headroom, \
+        f'The sum of {denominator} ciphertexts overflows {headroom} bits.'
+    width, factor = _packing(private_key, pack_bits, headroom)
+    scale = (2**pack_bits - 1) / (2 * private_key.bound)
+    tensor = tensor.reshape(-1)
+    m = tensor.new_empty(len(tensor), factor, dtype=torch.float)
+    for i in range(factor):
+        m[:,
+          i] = tensor.bitwise_right_shift(i * width).bitwise_and_(2**width - 1)
+    return m.view(-1).div_(scale * denominator).sub_(private_key.bound)
+
+
+def _encrypt_chunk(public_key: PublicKey, noise: Tensor, v: Tensor,
+                   out: Tensor, pack_bits: int, headroom: int) -> bool:
+    # Encrypts a chunk of plaintext into ``out`` with the noise part of c2.
+    m = float_to_long(public_key, v, pack_bits, headroom).view(-1)
+    if len(m) < out.numel():
+        m = torch.cat((m, m.new_zeros(out.numel() - len(m))))
+    c2 = compact_ciphertext(public_key,
+                            m.view_as(out).add_(noise.to(m.device)))
+    if c2 is None:
+        return False
+    out.copy_(c2)
+    return True
+
+
+def _encrypt_states(public_key: PublicKey,
+                    states: List[Dict[str, Any]],
+                    pool: Optional[NoisePool] = None,
+                    pack_bits: int = 0,
+                    headroom: int = 4,
+                    chunk_size: int = 2**20,
+                    executor: Optional[Executor] = None):
+    r'''Encrypts all tensors in ``states`` in place with one shared ``c1``.
+
+    Each tensor is padded to whole lines, and all of them are encrypted with
+    the same noise, as a single :func:`paillier_enc` call on the
+    concatenated plaintext does. The tensor ``v`` of key ``k`` is replaced by
+    ``k_c1``, the shared ``c1``, and ``k_c2``, its own lines of ``c2``. Thus,
+    each ``(k_c1, k_c2)`` pair can be decrypted on its own, the same as the
+    ciphertext of an individually encrypted tensor. Ciphertexts are stored by
+    :func:`compact_ciphertext`. Values are packed as :func:`float_to_long`.
+
+    Tensors are encrypted chunk by chunk, directly into the compact
+    ciphertext, so that the extra memory is bounded by a few chunks.
+
+    Args:
+        chunk_size: The number of values in each chunk.
+        executor: If specified, chunks are encrypted on it in parallel.
+    '''
+    tensors = []
+    for state in states:
+        for k, v in list(state.items()):
+            if v is None:
+                del state[k]
+            elif isinstance(v, Tensor):
+                tensors.append((state, k, v.detach().reshape(-1)))
+    if not tensors:
+        return
+
+    factor = _packing(public_key, pack_bits, headroom)[1] if pack_bits else 1
+    row_size = public_key.lines * factor
+    chunk_rows = max(1, chunk_size // row_size)
+    dtype = _compact_dtype(public_key)
+
+    def encrypt(task):
+        return _encrypt_chunk(public_key, *task, pack_bits, headroom)
+
+    while True:
+        noise = pool.get() if pool else paillier_noise(public_key)
+        # Draw new noise in the rare case that ciphertext is not compactable.
+        c1 = compact_ciphertext(public_key, noise[0])
+        if c1 is None:
+            continue
+        outputs, tasks = [], []
+        for _, _, v in tensors:
+            rows = (len(v) + row_size - 1) // row_size
+            out = torch.empty(rows, public_key.lines, dtype=dtype)
+            for r in range(0, rows, chunk_rows):
+                tasks.append(
+                    (noise[1], v[r * row_size:(r + chunk_rows) * row_size],
+                     out[r:r + chunk_rows]))
+            outputs.append(out)
+        if all((executor.map if executor else map)(encrypt, tasks)):
+            break
+
+    for (state, k, _), c2 in zip(tensors, outputs):
+        del state[k]
+        # The same c1 object is only transferred once.
+        state[f'{k}_c1'] = c1
+        state[f'{k}_c2'] = c2
+
+
+def _decrypt(private_key: PrivateKey,
+             c1: Tensor,
+             c2: Tensor,
+             denominator: float,
+             pack_bits: int = 0,
+             headroom: int = 4,
+             chunk_size: int = 2**20,
+             executor: Optional[Executor] = None) -> Tensor:
+    r'''Decrypts ``(c1, c2)`` and maps it to float by :func:`long_to_float`
+    chunk by chunk. Returns a flat tensor.
+
+    Args:
+        chunk_size: The number of values in each chunk.
+        executor: If specified, chunks are decrypted on it in parallel.
+    '''
+    c1 = expand_ciphertext(c1)
+    c1 = torch.matmul(c1, private_key.aligned('S', c1))
+    c2 = c2.reshape(-1, private_key.lines)
+
+    factor = _packing(private_key, pack_bits, headroom)[1] if pack_bits else 1
+    row_size = private_key.lines * factor
+    chunk_rows = max(1, chunk_size // row_size)
+    out = torch.empty(len(c2) * row_size, device=c2.device)
+
+    def decrypt(r):
+        m = (expand_ciphertext(c2[r:r + chunk_rows]) + c1) % private_key.p
+        out[r * row_size:(r + chunk_rows) * row_size] = long_to_float(
+            private_key, m, denominator, pack_bits, headroom).view(-1)
+
+    list((executor.map if executor else map)(decrypt,
+                                             range(0, len(c2), chunk_rows)))
+    return out
+
+
+def paillier_package(public_key: Union[str, PublicKey],
+                     batched: bool = False,
+                     pool_size: int = 0,
+                     pack_bits: int = 0,
+                     headroom: int = 4,
+                     num_threads: int = 0,
+                     chunk_size: int = 2**20) -> Optional[NoisePool]:
+    r'''Encrypts the uploaded data of collaborators.
+
+    Args:
+        public_key: The public key, or the path to it.
+        batched: If ``True``, encrypt all tensors of the model at once with
+            a shared ``c1``, instead of encrypting them one by one. It costs
+            one ``e1 @ A`` for the whole model, and sends ``c1`` only once.
+            As tensors are encrypted after the package hook of the last
+            parameter is called, it does not work with ``stream`` transfer
+            mode. Default: ``False``
+        pool_size: If greater than ``0``, prepare the noise of ``pool_size``
+            encryptions on a background thread, see :class:`NoisePool`.
+            Batched encryption takes one noise per upload, otherwise, one per
+            parameter. Default: ``0``
+        pack_bits: If greater than ``0``, quantize each value to
+            ``pack_bits`` bits and pack several of them into each plaintext
+            slot, see :func:`float_to_long`. Default: ``0``
+        headroom: The bits reserved for the sum of ciphertexts, i.e., at most
+            ``2**headroom`` collaborators. Default: ``4``
+        num_threads: If greater than ``0``, encrypt chunks of tensors on a
+            thread pool of ``num_threads`` threads, which is shared by all
+            the calls with the same ``num_threads``. Default: ``0``
+        chunk_size: The number of values encrypted at once, which bounds the
+            extra memory of encryption. Default: ``2**20``
+
+    Returns:
+        The noise pool, if any, which can be closed by ``pool.close()``.
+
+    .. note::
+        Ciphertexts should be aggregated by :func:`paillier_aggregation`,
+        with the same ``pack_bits`` and ``headroom``.
+    '''
     _default_maintainer = DefaultMaintainer._default_maintainer
 
     assert _default_maintainer, \
@@ -182,22 +711,40 @@ def paillier_package(public_key: Union[str, PublicKey]):
 
     if isinstance(public_key, str):
         public_key = PublicKey.load(public_key)
+    key: PublicKey = public_key  # type: ignore
 
+    pool = None
     if _default_maintainer.collaborator:
-
-        def package(state, p):
-            paillier_state = dict()
-            for k, v in state.items():
-                if v is not None:
-                    flat_v = float_to_long(
-                        public_key,  # type: ignore
-                        v).view(-1)
-                    ciphertext = paillier_enc(
-                        public_key,  # type: ignore
-                        flat_v)
-                    paillier_state[f'{k}_c1'] = ciphertext.c1
-                    paillier_state[f'{k}_c2'] = ciphertext.c2
-            return paillier_state
+        if pool_size > 0:
+            pool = NoisePool(key, pool_size)
+        executor = _thread_pool(num_threads)
+
+        def encrypt(states):
+            _encrypt_states(key, states, pool, pack_bits, headroom, chunk_size,
+                            executor)
+
+        if batched:
+            pending: List[Dict[str, Any]] = []
+
+            def package(state, p):
+                maintainer = _default_maintainer
+                params = list(maintainer.state_dict.values())
+                if p is params[0]:
+                    assert maintainer.pipe.transfer_mode != 'stream', \
+                        'Batched encryption does not work with stream mode.'
+                    pending.clear()
+                pending.append(state)
+                if p is params[-1]:
+                    encrypt(pending)
+                    pending.clear()
+                return state
+        else:
+
+            def package(state, p):
+                encrypt([state])
+                return state
 
         _default_maintainer.register_package_hook(
             nice=90, package_hook=package)
+
+    return pool
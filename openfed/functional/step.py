@@ -24,6 +24,11 @@ def count_step(counts: Union[List[int], int]):
         >>> # Stop when receive the fifth models.
         >>> # Then continue to receive the next fifteen models.
         >>> count_step([5, 15])
+
+    .. note::
+        A collaborator requesting a version ahead of aggregator is not
+        served until that version is published. Others download the full
+        model of the current version.
     '''
     _default_maintainer = DefaultMaintainer._default_maintainer
 
@@ -79,6 +84,11 @@ def period_step(period: float):
     Example::
 
         >>> period_step(15) # Stop the loop every 15 seconds.
+
+    .. note::
+        A collaborator requesting a version ahead of aggregator is not
+        served until that version is published. Others download the full
+        model of the current version.
     '''
     _default_maintainer = DefaultMaintainer._default_maintainer
 
@@ -86,8 +86,8 @@ def analysis(topo: Topology, node: Union[Node,
 
         lgp = lg.federated_properties
 
-        lgp.address = Address(lgp.address.backend, lgp.address.init_method,
-                              world_size, rank)
+        lgp.address = Address(
+            **dict(lgp.address.serialize(), world_size=world_size, rank=rank))
 
         aggregator_group_props.append(lgp)
 
@@ -118,11 +118,7 @@ def analysis(topo: Topology, node: Union[Node,
         fgp = fg.federated_properties
 
         fgp.address = Address(
-            fgp.address.backend,
-            fgp.address.init_method,
-            world_size,
-            rank,
-        )
+            **dict(fgp.address.serialize(), world_size=world_size, rank=rank))
         collaborator_group_props.append(fgp)
 
     return aggregator_group_props + collaborator_group_props
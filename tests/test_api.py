@@ -6,3 +6,92 @@
 def test_api():
     import openfed
     print(openfed.API)
+
+
+class Link(object):
+    # An in-memory pipe, whose aggregator end is serviced on download.
+
+    transfer_mode = 'object'
+
+    def __init__(self, aggregator):
+        from threading import Lock
+
+        from openfed.common import Meta
+        self.aggregator = aggregator
+        self.lock = Lock()
+        self.dist_props = self
+        self.meta = Meta()
+        self.received = None
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.lock.release()
+
+    def set_meta(self, meta):
+        from copy import deepcopy
+        self.meta = deepcopy(meta)
+
+    def upload(self, data):
+        import pickle
+        self.received = pickle.loads(pickle.dumps(data))
+
+    def not_modified(self):
+        from openfed.federated import not_modified
+        self.received = not_modified
+
+    def download(self, callback=None):
+        self.aggregator.pipe = self
+        self.aggregator._upload(self)
+        return self.received
+
+
+def test_api_test_round():
+    import torch
+    import torch.nn as nn
+
+    import openfed
+    from openfed.core import Maintainer
+    from openfed.federated import (FederatedProperties, aggregator,
+                                   collaborator)
+
+    def build_maintainer(role, **kwargs):
+        network = nn.Linear(4, 1)
+        maintainer = Maintainer(None, network.state_dict(keep_vars=True),
+                                **kwargs)
+        maintainer.fed_props = FederatedProperties(role, role,
+                                                   openfed.empty_address)
+        return maintainer
+
+    agg = build_maintainer(aggregator)
+    col = build_maintainer(collaborator, conditional_download=True)
+    col.pipe = Link(agg)
+
+    received = []
+
+    def step():
+        # The collaborator downloads twice in each round, and the second one
+        # is answered without data.
+        for _ in range(2):
+            assert col.step(upload=False)
+            received.append(col.data['weight']['param'].clone())
+        return True
+
+    def agg_func(**kwargs):
+        with torch.no_grad():
+            for p in agg.state_dict.values():
+                p.add_(1.0)
+
+    agg.step = step
+    fed_optim = openfed.optim.FederatedOptimizer(
+        torch.optim.SGD(agg.state_dict.values(), lr=1.0), aggregator)
+    openfed.API(agg, fed_optim, 1, agg_func, with_test_round=True).run()
+
+    weight = agg.state_dict['weight']
+    assert len(received) == 4
+    assert torch.equal(received[0], received[1])
+    # The test round evaluates the aggregated model.
+    assert torch.equal(received[2], weight)
+    assert torch.equal(received[3], weight)
+    assert not torch.equal(received[0], received[2])
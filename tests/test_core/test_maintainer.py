@@ -127,3 +127,350 @@ def test_maintainer_collaborator_alpha():
 @pytest.mark.run(order=9)
 def test_maintainer_collaborator_beta():
     collaborator_beta()
+
+
+def build_offline_maintainer(role, **kwargs):
+    # A maintainer without connection, whose transfers are replaced.
+    import torch.nn as nn
+
+    import openfed
+    from openfed.core import Maintainer
+    from openfed.federated import FederatedProperties
+
+    network = nn.Linear(4, 1)
+    maintainer = Maintainer(None, network.state_dict(keep_vars=True),
+                            **kwargs)
+    maintainer.fed_props = FederatedProperties(role, role,
+                                               openfed.empty_address)
+    return maintainer
+
+
+def test_worker_step_hooks():
+    from openfed.federated import aggregator, pull
+    from openfed.functional import after_upload, at_last, before_upload
+
+    maintainer = build_offline_maintainer(aggregator, max_workers=2)
+    maintainer._upload = lambda pipe: True
+
+    calls = []
+    maintainer.register_step_hook(
+        nice=50, step_hook=lambda mt: True, step_name=before_upload)
+    maintainer.register_step_hook(
+        nice=50,
+        step_hook=lambda mt, flag: calls.append(after_upload),
+        step_name=after_upload)
+    maintainer.register_step_hook(
+        nice=50,
+        step_hook=lambda mt: calls.append(at_last),
+        step_name=at_last)
+
+    pipes = [object(), object()]
+    maintainer.pipes = list(pipes)
+    maintainer._service_pipes(maintainer._step, [pull, pull])
+    # `at_last` is not called until the jobs are finished.
+    assert calls == []
+    maintainer._finish_jobs(maintainer._step, wait=True)
+    assert calls == [after_upload, at_last] * 2
+
+
+def test_discarded_meta():
+    from openfed.common import Meta
+    from openfed.federated import aggregator
+
+    class Accumulator(object):
+
+        def add(self, data, meta):
+            return meta['accept']
+
+        def clear(self):
+            pass
+
+    maintainer = build_offline_maintainer(aggregator)
+    maintainer.register_accumulator(Accumulator())
+    data = {n: dict(param=p) for n, p in maintainer.state_dict.items()}
+
+    assert maintainer._record(data, Meta(accept=True))
+    # the meta of discarded data is not kept
+    assert not maintainer._record(data, Meta(accept=False))
+    assert len(maintainer.meta_list) == 1
+
+
+class FakePipe(object):
+    # A pipe without connection, whose transfers are replaced.
+
+    transfer_mode = 'object'
+
+    def __init__(self, state=None):
+        from threading import Lock
+
+        from openfed.common import Meta
+        self.state = state
+        self.root_store = None
+        self.lock = Lock()
+        self.dist_props = self
+        self.meta = Meta()
+
+    def __enter__(self):
+        self.lock.acquire()
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.lock.release()
+
+    def _read(self):
+        pass
+
+    def set_meta(self, meta):
+        self.meta = meta
+
+
+def test_upload_async_snapshot():
+    import threading
+
+    import torch
+
+    from openfed.federated import collaborator
+
+    maintainer = build_offline_maintainer(collaborator)
+    maintainer.pipe = FakePipe()
+    started, release = threading.Event(), threading.Event()
+    uploaded = dict()
+
+    def upload(data):
+        started.set()
+        assert release.wait(timeout=5)
+        uploaded.update(data)
+
+    maintainer.pipe.upload = upload
+    maintainer.package()
+    weight = maintainer.state_dict['weight']
+    expected = weight.detach().clone()
+
+    future = maintainer.upload_async()
+    # train while uploading
+    assert started.wait(timeout=5)
+    with torch.no_grad():
+        weight.add_(1.0)
+    release.set()
+
+    assert future.result()
+    assert torch.equal(uploaded['weight']['param'], expected)
+
+
+def test_upload_overlaps_download():
+    import threading
+
+    from openfed.federated import collaborator
+
+    maintainer = build_offline_maintainer(collaborator)
+    maintainer.pipe = FakePipe()
+    downloaded = threading.Event()
+    data = {
+        n: dict(param=p.detach().clone())
+        for n, p in maintainer.state_dict.items()
+    }
+
+    def upload(data):
+        # The upload is not finished until the download is started.
+        assert downloaded.wait(timeout=5)
+
+    def download(callback=None):
+        downloaded.set()
+        return data
+
+    maintainer.pipe.upload = upload
+    maintainer.pipe.download = download
+    maintainer.package()
+
+    future = maintainer.upload_async()
+    assert maintainer.download()
+    assert future.result()
+    assert maintainer.data['weight']['param'] is data['weight']['param']
+
+
+def test_not_modified_offline():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from torch.distributed import HashStore
+
+    from openfed.common import Address, Meta
+    from openfed.federated import (FederatedProperties, Pipe, aggregator,
+                                   collaborator)
+
+    class StorePipe(Pipe):
+        # A pipe on a local store, without process group to destroy.
+
+        def __del__(self):
+            pass
+
+    store = HashStore()
+    address = Address('null', 'null', timeout=0.1, backoff_max=0.01)
+
+    def build_pipe(role):
+        return StorePipe(store, None, None,
+                         FederatedProperties(role, role, address))
+
+    # Each end waits for the other one to publish its state.
+    with ThreadPoolExecutor(2) as executor:
+        aggregator_pipe, collaborator_pipe = executor.map(
+            build_pipe, [aggregator, collaborator])
+
+    maintainer = build_offline_maintainer(aggregator)
+    maintainer.package()
+    collaborator_pipe.set_meta(Meta(held_generation=maintainer.generation))
+    # The collaborator pulls, but never reads the answer.
+    collaborator_pipe.pulling()
+
+    with pytest.warns(UserWarning):
+        assert maintainer._upload(aggregator_pipe) is False
+    assert maintainer._stats['not_modified'] == 0
+
+
+def test_versions_by_generation():
+    import torch
+
+    from openfed.core import VersionCache
+    from openfed.federated import aggregator
+
+    maintainer = build_offline_maintainer(
+        aggregator, versions=VersionCache(2))
+    maintainer.transfer = lambda **kwargs: True
+    weight = maintainer.state_dict['weight']
+
+    maintainer.package()
+    train_generation = maintainer.generation
+    assert maintainer._upload(FakePipe())
+    # The test round serves the aggregated model in the same version.
+    with torch.no_grad():
+        weight.add_(1.0)
+    maintainer.package()
+    assert maintainer._upload(FakePipe())
+
+    assert torch.equal(
+        maintainer.versions.get(train_generation)['weight'] + 1.0,
+        weight.detach())
+    assert torch.equal(
+        maintainer.versions.get(maintainer.generation)['weight'],
+        weight.detach())
+
+
+def test_async_ready():
+    import asyncio
+
+    from openfed.core import AsyncMaintainer
+    from openfed.federated import aggregator, pull, zombie
+
+    maintainer = build_offline_maintainer(aggregator)
+    pipes = [FakePipe(zombie), FakePipe(zombie)]
+    maintainer.pipes = list(pipes)
+    amt = AsyncMaintainer(maintainer)
+
+    async def main():
+        task = asyncio.ensure_future(amt.ready())
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        pipes[1].state = pull
+        return await asyncio.wait_for(task, timeout=5)
+
+    assert asyncio.run(main()) == [pipes[1]]
+
+
+def test_async_step():
+    import asyncio
+    import threading
+
+    from openfed.core import AsyncMaintainer
+    from openfed.federated import aggregator, pull, zombie
+    from openfed.functional import after_upload, at_new_episode, before_upload
+
+    maintainer = build_offline_maintainer(aggregator)
+    pipes = [FakePipe(pull), FakePipe(pull)]
+    maintainer.pipes = list(pipes)
+    maintainer.pipe = pipes[0]
+
+    # Both pipes are serviced at the same time, or the barrier breaks.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def upload(pipe):
+        barrier.wait()
+        pipe.state = zombie
+        return True
+
+    maintainer._upload = upload
+
+    threads, served = set(), []
+
+    def after_upload_hook(mt, flag):
+        assert flag
+        served.append(mt.pipe)
+        if len(served) == len(pipes):
+            mt.manual_stop()
+
+    maintainer.register_step_hook(
+        nice=50,
+        step_hook=lambda mt: threads.add(threading.get_ident()),
+        step_name=at_new_episode)
+    maintainer.register_step_hook(
+        nice=50, step_hook=lambda mt: True, step_name=before_upload)
+    maintainer.register_step_hook(
+        nice=50, step_hook=after_upload_hook, step_name=after_upload)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        assert await AsyncMaintainer(maintainer).step()
+        return loop_thread
+
+    loop_thread = asyncio.run(main())
+    assert sorted(map(id, served)) == sorted(map(id, pipes))
+    # step hooks are not called in the loop thread
+    assert loop_thread not in threads
+    assert not pipes[0].lock.locked()
+
+
+def test_stream_fold():
+    import torch
+
+    from openfed.common import Meta
+    from openfed.federated import (ChunkJoiner, aggregator, iter_chunks,
+                                   openfed_meta)
+
+    maintainer = build_offline_maintainer(aggregator)
+    added = []
+
+    class Accumulator(object):
+
+        def add(self, data, meta):
+            assert meta['instances'] == 2
+            added.append({p: state['param'] for p, state in data.items()})
+
+        def clear(self):
+            pass
+
+    maintainer.register_accumulator(Accumulator())
+    pipe = FakePipe()
+    pipe.transfer_mode = 'stream'
+    pipe.meta = Meta(instances=2)
+    items = [(n, dict(param=p.detach().clone()))
+             for n, p in maintainer.state_dict.items()]
+    items.append((openfed_meta, Meta(instances=2, loss=0.1)))
+
+    def download(callback=None):
+        joiner = ChunkJoiner()
+        # the weight of 16 bytes is sliced
+        for chunk in iter_chunks(iter(items), chunk_size=8):
+            chunk = joiner(chunk)
+            if chunk:
+                callback(chunk)
+        return True
+
+    pipe.download = download
+    maintainer.pipe = pipe
+
+    data, meta = maintainer._download(pipe)
+    # each parameter is folded once it arrives
+    assert data is None
+    assert len(added) == 2
+    for (n, state), folded in zip(items, added):
+        p = maintainer.state_dict[n]
+        assert torch.equal(folded[p], state['param'])
+    assert maintainer._record(data, meta)
+    assert maintainer.meta_list[0]['loss'] == 0.1
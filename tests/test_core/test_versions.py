@@ -0,0 +1,73 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-17 10:40:18
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-17 10:40:18
+# Copyright (c) FederalLab. All rights reserved.
+import os
+
+import pytest
+import torch
+
+from openfed.core import VersionCache
+
+
+def build_model(value):
+    return dict(w=torch.full((4, 4), float(value)), step=torch.tensor(value))
+
+
+def test_version_cache():
+    versions = VersionCache(max_versions=2)
+    model = build_model(0)
+    versions.put(0, model)
+    model['w'].add_(1.0)
+    # a copy is kept
+    assert torch.equal(versions.get(0)['w'], torch.zeros(4, 4))
+
+    versions.put(1, build_model(1))
+    versions.get(0)
+    versions.put(2, build_model(2))
+    # the least recently used one is evicted
+    assert versions.versions() == [0, 2]
+    assert versions.get(1) is None
+    assert versions.nbytes == 2 * (64 + 8)
+
+    # a version identifies one model
+    with pytest.warns(UserWarning, match='version 2 is changed'):
+        versions.put(2, build_model(3))
+    assert torch.equal(versions.get(2)['w'], torch.full((4, 4), 2.0))
+
+    versions.clear()
+    assert len(versions) == 0 and versions.nbytes == 0
+
+
+def test_version_cache_budget(tmp_path):
+    # drop models out of budget
+    versions = VersionCache(max_versions=4, max_bytes=150)
+    for version in range(3):
+        versions.put(version, build_model(version))
+    assert versions.versions() == [1, 2]
+
+    # the newest one is never evicted
+    versions = VersionCache(max_versions=4, max_bytes=100)
+    for version in range(3):
+        versions.put(version, build_model(version))
+        assert versions.get(version) is not None
+    assert versions.versions() == [2]
+    with pytest.raises(ValueError):
+        VersionCache(max_bytes=50).put(0, build_model(0))
+
+    # spill models out of budget
+    spill_dir = str(tmp_path)
+    versions = VersionCache(max_versions=3, max_bytes=150, spill_dir=spill_dir)
+    for version in range(4):
+        versions.put(version, build_model(version))
+    assert versions.versions() == [1, 2, 3]
+    assert list(versions.spilled) == [1]
+    assert versions.nbytes == 2 * (64 + 8)
+    assert os.listdir(spill_dir) == ['version_1.pt']
+    for version in range(1, 4):
+        assert torch.equal(
+            versions.get(version)['w'], torch.full((4, 4), float(version)))
+
+    versions.clear()
+    assert os.listdir(spill_dir) == []
@@ -0,0 +1,145 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 10:40:12
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 10:40:12
+# Copyright (c) FederalLab. All rights reserved.
+import json
+import pickle
+import threading
+
+import torch
+
+from openfed.federated import (ChunkJoiner, Serialized, iter_chunks,
+                               pack_tensors, prefetch, recv_object,
+                               recv_tensors, send_object, send_tensors,
+                               tensor_bytes, unpack_tensors)
+
+
+def test_pack_tensors():
+    weight = torch.randn(3, 4, requires_grad=True)
+    data = {
+        'weight': dict(param=weight, step=torch.tensor(3), lr=None),
+        'bias': dict(param=torch.zeros(0), shape=(1, 2), flag=[True]),
+    }
+    header, tensors = pack_tensors(data)
+    # header must be json serializable
+    header = json.loads(json.dumps(header))
+    assert len(tensors) == 3
+
+    output = unpack_tensors(header, tensors)
+    assert torch.equal(output['weight']['param'], weight.detach())
+    assert not output['weight']['param'].requires_grad
+    assert output['weight']['step'].item() == 3
+    assert output['weight']['lr'] is None
+    assert output['bias']['param'].numel() == 0
+    assert output['bias']['shape'] == (1, 2)
+    assert output['bias']['flag'] == [True]
+
+
+def test_pack_shared_tensors():
+    shared = torch.randn(5)
+    header, tensors = pack_tensors(dict(a=shared, b=shared))
+    assert len(tensors) == 1
+
+    output = unpack_tensors(header, tensors)
+    assert output['a'] is output['b']
+
+
+def test_iter_chunks():
+    items = [(f'p{i}', dict(param=torch.zeros(i + 1))) for i in range(4)]
+    # float32, 4 bytes per element
+    chunks = list(iter_chunks(iter(items), chunk_size=12))
+    assert [list(c.keys()) for c in chunks][:2] == [['p0', 'p1'], ['p2']]
+    # p3 is larger than the chunk budget, and sent in slices
+    assert all(tensor_bytes(c) <= 12 for c in chunks)
+    assert len(chunks) == 5
+
+
+def test_chunk_joiner():
+    items = [('p0', dict(param=torch.randn(2), step=3)),
+             ('p1', dict(param=torch.randn(5, 3), exp_avg=torch.randn(7))),
+             ('p2', dict(param=torch.empty(0)))]
+    joiner = ChunkJoiner()
+    output = dict()
+    for chunk in iter_chunks(iter(items), chunk_size=16):
+        assert tensor_bytes(chunk) <= 16
+        # sent and received as raw tensors
+        chunk = unpack_tensors(*pack_tensors(chunk))
+        output.update(joiner(chunk))
+    assert list(output.keys()) == ['p0', 'p1', 'p2']
+    assert len(joiner.pending) == 0
+    for k, v in items:
+        for name, t in v.items():
+            if isinstance(t, torch.Tensor):
+                assert torch.equal(output[k][name], t)
+            else:
+                assert output[k][name] == t
+
+
+def test_serialized():
+    data = dict(weight=dict(param=torch.randn(3, 4)))
+    serialized = Serialized(data)
+    data['weight']['param'] = None
+
+    # pickled once, the later changes are not seen
+    output = pickle.loads(pickle.dumps(serialized))
+    assert isinstance(output, dict)
+    assert output['weight']['param'].shape == (3, 4)
+
+
+def test_prefetch():
+    produced = []
+    second = threading.Event()
+
+    def produce():
+        for i in range(3):
+            produced.append(threading.current_thread())
+            if i == 1:
+                second.set()
+            yield i
+
+    items = prefetch(produce())
+    assert next(items) == 0
+    # the next one is produced in background
+    assert second.wait(timeout=30)
+    assert len(produced) == 2
+    assert list(items) == [1, 2]
+    assert threading.current_thread() not in produced
+
+
+class LoopbackGroup(object):
+    # A process group of which sent tensors are received by itself.
+
+    class Work(object):
+
+        def wait(self):
+            return True
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, tensors, dst, tag):
+        self.sent.append((dst, tensors[0].clone()))
+        return self.Work()
+
+    def recv(self, tensors, src, tag):
+        dst, t = self.sent.pop(0)
+        assert dst == src
+        tensors[0].copy_(t)
+        return self.Work()
+
+
+def test_send_recv():
+    # No global states of torch.distributed are needed.
+    group = LoopbackGroup()
+    data = dict(weight=dict(param=torch.randn(3, 4), step=3))
+
+    send_tensors(data, 1, group)
+    output = recv_tensors(1, group)
+    assert torch.equal(output['weight']['param'], data['weight']['param'])
+    assert output['weight']['step'] == 3
+
+    send_object(Serialized(data), 1, group)
+    output = recv_object(1, group)
+    assert torch.equal(output['weight']['param'], data['weight']['param'])
+    assert len(group.sent) == 0
@@ -0,0 +1,77 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 14:21:05
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 14:21:05
+# Copyright (c) FederalLab. All rights reserved.
+import torch
+
+import openfed.functional.agg as agg
+from openfed.functional import (AverageAccumulator, NaiveAccumulator,
+                                average_aggregation, naive_aggregation)
+
+
+def build_data_list(params, partial, clients=5):
+    torch.manual_seed(0)
+    data_list, meta_list = [], []
+    for i in range(clients):
+        data = dict()
+        for p in params:
+            data[p] = dict(param=torch.randn_like(p))
+            if not partial or i % 2 == 0:
+                data[p]['momentum'] = torch.randn_like(p)
+        data_list.append(data)
+        meta_list.append(dict(instances=i + 1))
+    return data_list, meta_list
+
+
+def check(agg_func, accumulator, partial=False):
+    params = [torch.randn(3, 4, requires_grad=True), torch.randn(6)]
+    data_list, meta_list = build_data_list(params, partial)
+
+    accumulator.clear()
+    for data, meta in zip(data_list, meta_list):
+        accumulator.add(data, meta)
+    output = accumulator(data_list=[], meta_list=meta_list)
+
+    expected = agg_func(data_list=data_list, meta_list=meta_list)
+
+    for p in params:
+        assert output[p].keys() == expected[p].keys()
+        for k in expected[p]:
+            assert torch.allclose(output[p][k], expected[p][k], atol=1e-6)
+
+
+def test_average_accumulator():
+    check(average_aggregation, AverageAccumulator(), partial=True)
+
+
+def test_naive_accumulator():
+    check(naive_aggregation, NaiveAccumulator())
+
+
+def test_flat_aggregation():
+    params = [torch.randn(3, 4, requires_grad=True), torch.randn(2)]
+    data_list, meta_list = build_data_list(params, partial=False)
+    for i, data in enumerate(data_list):
+        # non floating states
+        data[params[1]] = dict(param=torch.tensor([5, i]), momentum=None)
+
+    for flat, loop in [
+        (agg._flat_aggregate(data_list, dtype=torch.float),
+         agg._average_aggregate(data_list)),
+        (agg._weighted_flat_aggregate(data_list, meta_list),
+         agg._weighted_aggregate(data_list, meta_list)),
+    ]:
+        for p in params:
+            assert flat[p].keys() == loop[p].keys()
+            for k in loop[p]:
+                assert flat[p][k].dtype == loop[p][k].dtype
+                assert torch.allclose(flat[p][k], loop[p][k], atol=1e-6)
+
+    # fall back if clients report different states
+    data_list, _ = build_data_list(params, partial=True)
+    assert agg._flat_aggregate(data_list) is None
+    # fall back if clients report tensors in different shapes
+    data_list, _ = build_data_list(params, partial=False)
+    data_list[0][params[0]]['param'] = torch.randn(4)
+    assert agg._flat_aggregate(data_list) is None
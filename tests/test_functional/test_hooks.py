@@ -0,0 +1,306 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-17 00:41:26
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-17 00:41:26
+# Copyright (c) FederalLab. All rights reserved.
+import pytest
+import torch
+
+from openfed.common import empty_address
+from openfed.core import Maintainer
+from openfed.federated import (FederatedProperties, InvalidUpload, aggregator,
+                               collaborator)
+from openfed.functional import (average_aggregation, delta_encoding,
+                                device_alignment, elastic_aggregation,
+                                naive_aggregation, quantization,
+                                sign_gradient_clip, topk_sparsification)
+
+
+def test_quantization():
+    params = [torch.randn(3, 70), torch.randn(5), torch.zeros(7)]
+    for bits, block_size in [(8, 0), (8, 16), (4, 0), (4, 16)]:
+        mt = Maintainer(None, {str(i): p for i, p in enumerate(params)})
+        with mt:
+            quantization(bits, block_size, stochastic=False)
+        package = mt._package_hooks.queue[0][1]
+        unpackage = mt._unpackage_hooks.queue[0][1]
+
+        states = [
+            dict(param=p, momentum_buffer=p * 2, step=torch.tensor(1.0))
+            for p in params
+        ]
+        for state, p in zip(states, params):
+            state = package(state, p)
+            assert 'param' not in state and 'param_q' in state
+            # scalar states are kept as they are
+            assert torch.equal(state['step'], torch.tensor(1.0))
+
+        meta = mt.meta
+        assert meta['dense_bytes'] / meta['wire_bytes'] > 32 / bits / 2
+        assert meta['quantization_error'] < (0.01 if bits == 8 else 0.2)
+
+        for state, p in zip(states, params):
+            state = unpackage(state, p)
+            # half of the largest quantization step
+            step = p.abs().max() / (2**(bits - 1) - 1)
+            assert torch.allclose(
+                state['param'], p, atol=float(step) / 2 + 1e-6)
+            assert state['param'].shape == p.shape
+
+
+def test_stochastic_rounding():
+    p = torch.full((10000, ), 0.3)
+    p[0] = 1.0
+    mt = Maintainer(None, dict(p=p))
+    with mt:
+        quantization(4)
+    package = mt._package_hooks.queue[0][1]
+    unpackage = mt._unpackage_hooks.queue[0][1]
+    state = unpackage(package(dict(param=p), p), p)
+    # unbiased
+    assert abs(state['param'][1:].mean() - 0.3) < 0.01
+
+
+def test_sign_gradient_clip():
+    p = torch.randn(9, 7, requires_grad=True)
+    original = p.detach().clone()
+    local = original + torch.randn(9, 7)
+    for zeros in [False, True]:
+        if zeros:
+            local[0] = original[0]
+        collaborator_mt = build_maintainer(collaborator, dict(w=p),
+                                           sign_gradient_clip, 0.01)
+        aggregator_mt = build_maintainer(aggregator, dict(w=p),
+                                         sign_gradient_clip, 0.01)
+        package = collaborator_mt._package_hooks.queue[0][1]
+        unpackage = aggregator_mt._unpackage_hooks.queue[0][1]
+
+        state = package(dict(param=local, original_param=original), p)
+        assert state['param_sign'].dtype == torch.uint8
+        assert len(state['param_sign']) == 8
+        assert ('param_nonzero' in state) == zeros
+        assert 'original_param' not in state
+
+        state = unpackage(state, p)
+        expected = p - 0.01 * torch.sign(local - original)
+        assert torch.allclose(state['param'], expected)
+
+
+def build_maintainer(role, state_dict, hook, *args):
+    mt = Maintainer(None, state_dict)
+    mt.fed_props = FederatedProperties(role, role, empty_address)
+    with mt:
+        hook(*args)
+    return mt
+
+
+def test_topk_sparsification():
+    torch.manual_seed(0)
+    global_p = torch.randn(20, 10, requires_grad=True)
+    local_p = global_p.detach().clone()
+    collaborator_mt = build_maintainer(collaborator, dict(w=local_p),
+                                       topk_sparsification, 0.1)
+    aggregator_mt = build_maintainer(aggregator, dict(w=global_p),
+                                     topk_sparsification, 0.1)
+    package = collaborator_mt._package_hooks.queue[0][1]
+    download = collaborator_mt._unpackage_hooks.queue[0][1]
+    unpackage = aggregator_mt._unpackage_hooks.queue[0][1]
+
+    download(dict(param=global_p.detach().clone()), local_p)
+    update = torch.randn(20, 10)
+    received = torch.zeros(20, 10)
+    for i in range(10):
+        # upload the update once, and nothing new later
+        local = global_p.detach() + (update if i == 0 else 0)
+        state = package(dict(param=local), local_p)
+        assert 'param' not in state
+        assert state['param_indices'].dtype == torch.int32
+        assert len(state['param_values']) == 20
+
+        state = unpackage(state, global_p)
+        assert state['param'].is_sparse
+        if i == 0:
+            # the largest entries go first
+            sent = state['param'].to_dense() != 0
+            assert update[sent].abs().min() >= update[~sent].abs().max()
+        received += state['param'].to_dense()
+    # the dropped entries are uploaded later by error feedback
+    assert torch.allclose(received, update, atol=1e-6)
+
+
+def test_topk_sparsification_stale():
+    torch.manual_seed(0)
+    global_p = torch.randn(20, 10, requires_grad=True)
+    local_p = global_p.detach().clone()
+    collaborator_mt = build_maintainer(collaborator, dict(w=local_p),
+                                       topk_sparsification, 0.1)
+    aggregator_mt = build_maintainer(aggregator, dict(w=global_p),
+                                     topk_sparsification, 0.1)
+    package = collaborator_mt._package_hooks.queue[0][1]
+    download = collaborator_mt._unpackage_hooks.queue[0][1]
+    unpackage = aggregator_mt._unpackage_hooks.queue[0][1]
+
+    aggregator_mt.package()
+    aggregator_mt.versions.put(aggregator_mt.generation,
+                               aggregator_mt.state_dict)
+    base = global_p.detach().clone()
+    download(dict(param=base.clone()), local_p)
+    collaborator_mt.held_generation = aggregator_mt.generation
+
+    update = torch.randn(20, 10)
+    state = package(dict(param=base + update), local_p)
+    assert state['base_generation'] == aggregator_mt.generation
+    sent = torch.zeros(200, dtype=torch.bool)
+    sent[state['param_indices'].long()] = True
+    expected = base + update * sent.view(20, 10)
+
+    # the global model is updated before the upload is received
+    with torch.no_grad():
+        global_p.add_(1.0)
+    aggregator_mt.update_version()
+    received = unpackage(dict(state), global_p)
+    assert not received['param'].is_sparse
+    assert torch.allclose(received['param'], expected, atol=1e-6)
+    output = average_aggregation([{global_p: received}])
+    assert torch.allclose(output[global_p]['param'], expected, atol=1e-6)
+
+    # the upload is discarded once the stale model is evicted
+    aggregator_mt.versions.clear()
+    with pytest.raises(InvalidUpload, match='is not cached'):
+        unpackage(dict(state), global_p)
+
+
+def test_sparse_aggregation():
+    torch.manual_seed(0)
+    p = torch.randn(20, 10, requires_grad=True)
+    updates = [
+        torch.randn(20, 10) * (torch.rand(20, 10) < 0.1) for _ in range(3)
+    ]
+    meta_list = [dict(instances=i + 1) for i in range(3)]
+    sparse_list = [{p: dict(param=u.to_sparse())} for u in updates]
+    dense_list = [{p: dict(param=p.detach() + u)} for u in updates]
+    for agg_func in [average_aggregation, naive_aggregation]:
+        output = agg_func(sparse_list, meta_list)
+        expected = agg_func(dense_list, meta_list)
+        for k in expected[p]:
+            assert torch.allclose(output[p][k], expected[p][k], atol=1e-6)
+
+
+def test_sparse_elastic_aggregation():
+    p = torch.ones(4, requires_grad=True)
+    update = torch.tensor([0.5, 0, 0, 0])
+    meta_list = [dict(instances=1), dict(instances=1)]
+    sparse_list = [{
+        p: dict(param=update.to_sparse(), importance=torch.ones(4))
+    } for _ in range(2)]
+    dense_list = [{
+        p: dict(param=p.detach() + update, importance=torch.ones(4))
+    } for _ in range(2)]
+
+    output = elastic_aggregation(sparse_list, meta_list)
+    expected = elastic_aggregation(dense_list, meta_list)
+    assert torch.allclose(output[p]['grad'], torch.tensor([-0.25, 0, 0, 0]))
+    assert torch.allclose(output[p]['grad'], expected[p]['grad'])
+
+
+def test_delta_encoding():
+    global_p = torch.randn(5, 4, requires_grad=True)
+    local_p = global_p.detach().clone()
+    collaborator_mt = build_maintainer(collaborator, dict(w=local_p),
+                                       delta_encoding, 1)
+    aggregator_mt = build_maintainer(aggregator, dict(w=global_p),
+                                     delta_encoding, 1)
+    upload = collaborator_mt._package_hooks.queue[0][1]
+    download = collaborator_mt._unpackage_hooks.queue[0][1]
+    serve = aggregator_mt._package_hooks.queue[0][1]
+    receive = aggregator_mt._unpackage_hooks.queue[0][1]
+
+    def train(version):
+        aggregator_mt.update_version(version)
+        generation = aggregator_mt.generation
+        aggregator_mt.versions.put(generation, aggregator_mt.state_dict)
+        state = serve(dict(param=global_p), global_p)
+        assert state['base_generation'] == generation
+        state = download(dict(state), local_p)
+        assert 'base_generation' not in state
+        local = state['param'].detach() + torch.randn(5, 4)
+        state = upload(dict(param=local), local_p)
+        assert 'param' not in state and \
+            state['base_generation'] == generation
+        return local, state
+
+    local, state = train(1)
+    assert torch.allclose(receive(dict(state), global_p)['param'], local)
+
+    # the global model is updated, while the upload is not received
+    with torch.no_grad():
+        global_p.add_(1.0)
+    train(2)
+    with pytest.raises(InvalidUpload, match='is not cached'):
+        receive(dict(state), global_p)
+    # the maintainer discards it
+    with pytest.warns(UserWarning, match='is not cached'):
+        assert not aggregator_mt._unpackage_chunk(dict(w=dict(state)), dict())
+
+
+def test_delta_encoding_stale_version():
+    global_p = torch.randn(5, 4, requires_grad=True)
+    aggregator_mt = build_maintainer(aggregator, dict(w=global_p),
+                                     delta_encoding, 2)
+    serve = aggregator_mt._package_hooks.queue[0][1]
+    receive = aggregator_mt._unpackage_hooks.queue[0][1]
+
+    base = global_p.detach().clone()
+    generations = []
+    for version in [1, 2]:
+        aggregator_mt.update_version(version)
+        generations.append(aggregator_mt.generation)
+        aggregator_mt.versions.put(generations[-1], aggregator_mt.state_dict)
+        serve(dict(param=global_p), global_p)
+        with torch.no_grad():
+            global_p.add_(1.0)
+
+    delta = torch.randn(5, 4)
+    param = receive(
+        dict(param_delta=delta, base_generation=generations[0]),
+        global_p)['param']
+    assert torch.allclose(param, base + delta)
+
+
+def test_delta_encoding_with_quantization():
+    torch.manual_seed(0)
+    global_p = torch.randn(5, 4, requires_grad=True)
+    local_p = global_p.detach().clone()
+    maintainers = []
+    for role, p in [(collaborator, local_p), (aggregator, global_p)]:
+        mt = Maintainer(None, dict(w=p))
+        mt.fed_props = FederatedProperties(role, role, empty_address)
+        with mt:
+            # hooks are applied by nice, not by registration
+            device_alignment()
+            delta_encoding()
+            quantization(8, stochastic=False)
+        maintainers.append(mt)
+    collaborator_mt, aggregator_mt = maintainers
+
+    aggregator_mt.update_version(1)
+    aggregator_mt.package()
+    aggregator_mt.versions.put(aggregator_mt.generation,
+                               aggregator_mt.state_dict)
+    served = aggregator_mt._apply_package_hooks('w', global_p)
+    assert 'param_q' in served and \
+        served['base_generation'] == aggregator_mt.generation
+
+    downloaded = dict()
+    collaborator_mt._unpackage_chunk(dict(w=served), downloaded)
+    with torch.no_grad():
+        local_p.copy_(downloaded['w']['param'] + 0.01 * torch.randn(5, 4))
+    collaborator_mt.package()
+    uploaded = collaborator_mt._apply_package_hooks('w', local_p)
+    assert 'param_delta_q' in uploaded and 'param_delta' not in uploaded
+
+    received = dict()
+    aggregator_mt._unpackage_chunk(dict(w=uploaded), received)
+    # the base downloaded by collaborator is quantized
+    step = float(global_p.abs().max()) / 127
+    assert torch.allclose(received['w']['param'], local_p, atol=step)
@@ -0,0 +1,133 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 23:46:12
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 23:46:12
+# Copyright (c) FederalLab. All rights reserved.
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+from torch.distributed import HashStore
+
+from openfed.functional import (MaskAccumulator, PairwiseMask,
+                                mask_aggregation, unmask)
+from openfed.functional.mask import (derive_seed, from_fixed, prg,
+                                     recover_secret, share_secret)
+
+
+def build_masks(store, ranks):
+    # each collaborator blocks until all public values are published
+    with ThreadPoolExecutor(len(ranks)) as executor:
+        return list(
+            executor.map(lambda rank: PairwiseMask(store, rank, ranks), ranks))
+
+
+def masked_upload(pairwise_mask, params, values, version):
+    data = dict()
+    for index, (p, v) in enumerate(zip(params, values)):
+        data[p] = dict(
+            param_masked=pairwise_mask.mask(v, version, (index, 'param')),
+            mask_info=[
+                pairwise_mask.rank, pairwise_mask.ranks, version, index
+            ])
+    return data
+
+
+def masked_uploads(masks, params, plaintexts, version):
+    # masking a new round blocks until all collaborators have prepared it
+    with ThreadPoolExecutor(len(masks)) as executor:
+        list(executor.map(lambda m: m.prepare(version), masks))
+    return [
+        masked_upload(m, params, values, version)
+        for m, values in zip(masks, plaintexts)
+    ]
+
+
+def test_pairwise_mask():
+    store = HashStore()
+    ranks = [1, 2, 3]
+    masks = build_masks(store, ranks)
+    params = [torch.randn(3, 70), torch.randn(5)]
+    plaintexts = [[torch.randn_like(p) for p in params] for _ in ranks]
+
+    data_list = masked_uploads(masks, params, plaintexts, 0)
+    # masked data is as large as the plaintext
+    assert data_list[0][params[0]]['param_masked'].dtype == torch.int32
+    assert data_list[0][params[0]]['param_masked'].shape == params[0].shape
+    assert not torch.allclose(data_list[0][params[0]]['param_masked'].float(),
+                              plaintexts[0][0] * 2**16)
+
+    output = mask_aggregation(data_list, store=store)
+    for i, p in enumerate(params):
+        expected = sum(v[i] for v in plaintexts) / 3
+        assert torch.allclose(output[p]['param'], expected, atol=1e-4)
+
+    # collaborator 3 drops in round 1
+    plaintexts = [[torch.randn_like(p) for p in params] for _ in ranks]
+    data_list = masked_uploads(masks, params, plaintexts, 1)
+    accumulator = MaskAccumulator(store)
+    for data in data_list[:2]:
+        accumulator.add(data)
+    output = accumulator()
+    for i, p in enumerate(params):
+        expected = (plaintexts[0][i] + plaintexts[1][i]) / 2
+        assert torch.allclose(output[p]['param'], expected, atol=1e-4)
+
+    # the late upload is discarded
+    accumulator.clear()
+    with pytest.warns(UserWarning):
+        assert accumulator.add(data_list[2]) is False
+    assert len(accumulator.masked) == 0
+
+    # uploads of another round are discarded
+    upload = masked_uploads(masks, params, plaintexts, 2)[0]
+    assert accumulator.add(upload) is True
+    with pytest.warns(UserWarning):
+        assert accumulator.add(data_list[0]) is False
+    assert accumulator.reporters[params[0]] == [1]
+
+    for m in masks:
+        m.close()
+
+
+def test_prg():
+    seed = derive_seed(2021, 0)
+    mask = prg(seed, 1001)
+    assert mask.dtype == torch.int32 and mask.shape == (1001, )
+    assert torch.equal(mask, prg(seed, 1001))
+    # a prefix of the longer stream
+    assert torch.equal(mask[:10], prg(seed, 10))
+    assert not torch.equal(mask, prg(derive_seed(2021, 1), 1001))
+    assert prg(seed, 0).numel() == 0
+
+
+def test_unmask_reporter():
+    store = HashStore()
+    ranks = [1, 2, 3]
+    masks = build_masks(store, ranks)
+    params = [torch.randn(100)]
+    plaintexts = [[torch.randn_like(p) for p in params] for _ in ranks]
+    data_list = masked_uploads(masks, params, plaintexts, 0)
+
+    # The aggregator has received the upload of collaborator 1, and claims
+    # it dropped to recover its pairwise masks.
+    self_seeds, seeds = unmask(store, 0, ranks, [2, 3])
+    assert 1 not in self_seeds
+    v = data_list[0][params[0]]['param_masked'].long()
+    for rank, peers in seeds.items():
+        mask = prg(derive_seed(peers[1], (0, 'param')), v.numel())
+        v = v.sub(mask) if 1 < rank else v.add(mask)
+    # The self-mask still hides the upload.
+    assert not torch.allclose(
+        from_fixed(v, 16, 1), plaintexts[0][0], atol=1e-2)
+
+    for m in masks:
+        m.close()
+
+
+def test_secret_sharing():
+    secret = 2021
+    shares = share_secret(secret, [1, 2, 3, 4, 5], 3)
+    assert recover_secret({x: shares[x] for x in [1, 3, 5]}) == secret
+    assert recover_secret({x: shares[x] for x in [2, 3, 4, 5]}) == secret
+    assert recover_secret({x: shares[x] for x in [1, 2]}) != secret
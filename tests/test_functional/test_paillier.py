@@ -0,0 +1,237 @@
+# @Author            : FederalLab
+# @Date              : 2026-10-16 20:12:40
+# @Last Modified by  : Chen Dengsheng
+# @Last Modified time: 2026-10-16 20:12:40
+# Copyright (c) FederalLab. All rights reserved.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from openfed.functional import (Ciphertext, NoisePool, PaillierAccumulator,
+                                PrivateKey, PublicKey, compact_ciphertext,
+                                expand_ciphertext, float_to_long, key_gen,
+                                long_to_float, paillier_aggregation,
+                                paillier_dec, paillier_enc)
+from openfed.functional.paillier import (_decrypt, _encrypt_states,
+                                         _thread_pool,
+                                         get_seeded_uniform_random_matrix)
+
+
+def encrypt_and_decrypt(public_key, private_key):
+    x = [torch.randn(100) for _ in range(3)]
+    c = [paillier_enc(public_key, float_to_long(public_key, v)) for v in x]
+    y = long_to_float(private_key, paillier_dec(private_key,
+                                                c[0] + c[1] + c[2]), 3)
+    assert torch.allclose(sum(x) / 3, y[:100], atol=1e-5)
+
+
+def test_seeded_public_key(tmp_path):
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+
+    # only the seed is saved
+    public_key.save(tmp_path / 'public.key')
+    assert torch.load(tmp_path / 'public.key')['A'] is None
+    public_key = PublicKey.load(tmp_path / 'public.key')
+
+    encrypt_and_decrypt(public_key, private_key)
+
+    # blocks are the same as the full matrix
+    A = public_key.A
+    for start, block in PublicKey(
+            None, None, 300, 32, 64, 8, seed=2021).A_blocks(rows=64):
+        assert torch.equal(block, A[start:start + len(block)])
+
+    # the full matrix is not kept
+    assert public_key._A is None
+    x = torch.randint(-8, 8, (300, ))
+    assert torch.equal(public_key.matmul_A(x, rows=64), torch.matmul(x, A))
+    assert public_key._A is None
+
+
+def test_dense_public_key(tmp_path):
+    # keys with materialized A, saved by older versions
+    public_key, private_key = key_gen(n_lwe=300)
+    state = public_key.state_dict()
+    state['A'], state['seed'] = public_key.A, None
+    torch.save(state, tmp_path / 'public.key')
+
+    public_key = PublicKey.load(tmp_path / 'public.key')
+    assert public_key.seed is None
+    encrypt_and_decrypt(public_key, private_key)
+
+
+def test_seeded_uniform_random_matrix():
+    q = 2**32
+    A = get_seeded_uniform_random_matrix(7, 10, 20, q)
+    assert A.shape == (10, 20)
+    assert A.min() >= -q // 2 + 1 and A.max() < q // 2
+    assert torch.equal(A[4:], get_seeded_uniform_random_matrix(7, 6, 20, q, 4))
+    assert not torch.equal(A, get_seeded_uniform_random_matrix(8, 10, 20, q))
+
+
+def test_batched_encryption():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    params = [torch.randn(3, 70), torch.randn(5)]
+    plaintexts = [[torch.randn_like(p) for p in params] for _ in range(2)]
+
+    data_list = []
+    for values in plaintexts:
+        states = [dict(param=v, momentum_buffer=None) for v in values]
+        _encrypt_states(public_key, states)
+        # c1 is shared by all tensors
+        assert states[0]['param_c1'] is states[1]['param_c1']
+        assert 'momentum_buffer' not in states[0]
+        data_list.append(dict(zip(params, states)))
+
+    output = paillier_aggregation(data_list, private_key=private_key)
+    for i, p in enumerate(params):
+        expected = (plaintexts[0][i] + plaintexts[1][i]) / 2
+        assert torch.allclose(output[p]['param'], expected, atol=1e-4)
+
+    # fold ciphertexts as they arrive
+    accumulator = PaillierAccumulator(private_key)
+    for data in data_list:
+        accumulator.add(data)
+    streamed = accumulator()
+    for p in params:
+        assert torch.equal(streamed[p]['param'], output[p]['param'])
+
+
+def test_compact_ciphertext():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    x = [torch.randn(1000) for _ in range(2)]
+    c = [paillier_enc(public_key, float_to_long(public_key, v)) for v in x]
+    compact = [
+        Ciphertext(
+            compact_ciphertext(public_key, v.c1),
+            compact_ciphertext(public_key, v.c2), public_key.p) for v in c
+    ]
+    assert compact[0].c1.dtype == torch.int32
+    assert torch.equal(
+        expand_ciphertext(compact[0].c2), c[0].c2 % public_key.p)
+
+    # homomorphic addition wraps around p
+    expected = paillier_dec(private_key, c[0] + c[1])
+    output = paillier_dec(private_key, compact[0] + compact[1])
+    assert torch.equal(expected, output)
+    assert (compact[0] + compact[1]).c2.max() < public_key.p
+
+
+def test_key_cache(tmp_path):
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    private_key.save(tmp_path / 'private.key')
+
+    loaded = PrivateKey.load(tmp_path / 'private.key')
+    assert PrivateKey.load(str(tmp_path / 'private.key')) is loaded
+
+    # reload modified file
+    private_key.save(tmp_path / 'private.key')
+    stat = os.stat(tmp_path / 'private.key')
+    os.utime(tmp_path / 'private.key', (stat.st_atime, stat.st_mtime + 1))
+    assert PrivateKey.load(tmp_path / 'private.key') is not loaded
+
+    m = torch.zeros(1, dtype=torch.int32)
+    P = public_key.aligned('P', m)
+    assert P.dtype == torch.int32
+    assert public_key.aligned('P', m) is P
+    # replaced matrix is aligned again
+    public_key.P = public_key.P.clone()
+    assert torch.equal(public_key.aligned('P', m), public_key.P.int())
+
+
+def test_noise_pool():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    pool = NoisePool(public_key, size=2)
+
+    x = [torch.randn(100) for _ in range(3)]
+    noise = [pool.get() for _ in x]
+    # each noise is fresh
+    assert not torch.equal(noise[0][0], noise[1][0])
+
+    c = [
+        paillier_enc(public_key, float_to_long(public_key, v), n)
+        for v, n in zip(x, noise)
+    ]
+    y = long_to_float(private_key, paillier_dec(private_key,
+                                                c[0] + c[1] + c[2]), 3)
+    assert torch.allclose(sum(x) / 3, y[:100], atol=1e-5)
+
+    states = [dict(param=torch.randn(10)), dict(param=torch.randn(20))]
+    expected = [s['param'].clone() for s in states]
+    _encrypt_states(public_key, states, pool)
+    for s, e in zip(states, expected):
+        c = Ciphertext(s['param_c1'], s['param_c2'])
+        y = long_to_float(private_key, paillier_dec(private_key, c), 1)
+        assert torch.allclose(e, y[:len(e)], atol=1e-5)
+    pool.close()
+
+
+def test_packed_encryption():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    params = [torch.randn(3, 70), torch.randn(5)]
+    plaintexts = [[torch.rand_like(p) * 2 - 1 for p in params]
+                  for _ in range(4)]
+
+    # 4 values of 6 bits with 2 bits headroom per slot
+    m = float_to_long(public_key, plaintexts[0][0], pack_bits=6, headroom=2)
+    assert len(m) == 210 // 4 + 1
+
+    data_list = []
+    for values in plaintexts:
+        states = [dict(param=v) for v in values]
+        _encrypt_states(public_key, states, pack_bits=6, headroom=2)
+        # the ciphertext shrinks by the packing factor
+        assert states[0]['param_c2'].numel() == 64
+        data_list.append(dict(zip(params, states)))
+
+    output = paillier_aggregation(
+        data_list, private_key=private_key, pack_bits=6, headroom=2)
+    # half of the quantization step
+    atol = public_key.bound / (2**6 - 1) + 1e-5
+    for i, p in enumerate(params):
+        expected = sum(v[i] for v in plaintexts) / 4
+        assert torch.allclose(output[p]['param'], expected, atol=atol)
+
+    # more ciphertexts than headroom
+    with pytest.raises(AssertionError):
+        paillier_aggregation(
+            data_list * 2, private_key=private_key, pack_bits=6, headroom=2)
+
+
+def test_chunked_encryption():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    values = [torch.randn(3, 70), torch.randn(500)]
+
+    torch.manual_seed(0)
+    states = [dict(param=v) for v in values]
+    _encrypt_states(public_key, states)
+
+    # the same noise
+    torch.manual_seed(0)
+    chunked = [dict(param=v) for v in values]
+    with ThreadPoolExecutor(3) as executor:
+        _encrypt_states(public_key, chunked, chunk_size=100, executor=executor)
+        for state, c, v in zip(states, chunked, values):
+            assert torch.equal(state['param_c2'], c['param_c2'])
+
+            y = _decrypt(
+                private_key,
+                c['param_c1'],
+                c['param_c2'],
+                1,
+                chunk_size=100,
+                executor=executor)
+            assert torch.allclose(y[:v.numel()], v.view(-1), atol=1e-5)
+
+
+def test_shared_thread_pool():
+    public_key, private_key = key_gen(n_lwe=300, seed=2021)
+    assert _thread_pool(0) is None
+    # accumulators built in each round share the pool
+    accumulators = [
+        PaillierAccumulator(private_key, num_threads=2) for _ in range(3)
+    ]
+    assert all(a.executor is _thread_pool(2) for a in accumulators)
+    assert _thread_pool(3) is not _thread_pool(2)